@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#################################################################
+# FILE:  benchmark.py
+#
+# DESCRIPTION:    This script benchmarks the get, export, delete and cleanup old pipelines scripts offline,
+#                 against a synthetic Control Hub tenant instead of a real one. Each script is run in its own
+#                 process with the StreamSets SDK replaced by the fake in pipeline_cleanup/fakehub.py, and the
+#                 wall time, Control Hub calls by endpoint and peak memory of each run are reported.
+#
+#                 No Control Hub credentials are needed, and nothing outside the work directory is touched.
+#
+# ARGS:           - --pipelines, --commits, --jobs - (Optional) The number of pipelines, published versions per
+#                                  pipeline and Jobs in the synthetic tenant.
+#
+#                 - --latency-ms, --error-rate - (Optional) The latency added to every Control Hub call, and the
+#                                  fraction of calls that fail with a retryable 503 error.
+#
+#                 - --flows      - (Optional) A comma separated list of the flows to run, from get, export, delete
+#                                  and cleanup. Defaults to get,export,delete.
+#
+#                 - --get-args, --export-args, --delete-args, --cleanup-args - (Optional) Extra arguments for each
+#                                  script, for example --export-args="--workers 8 --export-batch-size 50"
+#
+#                 - --output     - (Optional) A file to write the results to as JSON, to compare runs.
+#
+# USAGE:          $ python3 benchmark.py [options]
+#
+# USAGE EXAMPLE:  $ python3 benchmark.py --pipelines 10000 --jobs 2000 --latency-ms 20 --export-args="--workers 8"
+#
+# PREREQUISITES:
+#
+#  - Python 3.9+ on Linux or macOS
+#
+#################################################################
+
+import os, sys, json, argparse, shlex, shutil, subprocess, tempfile, time
+from datetime import date, timedelta
+from pipeline_cleanup.fakehub import DEFAULT_CONFIG
+
+# The directory of the scripts, and of the shim that replaces the SDK
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_SDK_DIR = os.path.join(SCRIPT_DIR, 'fake_sdk')
+
+FLOWS = ['get', 'export', 'delete', 'cleanup']
+
+# Method that returns the command line for a flow
+def build_command(the_flow, the_work_dir, the_threshold):
+    old_pipelines_file = os.path.join(the_work_dir, 'old_pipelines.json')
+    metrics_file = os.path.join(the_work_dir, the_flow + '-metrics.json')
+    if the_flow == 'get':
+        command = ['get-old-pipelines.py', the_threshold, old_pipelines_file]
+    elif the_flow == 'export':
+        command = ['export-old-pipelines.py', old_pipelines_file, os.path.join(the_work_dir, 'export')]
+    elif the_flow == 'delete':
+        command = ['delete-old-pipelines.py', old_pipelines_file]
+    else:
+        command = ['cleanup-old-pipelines.py', the_threshold, os.path.join(the_work_dir, 'cleanup')]
+    extra_args = shlex.split(getattr(args, the_flow + '_args') or '')
+    return [sys.executable, os.path.join(SCRIPT_DIR, command[0])] + command[1:] + extra_args + ['--metrics', metrics_file]
+
+# Method that runs one flow in a child process and returns its results: the exit code, wall time,
+# peak resident memory, and the Control Hub calls counted by the fake
+def run_flow(the_flow, the_work_dir, the_threshold, the_tenant):
+    stats_file = os.path.join(the_work_dir, the_flow + '-calls.json')
+    log_file = os.path.join(the_work_dir, the_flow + '.log')
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join([FAKE_SDK_DIR, SCRIPT_DIR, os.getenv('PYTHONPATH', '')]),
+               FAKE_CONTROL_HUB=json.dumps(the_tenant),
+               FAKE_CONTROL_HUB_STATS=stats_file,
+               CRED_ID='benchmark', CRED_TOKEN='benchmark')
+    with open(log_file, 'w') as log:
+        started_at = time.monotonic()
+        process = subprocess.Popen(build_command(the_flow, the_work_dir, the_threshold), stdout=log,
+                                   stderr=subprocess.STDOUT, env=env, cwd=SCRIPT_DIR)
+        # wait4 returns the resource usage of this child alone
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_seconds = time.monotonic() - started_at
+    exit_code = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status >> 8
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_kb = usage.ru_maxrss / 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    calls = {}
+    if os.path.isfile(stats_file):
+        with open(stats_file) as f:
+            calls = json.load(f)['calls']
+    return {'exit_code': exit_code,
+            'wall_seconds': round(wall_seconds, 3),
+            'peak_memory_mb': round(peak_kb / 1024, 1),
+            'calls': calls,
+            'log': log_file}
+
+# Method that prints a flow's results
+def print_result(the_flow, the_result):
+    print(f"{the_flow}: {the_result['wall_seconds']:.2f} seconds, peak memory {the_result['peak_memory_mb']} MB, "
+          f"exit code {the_result['exit_code']}")
+    for endpoint, n in sorted(the_result['calls'].items()):
+        print(f"- {endpoint}: {n}")
+    if the_result['exit_code'] != 0:
+        print(f"Warning: the {the_flow} script failed; see the log '{the_result['log']}'")
+    print("---------------------------------")
+
+#####################################
+# Main Program
+#####################################
+
+# Parse the command line args
+parser = argparse.ArgumentParser(prog='benchmark.py',
+                                 epilog='Usage Example: $ python3 benchmark.py --pipelines 10000 --jobs 2000 --latency-ms 20')
+parser.add_argument('--pipelines', type=int, default=DEFAULT_CONFIG['pipelines'],
+                    help=f"The number of pipelines in the synthetic tenant (default: {DEFAULT_CONFIG['pipelines']})")
+parser.add_argument('--commits', type=int, default=DEFAULT_CONFIG['commits'],
+                    help=f"The number of published versions of each pipeline (default: {DEFAULT_CONFIG['commits']})")
+parser.add_argument('--jobs', type=int, default=DEFAULT_CONFIG['jobs'],
+                    help=f"The number of Jobs (default: {DEFAULT_CONFIG['jobs']})")
+parser.add_argument('--draft-rate', type=float, default=DEFAULT_CONFIG['draft_rate'],
+                    help=f"The fraction of pipelines whose latest version is a draft (default: {DEFAULT_CONFIG['draft_rate']})")
+parser.add_argument('--pipeline-kb', type=int, default=DEFAULT_CONFIG['pipeline_kb'],
+                    help=f"The approximate size of each exported pipeline (default: {DEFAULT_CONFIG['pipeline_kb']})")
+parser.add_argument('--latency-ms', type=float, default=DEFAULT_CONFIG['latency_ms'],
+                    help='The latency added to every Control Hub call (default: 0)')
+parser.add_argument('--error-rate', type=float, default=DEFAULT_CONFIG['error_rate'],
+                    help='The fraction of Control Hub calls that fail with a retryable 503 error (default: 0)')
+parser.add_argument('--seed', type=int, default=DEFAULT_CONFIG['seed'],
+                    help='The random seed used to generate the tenant (default: 1)')
+parser.add_argument('--threshold-days', type=int, default=365,
+                    help='Pipelines last modified more than this many days ago are old (default: 365)')
+parser.add_argument('--flows', default='get,export,delete',
+                    help='A comma separated list of the flows to run, from get, export, delete and cleanup '
+                         '(default: get,export,delete)')
+for flow in FLOWS:
+    parser.add_argument(f'--{flow}-args', default=None, help=f'Extra arguments for the {flow} script')
+parser.add_argument('--work-dir', default=None,
+                    help='The directory to write the scripts\' output to (default: a temporary directory that is '
+                         'removed afterwards)')
+parser.add_argument('--output', default=None, help='A file to write the results to as JSON')
+args = parser.parse_args()
+
+flows = [flow.strip() for flow in args.flows.split(',') if flow.strip()]
+for flow in flows:
+    if flow not in FLOWS:
+        parser.error(f"Unknown flow '{flow}'; choose from {', '.join(FLOWS)}")
+if ('export' in flows or 'delete' in flows) and 'get' not in flows:
+    parser.error('The export and delete flows read the list of pipelines written by the get flow')
+
+tenant = dict(DEFAULT_CONFIG, pipelines=args.pipelines, commits=args.commits, jobs=args.jobs,
+              draft_rate=args.draft_rate, pipeline_kb=args.pipeline_kb, latency_ms=args.latency_ms,
+              error_rate=args.error_rate, seed=args.seed)
+threshold = (date.today() - timedelta(days=args.threshold_days)).strftime('%Y-%m-%d')
+
+work_dir = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix='pipeline-cleanup-benchmark-')
+os.makedirs(work_dir, exist_ok=True)
+
+print("---------------------------------")
+print(f"Synthetic tenant: {args.pipelines} pipelines with {args.commits} versions each, {args.jobs} Jobs")
+print(f"Latency per call: {args.latency_ms} ms, error rate: {args.error_rate}")
+print(f"Last Modification Date Threshold: '{threshold}'")
+print(f"Work directory: '{work_dir}'")
+print("---------------------------------")
+
+# Each flow starts from the same freshly generated tenant, so the delete flow finds the pipelines that
+# the get flow listed even though they are generated again in its own process
+results = {}
+for flow in flows:
+    results[flow] = run_flow(flow, work_dir, threshold, tenant)
+    print_result(flow, results[flow])
+
+if args.output is not None:
+    with open(args.output, 'w') as f:
+        json.dump({'tenant': tenant, 'threshold': threshold, 'results': results}, f, indent=2)
+    print(f"Wrote the results to '{args.output}'")
+
+# Keep the work directory if a script failed, so its log can be read
+if args.work_dir is None and all(result['exit_code'] == 0 for result in results.values()):
+    shutil.rmtree(work_dir)
+
+print('Done')
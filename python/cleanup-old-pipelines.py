@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+#################################################################
+# FILE:  cleanup-old-pipelines.py
+#
+# DESCRIPTION:    This script finds, exports and deletes the pipelines that are not associated with any Jobs and
+#                 that have not been modified since before a user-defined last_modification_date_threshold
+#                 parameter, in a single pass. It does the work of get-old-pipelines.py, export-old-pipelines.py
+#                 and delete-old-pipelines.py without writing or re-reading a list of pipelines in between.
+#
+#                 The three steps run as a pipeline: once the pipelines have been listed, pipelines are exported as
+#                 soon as they are found, and each pipeline is deleted as soon as its export has been written to
+#                 disk. A pipeline is never deleted unless its export was written successfully.
+#
+# ARGS:           - last_modification_date_threshold - A String in the form yyyy-mm-dd
+#
+#                 - export_dir - The directory to write the exported pipelines to.
+#                                The directory will be created if it does not exist.
+#                                If the directory does exist, it must be empty
+#
+#                 - --name, --name-regex, --label, --creator, --engine-type, --drafts-only, --published-only,
+#                   --filter-locally - (Optional) Filters, as for get-old-pipelines.py
+#
+#                 - --store      - (Optional) Unpack the exports into a deduplicated, content-addressed store in
+#                                  the export_dir instead of writing zip files, as for export-old-pipelines.py
+#
+#                 - --workers    - (Optional) The number of exports, and separately deletes, to run concurrently.
+#                                  Defaults to 1.
+#
+#                 - --rate, --max-retries - (Optional) Rate limit and retry settings, as for delete-old-pipelines.py
+#
+#                 - --cache, --cache-ttl, --scan-shards - (Optional) As for get-old-pipelines.py
+#
+#                 - --resume     - (Optional) Continue a previous run into the same export_dir, skipping the
+#                                  pipelines its cleanup-journal.json records as deleted or not exportable.
+#
+#                 - --dry-run    - (Optional) Check the arguments and the export_dir without connecting to Control
+#                                  Hub or creating the export_dir. With --cache, list the pipelines in the cache
+#                                  that would be exported and deleted, and those skipped because they are still
+#                                  associated with Jobs.
+#
+#                 - --metrics, --prometheus - (Optional) Files to write API call counts, latencies and per-phase
+#                                  timings to, as JSON and in the Prometheus text format.
+#
+# USAGE:          $ python3 cleanup-old-pipelines.py <last_modification_date_threshold> <export_dir> [options]
+#
+# USAGE EXAMPLE:  $ python3 cleanup-old-pipelines.py 2024-06-30 /Users/mark/pipelines-export
+#
+# PREREQUISITES:
+#
+#  - Python 3.9+
+#
+# - StreamSets Platform SDK for Python v6.6+
+#   See: https://docs.streamsets.com/platform-sdk/latest/welcome/installation.html
+#
+# - StreamSets Platform API Credentials for a user with Organization Administrator role
+#
+# - Before running the script, export the environment variables CRED_ID and CRED_TOKEN
+#  with the StreamSets Platform API Credentials, like this:
+#
+#    $ export CRED_ID="40af8..."
+#    $ export CRED_TOKEN="eyJ0..."
+#
+#################################################################
+
+import os,sys,argparse,threading
+from pipeline_cleanup import metrics
+from pipeline_cleanup.archives import get_pipeline_archive_name, write_file_atomically
+from pipeline_cleanup.associations import JobAssociationIndex
+from pipeline_cleanup.cache import DEFAULT_TTL_HOURS, MetadataCache
+from pipeline_cleanup.concurrency import TokenBucket, call_with_retry, map_in_order
+from pipeline_cleanup.connection import connect_to_control_hub, validate_credentials
+from pipeline_cleanup.dates import millis_to_datetime_string, convert_datetime_string_to_millis, is_valid_date, \
+    date_is_at_least_one_day_old
+from pipeline_cleanup.exports import get_exportable_pipeline, export_pipelines
+from pipeline_cleanup.filters import add_filter_arguments, PipelineFilter
+from pipeline_cleanup.journal import Journal, load_journal, get_finished_pipeline_ids
+from pipeline_cleanup.preview import preview_old_pipelines, validate_cache_file_parameter
+from pipeline_cleanup.scan import ShardedScan, list_all
+from pipeline_cleanup.parameters import validate_export_dir_parameter
+from pipeline_cleanup.store import ExportStore
+
+# The journal of each pipeline's outcome, written to the export_dir
+CLEANUP_JOURNAL_FILE_NAME = 'cleanup-journal.json'
+
+# Outcomes in the journal that mean a pipeline is skipped when a run is resumed. A pipeline that was
+# exported but not deleted is exported again, so that it is only deleted once its export is on disk
+CLEANUP_FINISHED_STATUSES = {'deleted', 'not_exportable'}
+
+# Method that yields a tuple of (pipeline_info, pipeline) for each old pipeline that is not associated
+# with any Job, one at a time as the export stage asks for more. Pipelines that a resumed run's journal
+# records as finished are skipped
+def find_old_pipelines(the_pipelines):
+    global old_pipelines_used_by_jobs_count, resumed_pipelines_count
+    for pipeline in the_pipelines:
+        if pipeline_filter.matches(pipeline):
+            if pipeline.pipeline_id in finished_pipeline_ids:
+                resumed_pipelines_count += 1
+                continue
+            pipeline_info = {'pipeline_name': pipeline.name,
+                             'pipeline_id': pipeline.pipeline_id,
+                             'last_modified': millis_to_datetime_string(pipeline.last_modified_on),
+                             'version': pipeline.version,
+                             'is_draft': pipeline.draft}
+            if len(job_index.get_jobs_for_pipeline(pipeline)) == 0:
+                yield pipeline_info, pipeline
+            else:
+                old_pipelines_used_by_jobs_count += 1
+
+# Method that exports the most recent published version of a pipeline to its own zip file in the export_dir,
+# or into the store. The file name includes the pipeline ID so that pipelines with the same name never overwrite each other's
+# export. Returns a tuple of (the buffered messages, the outcome: 'exported', 'not_exportable' or 'failed')
+def export_stage(the_item):
+    pipeline_info, pipeline = the_item
+    messages = [f"Pipeline \'{pipeline_info['pipeline_name']}\' with ID \'{pipeline_info['pipeline_id']}\' "
+                f"was last modified on \'{pipeline_info['last_modified']}\'"]
+    global published_version_lookups
+    try:
+        # A draft's versions are read to find its most recent published version
+        if pipeline.draft:
+            with lookups_lock:
+                published_version_lookups += 1
+        exportable_pipeline = get_exportable_pipeline(sch, pipeline_info, pipeline, cache=cache, rate_limiter=rate_limiter,
+                                                      max_retries=max_retries, log=messages.append)
+        if exportable_pipeline is None:
+            journal.record(pipeline_info['pipeline_id'], 'not_exportable')
+            return messages, 'not_exportable'
+
+        # Every file in the store is fsynced before its manifest is written, and the manifest before it returns
+        if store is not None:
+            messages.append(f"Exporting version \'{exportable_pipeline.version}\' into the store \'{export_dir}\'")
+            data = export_pipelines(sch, [exportable_pipeline], rate_limiter=rate_limiter, max_retries=max_retries)
+            store.add_archive(data, [exportable_pipeline])
+            metrics.count('find_export_delete', byte_count=len(data))
+            journal.record(pipeline_info['pipeline_id'], 'exported', version=exportable_pipeline.version,
+                           manifest=store.get_manifest_name(exportable_pipeline.pipeline_id))
+            return messages, 'exported'
+
+        file_name = get_pipeline_archive_name(exportable_pipeline.name, pipeline_info['pipeline_id'])
+        export_file_name = export_dir + '/' + file_name
+        messages.append(f"Exporting version \'{exportable_pipeline.version}\' into the file \'{export_file_name}\'")
+
+        # The file is fsynced before it replaces the partial file, so it is on disk before the pipeline is deleted
+        data = export_pipelines(sch, [exportable_pipeline], rate_limiter=rate_limiter, max_retries=max_retries)
+        write_file_atomically(export_file_name, data)
+        metrics.count('find_export_delete', byte_count=len(data))
+        journal.record(pipeline_info['pipeline_id'], 'exported', version=exportable_pipeline.version, file=file_name)
+        return messages, 'exported'
+
+    except Exception as e:
+        journal.record(pipeline_info['pipeline_id'], 'failed', error=str(e))
+        messages.append(f"Error exporting pipeline \'{pipeline_info['pipeline_name']}\': {e}")
+        return messages, 'failed'
+
+# Method that deletes a pipeline whose export has been written. Pipelines that were not exported are
+# left in Control Hub. Returns a tuple of (the buffered messages, the outcome)
+def delete_stage(the_exported_item):
+    (pipeline_info, pipeline), (messages, outcome) = the_exported_item
+    if outcome != 'exported':
+        messages.append(f"Warning: Pipeline \'{pipeline_info['pipeline_name']}\' was not exported, so it was not deleted")
+        return messages, outcome
+    try:
+        call_with_retry(sch.delete_pipeline, pipeline, endpoint='delete_pipeline',
+                        rate_limiter=rate_limiter, max_retries=max_retries)
+        journal.record(pipeline_info['pipeline_id'], 'deleted')
+        if cache is not None:
+            cache.remove_pipeline(pipeline_info['pipeline_id'])
+        messages.append('- Pipeline was deleted.')
+        return messages, 'deleted'
+    except Exception as ex:
+        journal.record(pipeline_info['pipeline_id'], 'delete_failed', error=str(ex))
+        messages.append(f"Error: Attempt to delete pipeline \'{pipeline_info['pipeline_name']}\' with ID \'{pipeline_info['pipeline_id']}\' failed; {ex}")
+        return messages, 'delete_failed'
+
+#####################################
+# Main Program
+#####################################
+
+# Get CRED_ID from the environment
+CRED_ID = os.getenv('CRED_ID')
+
+# Get CRED_TOKEN from the environment
+CRED_TOKEN = os.getenv('CRED_TOKEN')
+
+# Parse the command line args
+parser = argparse.ArgumentParser(prog='cleanup-old-pipelines.py',
+                                 epilog='Usage Example: $ python3 cleanup-old-pipelines.py 2024-06-30 /Users/mark/pipelines-export')
+parser.add_argument('last_modification_date_threshold', help='A String in the form yyyy-mm-dd')
+parser.add_argument('export_dir', help='The directory to write the exported pipelines to')
+add_filter_arguments(parser)
+parser.add_argument('--store', action='store_true',
+                    help='Unpack the exports into a deduplicated, content-addressed store in the export_dir instead '
+                         'of writing zip files. The export_dir may already hold a store from a previous run')
+parser.add_argument('--workers', type=int, default=1,
+                    help='The number of exports, and separately deletes, to run concurrently (default: 1)')
+parser.add_argument('--rate', type=float, default=0,
+                    help='The maximum number of Control Hub API calls per second across all workers (default: no limit)')
+parser.add_argument('--max-retries', type=int, default=5,
+                    help='The number of times to retry a call that was throttled or failed with a server error (default: 5)')
+parser.add_argument('--cache', dest='cache_file', default=None,
+                    help='A local SQLite file to cache pipeline and Job metadata in. Later runs only fetch '
+                         'what has changed since the previous run')
+parser.add_argument('--cache-ttl', type=float, default=DEFAULT_TTL_HOURS,
+                    help=f'The number of hours after which the cache is fully refreshed (default: {DEFAULT_TTL_HOURS})')
+parser.add_argument('--scan-shards', type=int, default=1,
+                    help='Split the pipeline and Job listings into this many shards by last modified date and fetch '
+                         'them concurrently (default: 1, a single serial listing)')
+parser.add_argument('--resume', action='store_true',
+                    help='Continue a previous run into the same, non-empty export_dir')
+parser.add_argument('--dry-run', action='store_true',
+                    help='Check the arguments and the export_dir and, with --cache, list the pipelines in the cache '
+                         'that would be exported and deleted, without connecting to Control Hub')
+metrics.add_metrics_arguments(parser)
+args = parser.parse_args()
+if args.workers < 1:
+    parser.error('--workers must be at least 1')
+if args.scan_shards < 1:
+    parser.error('--scan-shards must be at least 1')
+
+# Validate the last_modification_date_threshold parameter
+last_modification_date_threshold = args.last_modification_date_threshold
+last_modification_date_threshold_millis = None
+if is_valid_date(last_modification_date_threshold) and date_is_at_least_one_day_old(last_modification_date_threshold):
+    last_modification_date_threshold_millis = convert_datetime_string_to_millis(last_modification_date_threshold)
+if last_modification_date_threshold_millis is None:
+    sys.exit(1)
+
+# The threshold and the optional filters
+pipeline_filter = PipelineFilter.from_args(last_modification_date_threshold_millis, args)
+
+# The search query that narrows the pipeline listing, unless the filters are only applied locally
+pipeline_search = None if args.filter_locally else pipeline_filter.build_search_query()
+
+# Validate the export_dir parameter
+export_dir = args.export_dir
+if not validate_export_dir_parameter(export_dir, args.resume, args.store, create=not args.dry_run):
+    sys.exit(1)
+
+print("---------------------------------")
+print('Exporting and deleting old pipelines not associated with Jobs')
+print(f"Last Modification Date Threshold: '{last_modification_date_threshold}'")
+print(f"export_dir: '{export_dir}'")
+pipeline_filter.describe()
+if pipeline_search is not None:
+    print(f"Control Hub search: '{pipeline_search}'")
+
+# In a dry run, list what the metadata cache says would be cleaned up and stop before connecting to Control Hub
+if args.dry_run:
+    print("---------------------------------")
+    if args.cache_file is None:
+        print('Dry run: the arguments are valid. Use --cache to list the pipelines that would be exported and deleted')
+        print("---------------------------------")
+        sys.exit(0)
+    if not validate_cache_file_parameter(args.cache_file):
+        sys.exit(1)
+    cache = MetadataCache(args.cache_file)
+    would_clean_up_count, used_by_jobs_count, unknown_count = preview_old_pipelines(cache, pipeline_filter, 'export and delete',
+                                                                                    export=True)
+    cache.close()
+    print("---------------------------------")
+    print(f"Dry run: would export and delete {would_clean_up_count} old pipelines in the metadata cache")
+    print(f"Would skip {used_by_jobs_count} old pipelines that are still associated with Jobs")
+    if unknown_count > 0:
+        print(f"{unknown_count} old pipelines would be checked for Jobs with a call to Control Hub")
+    print('The cache may be out of date; a real run refreshes it first')
+    print("---------------------------------")
+    sys.exit(0)
+
+# Check the API credentials before connecting
+if not validate_credentials(CRED_ID, CRED_TOKEN):
+    sys.exit(1)
+
+# Open the export store
+store = None
+if args.store:
+    store = ExportStore(export_dir)
+
+# Settings shared by all API calls
+workers = args.workers
+rate_limiter = TokenBucket(args.rate)
+max_retries = args.max_retries
+
+# Connect to Control Hub
+print("---------------------------------")
+print('Connecting to Control Hub')
+print("---------------------------------")
+sch = connect_to_control_hub(CRED_ID, CRED_TOKEN)
+
+# Read pipelines and Jobs from the local cache, after fetching any changes, or from Control Hub
+if args.cache_file is not None:
+    print(f"Refreshing the metadata cache '{args.cache_file}'")
+    cache = MetadataCache(args.cache_file, args.cache_ttl)
+    with metrics.phase('cache_refresh'):
+        pipeline_count, job_count = cache.refresh(sch, shards=args.scan_shards)
+    metrics.count('cache_refresh', items=pipeline_count + job_count)
+    print(f"Fetched {pipeline_count} pipelines and {job_count} Jobs from Control Hub")
+    print("---------------------------------")
+    all_jobs = cache.jobs()
+    all_pipelines = cache.pipelines()
+elif args.scan_shards > 1 or pipeline_search is not None:
+    if args.scan_shards > 1:
+        print(f"Listing pipelines and Jobs in {args.scan_shards} concurrent shards")
+    else:
+        print('Listing the pipelines that match the search and all of the Jobs concurrently')
+    print("---------------------------------")
+    cache = None
+    scan = ShardedScan(sch, args.scan_shards, rate_limiter, max_retries, pipeline_search=pipeline_search,
+                       before_millis=last_modification_date_threshold_millis)
+    all_jobs = scan.jobs()
+    all_pipelines = scan.pipelines()
+else:
+    # List every Job, one page at a time, timed as the shard searches are. The pipelines are listed below
+    cache = None
+    all_jobs = list_all(sch.jobs, 'jobs.get_all', rate_limiter, max_retries)
+    all_pipelines = None
+
+# Get pipelines associated with Jobs
+print('Getting Job/Pipeline associations')
+print("---------------------------------")
+metrics.start_phase('list_jobs')
+job_index = JobAssociationIndex(all_jobs)
+metrics.end_phase('list_jobs', items=sum(len(jobs) for jobs in job_index.jobs_by_commit_id.values()))
+
+# The SDK lists pipelines a page at a time by offset, so deleting pipelines while the listing is still
+# being read would shift later pages and skip pipelines. Finish the listing before anything is deleted
+print('Listing pipelines')
+print("---------------------------------")
+metrics.start_phase('list_pipelines')
+if all_pipelines is None:
+    all_pipelines = list_all(sch.pipelines, 'pipelines.get_all', rate_limiter, max_retries)
+else:
+    all_pipelines = list(all_pipelines)
+metrics.end_phase('list_pipelines', items=len(all_pipelines))
+
+# Load the journal of a previous run if resuming, then open the journal
+journal_file = export_dir + '/' + CLEANUP_JOURNAL_FILE_NAME
+finished_pipeline_ids = set()
+if args.resume:
+    finished_pipeline_ids = get_finished_pipeline_ids(load_journal(journal_file), CLEANUP_FINISHED_STATUSES)
+    print(f"Resuming from journal '{journal_file}': {len(finished_pipeline_ids)} pipelines are already finished")
+    print("---------------------------------")
+journal = Journal(journal_file, resume=args.resume)
+
+print('Exporting and deleting old pipelines as they are found.')
+print('Please be patient; this may take a while...')
+print("---------------------------------")
+
+# Chain the three steps. Each stage pulls from the one before it, so pipelines are exported while later
+# pipelines are still being checked for Jobs and deleted while later pipelines are still being exported, with a bounded number
+# of pipelines in flight at each stage. Results are printed in the order the pipelines were found.
+# The stages overlap, so they are timed together as a single phase
+old_pipelines_used_by_jobs_count = 0
+resumed_pipelines_count = 0
+published_version_lookups = 0
+lookups_lock = threading.Lock()
+outcome_counts = {}
+metrics.start_phase('find_export_delete')
+exported_items = map_in_order(export_stage, find_old_pipelines(all_pipelines), workers)
+for item, (messages, outcome) in map_in_order(delete_stage, exported_items, workers):
+    for message in messages:
+        print(message)
+    print("---------------------------------")
+    outcome_counts[outcome] = outcome_counts.get(outcome, 0) + 1
+metrics.end_phase('find_export_delete', items=sum(outcome_counts.values()))
+
+journal.close()
+if cache is not None:
+    cache.close()
+
+# Summarize the run
+print(f"Found {sum(outcome_counts.values())} old pipelines not associated with any Jobs.")
+print(f"- Exported and deleted: {outcome_counts.get('deleted', 0)}")
+print(f"- Exported but not deleted: {outcome_counts.get('delete_failed', 0)}")
+print(f"- No published version to export, not deleted: {outcome_counts.get('not_exportable', 0)}")
+print(f"- Export failed, not deleted: {outcome_counts.get('failed', 0)}")
+print(f"Skipped {old_pipelines_used_by_jobs_count} old pipelines that are still associated with Jobs.")
+if args.resume:
+    print(f"Skipped {resumed_pipelines_count} old pipelines that the journal records as finished.")
+print(f"Fetched the version history of {job_index.commit_lookups + published_version_lookups} pipelines.")
+print(f"The outcome of each pipeline was recorded in the journal '{journal_file}'")
+if store is not None:
+    store.describe()
+print("---------------------------------")
+metrics.report(args)
+print("---------------------------------")
+print('Done')
@@ -4,9 +4,49 @@
 #
 # DESCRIPTION:    This script attempts to delete pipelines listed in the input file.
 #
-# ARGS:           - input_file - A JSON list of pipelines to delete.
+# ARGS:           - input_file    - A JSON list of pipelines to delete, or an inventory written by
+#                                   get-old-pipelines.py --format inventory or slice-inventory.py.
 #
-# USAGE:          $ python3 delete-old-pipelines.py <input_file>
+#                 - --workers     - (Optional) The number of pipelines to look up and delete concurrently.
+#                                   Defaults to 1. Output is always printed in the order of the input file.
+#
+#                 - --rate        - (Optional) The maximum number of Control Hub API calls per second.
+#
+#                 - --batch-size  - (Optional) The number of pipelines to look up per Control Hub search.
+#                                   Defaults to 50.
+#
+#                 - --delete-batch-size - (Optional) The number of pipelines to delete per Control Hub call.
+#                                   If a batch fails, for example because one of its pipelines is used by a
+#                                   Job, its pipelines are deleted one at a time. Defaults to 1.
+#
+#                 - --results     - (Optional) The file to write the deleted, failed and not found pipelines to
+#                                   as JSON, after a search confirms which deleted pipelines are really gone.
+#                                   With --resume, this run's outcomes are merged into the file's.
+#                                   Defaults to <input_file>.delete-results.json
+#
+#                 - --journal     - (Optional) The file to record the outcome of each deletion in.
+#                                   Defaults to <input_file>.delete-journal.json
+#
+#                 - --resume      - (Optional) Skip pipelines the journal records as already deleted or not found.
+#
+#                 - --cache       - (Optional) The metadata cache written by get-old-pipelines.py --cache.
+#                                   Deleted pipelines are removed from it.
+#
+#                 - --async-http  - (Optional) Use the built-in asyncio REST client instead of the SDK, with up
+#                                   to --workers requests in flight over pooled keep-alive connections.
+#                                   --sch-url sets the Control Hub URL (default: $SCH_URL or na01).
+#
+#                 - --dry-run     - (Optional) Check the arguments and the input file, and list the pipelines that would
+#                                   be deleted, without connecting to Control Hub. With --cache, pipelines that are not
+#                                   in the cache are flagged.
+#
+#                 - --max-retries - (Optional) How many times to retry calls that fail with a 429 or 5xx
+#                                   response, with exponential backoff. Defaults to 5.
+#
+#                 - --metrics, --prometheus - (Optional) Files to write API call counts, latencies and per-phase
+#                                  timings to, as JSON and in the Prometheus text format.
+#
+# USAGE:          $ python3 delete-old-pipelines.py <input_file> [--workers N] [--rate R] [--batch-size N] [--delete-batch-size N] [--max-retries N] [--journal <file>] [--results <file>] [--resume] [--dry-run] [--metrics <file>] [--prometheus <file>]
 #
 # USAGE EXAMPLE:  $ python3 delete-old-jpipelines.py /Users/mark/old-pipelines/old_pipelines.json
 #
@@ -27,63 +67,17 @@
 #
 #################################################################
 
-import os,sys, json
-from pathlib import Path
-from datetime import datetime
-from streamsets.sdk import ControlHub
-
-# Method that validates the input_file command line parameter.
-# Returns True if the input_file exists and is readable or False otherwise
-def validate_input_file_parameter(the_input_file):
-    file_path = Path(the_input_file)
-    if file_path.is_file() and os.access(file_path, os.R_OK):
-        return True
-    else:
-        print(f"Error: Input File \'{input_file}\' either does not exist or is not readable")
-        return False
-
-# Method to get a pipeline from SCH using the pipeline_id. Returns the pipeline or None if the
-# pipeline is not found or if there is any issue
-def get_pipeline(the_pipeline_info):
-    pipeline_id = the_pipeline_info["pipeline_id"]
-    pipeline_name = the_pipeline_info["pipeline_name"]
-
-    try:
-        query = 'pipeline_id=="' + pipeline_id + '"'
-        pipelines = sch.pipelines.get_all(search=query)
-        if pipelines is None or len(pipelines) == 0:
-            print(f"Error getting pipeline \'{pipeline_name}\': Pipeline not found")
-        else:
-            pipeline = pipelines[0]
-            return pipeline
-    except Exception as ex:
-        print(f"Error getting pipeline \'{pipeline_name}\': {ex}")
-    return None
-
-# Method to delete a pipeline. The deletion attempt might fail due to permission issues
-# or if the pipeline is associated with a Job
-def delete_pipeline(pipeline):
-    try:
-        sch.delete_pipeline(pipeline)
-        print('- Pipeline was deleted.')
-    except Exception as ex:
-        print(f"Error: Attempt to delete pipeline \'{pipeline_name}\' with ID \'{pipeline_id}\' failed; {ex}")
-
-# Method to handle each line of the input file
-def handle_line(the_pipeline_info):
-
-    print(f"Preparing to delete pipeline \'{the_pipeline_info['pipeline_name']}\' with ID \'{the_pipeline_info['pipeline_id']}\'")
-
-    # Get the pipeline
-    pipeline = get_pipeline(the_pipeline_info)
-    if pipeline is not None:
-
-        print("- Found Pipeline")
-
-        # Try to delete the pipeline
-        delete_pipeline(pipeline)
-
-    print("---------------------------------")
+import os,sys, argparse
+from pipeline_cleanup import metrics
+from pipeline_cleanup.cache import MetadataCache
+from pipeline_cleanup.concurrency import TokenBucket
+from pipeline_cleanup.connection import DEFAULT_SCH_URL, connect_to_control_hub, validate_credentials
+from pipeline_cleanup.deletion import DEFAULT_DELETE_BATCH_SIZE, write_delete_results
+from pipeline_cleanup.journal import Journal, load_journal, get_finished_pipeline_ids
+from pipeline_cleanup.parameters import validate_input_file_parameter
+from pipeline_cleanup.preview import preview_pipeline_infos, validate_cache_file_parameter
+from pipeline_cleanup.resolver import DEFAULT_BATCH_SIZE, read_pipeline_infos
+from pipeline_cleanup.steps import delete_pipeline_infos
 
 #####################################
 # Main Program
@@ -95,33 +89,135 @@ CRED_ID = os.getenv('CRED_ID')
 # Get CRED_TOKEN from the environment
 CRED_TOKEN = os.getenv('CRED_TOKEN')
 
-# Check the number of command line args
-if len(sys.argv) != 2:
-    print('Error: Wrong number of arguments')
-    print('Usage: $ python3 delete-old-pipelines.py <input_file>')
-    print('Usage Example: $ python3 delete-old-pipelines /Users/mark/old-jobs/old_jobs.json')
-    sys.exit(1)
+# Parse the command line args
+parser = argparse.ArgumentParser(prog='delete-old-pipelines.py',
+                                 epilog='Usage Example: $ python3 delete-old-pipelines.py /Users/mark/old-pipelines/old_pipelines.json')
+parser.add_argument('input_file', help='A JSON list of pipelines to delete, or an inventory file')
+parser.add_argument('--workers', type=int, default=1,
+                    help='The number of pipelines to look up and delete concurrently (default: 1)')
+parser.add_argument('--rate', type=float, default=0,
+                    help='The maximum number of Control Hub API calls per second across all workers (default: no limit)')
+parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                    help=f'The number of pipelines to look up per Control Hub search (default: {DEFAULT_BATCH_SIZE})')
+parser.add_argument('--delete-batch-size', type=int, default=DEFAULT_DELETE_BATCH_SIZE,
+                    help='The number of pipelines to delete per Control Hub call. If a batch fails, its pipelines are '
+                         f'deleted one at a time (default: {DEFAULT_DELETE_BATCH_SIZE})')
+parser.add_argument('--results', dest='results_file', default=None,
+                    help='The file to write the verified outcome of the run to as JSON (default: <input_file>.delete-results.json)')
+parser.add_argument('--max-retries', type=int, default=5,
+                    help='The number of times to retry a call that was throttled or failed with a server error (default: 5)')
+parser.add_argument('--journal', dest='journal_file', default=None,
+                    help='The file to record the outcome of each deletion in (default: <input_file>.delete-journal.json)')
+parser.add_argument('--resume', action='store_true',
+                    help='Skip the pipelines that the journal records as already deleted or not found')
+parser.add_argument('--cache', dest='cache_file', default=None,
+                    help='The local SQLite metadata cache written by get-old-pipelines.py --cache, '
+                         'which deleted pipelines are removed from')
+parser.add_argument('--async-http', action='store_true',
+                    help='Look up and delete pipelines with the built-in asyncio REST client, with --workers requests '
+                         'in flight over a pool of keep-alive connections, instead of the StreamSets SDK')
+parser.add_argument('--sch-url', default=None,
+                    help=f'The Control Hub URL used by --async-http (default: $SCH_URL or {DEFAULT_SCH_URL})')
+parser.add_argument('--dry-run', action='store_true',
+                    help='Check the arguments and the input file and list the pipelines that would be deleted, '
+                         'using --cache if given, without connecting to Control Hub')
+metrics.add_metrics_arguments(parser)
+args = parser.parse_args()
+if args.workers < 1:
+    parser.error('--workers must be at least 1')
+if args.batch_size < 1:
+    parser.error('--batch-size must be at least 1')
+if args.delete_batch_size < 1:
+    parser.error('--delete-batch-size must be at least 1')
 
 # Validate the input_file parameter
-input_file = sys.argv[1]
+input_file = args.input_file
 print("---------------------------------")
 print(f"input_file: '{input_file}'")
 if not validate_input_file_parameter(input_file):
     sys.exit(1)
 
-# Connect to Control Hub
+# Load the journal of a previous run if resuming
+journal_file = args.journal_file if args.journal_file is not None else input_file + '.delete-journal.json'
+finished_pipeline_ids = set()
+if args.resume:
+    finished_pipeline_ids = get_finished_pipeline_ids(load_journal(journal_file))
+    print("---------------------------------")
+    print(f"Resuming from journal '{journal_file}': {len(finished_pipeline_ids)} pipelines are already finished")
+
+# Read the input_file, skipping pipelines that were finished by a previous run
+pipeline_infos = [info for info in read_pipeline_infos(input_file) if info['pipeline_id'] not in finished_pipeline_ids]
+
+# In a dry run, list the pipelines that would be deleted and stop before connecting to Control Hub
+if args.dry_run:
+    print("---------------------------------")
+    if args.cache_file is not None and not validate_cache_file_parameter(args.cache_file):
+        sys.exit(1)
+    cache = MetadataCache(args.cache_file) if args.cache_file is not None else None
+    cached_count = preview_pipeline_infos(pipeline_infos, 'delete', cache)
+    print("---------------------------------")
+    delete_calls = len(pipeline_infos) if args.delete_batch_size == 1 else -(-len(pipeline_infos) // args.delete_batch_size)
+    print(f"Dry run: would delete {len(pipeline_infos)} pipelines with {delete_calls} delete calls")
+    if cache is not None:
+        print(f"{len(pipeline_infos) - cached_count} of them are not in the metadata cache")
+        cache.close()
+    print("---------------------------------")
+    print('Done')
+    sys.exit(0)
+if not validate_credentials(CRED_ID, CRED_TOKEN):
+    sys.exit(1)
+
+# The file to write the verified outcome of each pipeline to
+results_file = args.results_file if args.results_file is not None else input_file + '.delete-results.json'
+
+# Settings shared by all API calls
+workers = args.workers
+rate_limiter = TokenBucket(args.rate)
+max_retries = args.max_retries
+
+# Connect to Control Hub, either through the SDK or the async HTTP client
 print("---------------------------------")
 print('Connecting to Control Hub')
 print("---------------------------------")
-sch = ControlHub(credential_id=CRED_ID, token=CRED_TOKEN)
-
-# Process each line of the input_file
-with open(input_file, 'r') as f:
-    for line in f:
-        try:
-            pipeline_info = json.loads(line)
-            handle_line(pipeline_info)
-        except json.JSONDecodeError as e:
-            print(f"Error: Invalid JSON for line {line}: {e}")
+sch = None
+client = None
+if args.async_http:
+    from pipeline_cleanup.async_client import AsyncControlHubClient
+    client = AsyncControlHubClient(CRED_ID, CRED_TOKEN, server_url=args.sch_url, concurrency=workers,
+                                   rate_limiter=rate_limiter, max_retries=max_retries)
+else:
+    sch = connect_to_control_hub(CRED_ID, CRED_TOKEN)
+
+# Open the metadata cache
+cache = None
+if args.cache_file is not None:
+    cache = MetadataCache(args.cache_file)
+    cache.attach(sch)
+
+# Open the journal
+journal = Journal(journal_file, resume=args.resume)
+
+# Look up all of the pipelines in the input_file in batches, delete those that were found delete_batch_size
+# pipelines per call, and confirm that they are gone
+print(f"Looking up {len(pipeline_infos)} pipelines")
+print("---------------------------------")
+results = delete_pipeline_infos(sch, pipeline_infos, delete_batch_size=args.delete_batch_size, batch_size=args.batch_size,
+                                rate_limiter=rate_limiter, max_retries=max_retries, workers=workers, journal=journal,
+                                cache=cache, client=client)
+if client is not None:
+    client.close()
+journal.close()
+if cache is not None:
+    cache.close()
+written_results = write_delete_results(results_file, results, merge=args.resume)
+print(f"The outcome of each deletion was recorded in the journal '{journal_file}'")
+print(f"Wrote {len(written_results['deleted'])} deleted, {len(written_results['failed'])} failed, "
+      f"{len(written_results['not_found'])} not found and {len(written_results['unverified'])} unverified "
+      f"pipelines to the results file '{results_file}'")
+if args.resume:
+    print('The results of earlier runs were kept, except for the pipelines that this run retried')
+print("---------------------------------")
+metrics.report(args)
+print("---------------------------------")
 
 print('Done')
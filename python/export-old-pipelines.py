@@ -4,13 +4,50 @@
 #
 # DESCRIPTION:    This script exports the current version of the pipelines listed in the input file.
 #
-# ARGS:           - input_file - A JSON list of pipelines to export.
+# ARGS:           - input_file - A JSON list of pipelines to export, or an inventory written by
+#                                get-old-pipelines.py --format inventory or slice-inventory.py.
 #
 #                 - export_dir - The directory to write the exported pipelines to.
 #                                The directory will be created if it does not exist.
 #                                If the directory does exist, it must be empty
 #
-# USAGE:          $ python3 export-old-pipelines.py <input_file> <export_dir>
+#                 - --batch-size - (Optional) The number of pipelines to look up per Control Hub search.
+#                                  Defaults to 50.
+#
+#                 - --workers    - (Optional) The number of exports to run concurrently. Defaults to 1.
+#
+#                 - --export-batch-size - (Optional) The number of pipelines to export per archive. When greater
+#                                  than 1, pipelines are written to numbered batch-<n>.zip archives and a
+#                                  manifest.json lists which archive each pipeline is in. Defaults to 1.
+#
+#                 - --consolidate - (Optional) Merge the batch archives into a single pipelines.zip.
+#
+#                 - --store      - (Optional) Instead of zip files, unpack the exports into a deduplicated,
+#                                  content-addressed store in the export_dir, which may already hold a store
+#                                  from a previous run. Use rebuild-export-archive.py to get an importable zip.
+#
+#                 - --resume     - (Optional) Continue a previous export into the same export_dir, skipping the
+#                                  pipelines its export-journal.json records as exported or not exportable.
+#
+#                 - --cache      - (Optional) The metadata cache written by get-old-pipelines.py --cache, used
+#                                  to look up the published versions of draft pipelines.
+#
+#                 - --rate, --max-retries - (Optional) Rate limit and retry settings, as for delete-old-pipelines.py
+#
+#                 - --async-http - (Optional) Stream each archive straight to disk with the built-in asyncio REST client,
+#                                  with up to --workers exports in flight over pooled keep-alive connections, instead
+#                                  of holding it in memory. Pipelines are still looked up with the SDK. Can't be used
+#                                  with --store. --sch-url sets the Control Hub URL (default: $SCH_URL or na01).
+#
+#                 - --dry-run    - (Optional) Check the arguments, the input file and the export_dir, and list the
+#                                  pipelines and versions that would be exported, without connecting to Control Hub
+#                                  or creating the export_dir. Draft versions are previewed from the versions
+#                                  recorded in the input file or in --cache.
+#
+#                 - --metrics, --prometheus - (Optional) Files to write API call counts, latencies and per-phase
+#                                  timings to, as JSON and in the Prometheus text format.
+#
+# USAGE:          $ python3 export-old-pipelines.py <input_file> <export_dir> [options]
 #
 # USAGE EXAMPLE:  $ python3 export-old-pipelines.py /Users/mark/old-pipelines/old_pipelines.json /Users/mark/pipelines-export
 #
@@ -31,44 +68,19 @@
 #
 #################################################################
 
-import os,sys, json
-from pathlib import Path
-from streamsets.sdk import ControlHub
-
-# Method that validates the input_file command line parameter.
-# Returns True if the input_file exists and is readable or False otherwise
-def validate_input_file_parameter(the_input_file):
-    file_path = Path(the_input_file)
-    if file_path.is_file() and os.access(file_path, os.R_OK):
-        return True
-    else:
-        print(f"Error: Input File \'{the_input_file}\' either does not exist or is not readable")
-        return False
-
-# Method that validates that the directory specified in the export_dir command line parameter either
-# does not exist or exists but is an empty dir. If the directory does not exist it will be created.
-# Returns True if the directory is OK or False if not.
-def validate_export_dir_parameter(the_export_dir):
-
-    # If export_dir already exists...
-    if os.path.isdir(the_export_dir):
-        # ... make sure it is empty
-        if os.listdir(the_export_dir):
-            print(f"Error: Export directory \'{the_export_dir}\' already exists but is not empty. ")
-            print("Please specify a new or empty directory for Job export")
-            return False
-
-    # Create export dir if it does not yet exist
-    else:
-        try:
-            os.makedirs(the_export_dir, exist_ok=True)
-            if not os.path.isdir(the_export_dir):
-                print("Error: directory creation failed.")
-                return False
-        except Exception as ex:
-            print(f"Exception when trying to create directory \'{the_export_dir}\': {ex}")
-            return False
-    return True
+import os,sys, argparse
+from pipeline_cleanup import metrics
+from pipeline_cleanup.archives import MANIFEST_FILE_NAME, JOURNAL_FILE_NAME, CONSOLIDATED_ARCHIVE_NAME, get_manifest_archive_names, \
+    set_manifest_archive, consolidate_archives, count_manifest_entries
+from pipeline_cleanup.cache import MetadataCache
+from pipeline_cleanup.concurrency import TokenBucket
+from pipeline_cleanup.connection import DEFAULT_SCH_URL, connect_to_control_hub, validate_credentials
+from pipeline_cleanup.journal import Journal, load_journal, get_finished_pipeline_ids
+from pipeline_cleanup.parameters import validate_input_file_parameter, validate_export_dir_parameter
+from pipeline_cleanup.preview import preview_pipeline_infos, validate_cache_file_parameter
+from pipeline_cleanup.resolver import DEFAULT_BATCH_SIZE, read_pipeline_infos
+from pipeline_cleanup.steps import export_pipeline_infos
+from pipeline_cleanup.store import ExportStore
 
 #####################################
 # Main Program
@@ -80,104 +92,184 @@ CRED_ID = os.getenv('CRED_ID')
 # Get CRED_TOKEN from the environment
 CRED_TOKEN = os.getenv('CRED_TOKEN')
 
-# Check the number of command line args
-if len(sys.argv) != 3:
-    print('Error: Wrong number of arguments')
-    print('Usage: $ python3 export-old-pipelines.py <input_file> <export_dir>')
-    print('Usage Example: $ python3 export-old-pipelines.py /Users/mark/old-pipelines/old_pipelines.json /Users/mark/pipelines-export')
-    sys.exit(1)
+# Parse the command line args
+parser = argparse.ArgumentParser(prog='export-old-pipelines.py',
+                                 epilog='Usage Example: $ python3 export-old-pipelines.py /Users/mark/old-pipelines/old_pipelines.json /Users/mark/pipelines-export')
+parser.add_argument('input_file', help='A JSON list of pipelines to export, or an inventory file')
+parser.add_argument('export_dir', help='The directory to write the exported pipelines to')
+parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                    help=f'The number of pipelines to look up per Control Hub search (default: {DEFAULT_BATCH_SIZE})')
+parser.add_argument('--workers', type=int, default=1,
+                    help='The number of exports to run concurrently (default: 1)')
+parser.add_argument('--export-batch-size', type=int, default=1,
+                    help='The number of pipelines to export per archive. When greater than 1, pipelines are written to '
+                         'numbered batch archives along with a manifest.json (default: 1, one archive per pipeline)')
+parser.add_argument('--consolidate', action='store_true',
+                    help='After a batched export, merge the batch archives into a single pipelines.zip')
+parser.add_argument('--store', action='store_true',
+                    help='Unpack the exports into a deduplicated, content-addressed store in the export_dir instead '
+                         'of writing zip files. The export_dir may already hold a store from a previous run')
+parser.add_argument('--rate', type=float, default=0,
+                    help='The maximum number of Control Hub API calls per second across all workers (default: no limit)')
+parser.add_argument('--max-retries', type=int, default=5,
+                    help='The number of times to retry a call that was throttled or failed with a server error (default: 5)')
+parser.add_argument('--resume', action='store_true',
+                    help='Continue a previous export into the same export_dir, skipping the pipelines that its '
+                         'journal records as already exported or not exportable')
+parser.add_argument('--cache', dest='cache_file', default=None,
+                    help='The local SQLite metadata cache written by get-old-pipelines.py --cache, '
+                         'used to look up the published versions of draft pipelines')
+parser.add_argument('--async-http', action='store_true',
+                    help='Stream each archive straight to disk with the built-in asyncio REST client, with --workers '
+                         'exports in flight over a pool of keep-alive connections. Pipelines are still looked up '
+                         'with the StreamSets SDK')
+parser.add_argument('--sch-url', default=None,
+                    help=f'The Control Hub URL used by --async-http (default: $SCH_URL or {DEFAULT_SCH_URL})')
+parser.add_argument('--dry-run', action='store_true',
+                    help='Check the arguments, the input file and the export_dir and list the pipelines that would be '
+                         'exported, using --cache if given, without connecting to Control Hub')
+metrics.add_metrics_arguments(parser)
+args = parser.parse_args()
+if args.batch_size < 1:
+    parser.error('--batch-size must be at least 1')
+if args.workers < 1:
+    parser.error('--workers must be at least 1')
+if args.export_batch_size < 1:
+    parser.error('--export-batch-size must be at least 1')
+if args.consolidate and args.export_batch_size == 1:
+    parser.error('--consolidate requires --export-batch-size greater than 1')
+if args.consolidate and args.store:
+    parser.error('--consolidate can\'t be used with --store; use rebuild-export-archive.py to build a single archive')
+if args.async_http and args.store:
+    parser.error('--async-http can\'t be used with --store, which unpacks each export in memory')
 
 # Validate the input_file parameter
-input_file = sys.argv[1]
+input_file = args.input_file
 print("---------------------------------")
 print(f"input_file: '{input_file}'")
 if not validate_input_file_parameter(input_file):
     sys.exit(1)
 
 # Validate the export_dir parameter
-export_dir = sys.argv[2]
+export_dir = args.export_dir
 print("---------------------------------")
 print(f"export_dir: '{export_dir}'")
-if not validate_export_dir_parameter(export_dir):
+if not validate_export_dir_parameter(export_dir, args.resume, args.store, create=not args.dry_run):
     sys.exit(1)
 
+# Load the journal of a previous run if resuming. The journal is the index of finished
+# pipelines, so the export_dir itself never needs to be scanned
+journal_file = export_dir + '/' + JOURNAL_FILE_NAME
+finished_pipeline_ids = set()
+if args.resume:
+    finished_pipeline_ids = get_finished_pipeline_ids(load_journal(journal_file))
+    print("---------------------------------")
+    print(f"Resuming from journal '{journal_file}': {len(finished_pipeline_ids)} pipelines are already finished")
+
+# Read the input_file, skipping pipelines that were finished by a previous run
+pipeline_infos = [info for info in read_pipeline_infos(input_file) if info['pipeline_id'] not in finished_pipeline_ids]
+
+# In a dry run, list the pipelines that would be exported and stop before connecting to Control Hub
+if args.dry_run:
+    print("---------------------------------")
+    if args.cache_file is not None and not validate_cache_file_parameter(args.cache_file):
+        sys.exit(1)
+    cache = MetadataCache(args.cache_file) if args.cache_file is not None else None
+    cached_count = preview_pipeline_infos(pipeline_infos, 'export', cache, export=True)
+    print("---------------------------------")
+    if args.store:
+        destination = 'the export store'
+    elif args.export_batch_size > 1:
+        destination = f"{-(-len(pipeline_infos) // args.export_batch_size)} batch archives"
+    else:
+        destination = 'one archive per pipeline'
+    print(f"Dry run: would export {len(pipeline_infos)} pipelines into {destination} in \'{export_dir}\'")
+    if cache is not None:
+        print(f"{len(pipeline_infos) - cached_count} of them are not in the metadata cache")
+        cache.close()
+    print("---------------------------------")
+    print('Done')
+    sys.exit(0)
+if not validate_credentials(CRED_ID, CRED_TOKEN):
+    sys.exit(1)
+
+# Settings shared by all API calls
+workers = args.workers
+export_batch_size = args.export_batch_size
+rate_limiter = TokenBucket(args.rate)
+max_retries = args.max_retries
+
+# Open the export store
+store = None
+if args.store:
+    store = ExportStore(export_dir)
+
 # Connect to Control Hub
 print("---------------------------------")
 print('Connecting to Control Hub')
-sch = ControlHub(credential_id=CRED_ID, token=CRED_TOKEN)
+sch = connect_to_control_hub(CRED_ID, CRED_TOKEN)
+client = None
+if args.async_http:
+    from pipeline_cleanup.async_client import AsyncControlHubClient
+    client = AsyncControlHubClient(CRED_ID, CRED_TOKEN, server_url=args.sch_url, concurrency=workers,
+                                   rate_limiter=rate_limiter, max_retries=max_retries)
+
+# Open the metadata cache
+cache = None
+if args.cache_file is not None:
+    cache = MetadataCache(args.cache_file)
+    cache.attach(sch)
 
 print("---------------------------------")
 print('Exporting Pipelines...')
 print("---------------------------------")
 
-# Process each line of the input_file
-with open(input_file, 'r') as f:
-    for line in f:
-        try:
-            obj = json.loads(line)
-            pipeline_id = obj["pipeline_id"]
-
-            try:
-                # Get the pipeline from Control Hub using its ID
-                query = 'pipeline_id=="' + pipeline_id + '"'
-                pipelines = sch.pipelines.get_all(search=query)
-
-                # Handle if pipeline is not found
-                if pipelines is None or len(pipelines) == 0:
-                    print(f"Error exporting pipeline \'{obj["pipeline_name"]}\' with pipeline ID \'{pipeline_id}\': Pipeline not found")
-
-               # Export Pipeline
-                else:
-                    pipeline = pipelines[0]
-                    got_pipeline = True
-
-                    # If the pipeline is a draft version, get the last published version instead
-                    if pipeline.draft:
-                        print(f"Pipeline \'{obj["pipeline_name"]}\' version \'{pipeline.version}\' with pipeline ID \'{pipeline_id}\' is a draft pipeline and can't be exported.")
-                        print("Looking for the most recent published version of the pipeline...")
-
-                        # See if a version of the pipeline has been published
-                        commits = pipeline.commits
-                        if commits is None or len(commits) == 0:
-                            print("No published versions found for this pipeline")
-                            print(f"Warning: Pipeline \'{obj["pipeline_name"]}\' with pipeline ID \'{pipeline_id}\' was not exported!")
-                            got_pipeline = False
-
-                        else:
-                            # Get the most recent published version
-                            most_recent_commit = max(commits, key=lambda c: c.commit_time)
-                            # Get the most recent commit of the pipeline from Control Hub using its ID
-                            query = 'pipeline_id=="' + pipeline_id + '" and version=="' +  most_recent_commit.version + '"'
-                            pipelines = sch.pipelines.get_all(search=query)
-
-                            if pipelines is None or len(pipelines) == 0:
-                                print("Error: Unable to retrieve a published version of this pipeline")
-                                got_pipeline = False
-
-                            else:
-                                pipeline = pipelines[0]
-                                print(f"Found version \'{pipeline.version}\' of the pipeline")
-                                got_pipeline = True
-
-                    if got_pipeline:
-                        # replace '/' with '_' in pipeline name
-                        pipeline_name = pipeline.name.replace("/", "_")
-                        export_file_name = export_dir + '/' + pipeline_name + '.zip'
-
-                        print(f"Exporting pipeline \'{pipeline.name}\' version \'{pipeline.version}\' with pipeline ID \'{pipeline.pipeline_id}\'into the file \'{export_file_name}\'")
-
-                        data = sch.export_pipelines([pipeline], fragments=True, include_plain_text_credentials=False)
-
-                        # Write a zip file for the pipeline
-                        with open(export_file_name, 'wb') as file:
-                            file.write(data)
-
-            except Exception as e:
-                print(f"Error exporting pipeline \'{pipeline.name}\': {e}")
-
-        except json.JSONDecodeError as e:
-            print(f"Error: Invalid JSON for line {line}: {e}")
-
-        print("---------------------------------")
+# Open the journal
+journal = Journal(journal_file, resume=args.resume)
+
+# Look up all of the pipelines in the input_file in batches, and export each one that was found into its own
+# archive, or export_batch_size pipelines per archive
+export_pipeline_infos(sch, pipeline_infos, export_dir, cache=cache, batch_size=args.batch_size, rate_limiter=rate_limiter,
+                      max_retries=max_retries, workers=workers, export_batch_size=export_batch_size, store=store,
+                      journal=journal, client=client)
+
+# Merge the batch archives, including those from a previous run, into a single archive
+archive_names = []
+if args.consolidate:
+    archive_names = [name for name in get_manifest_archive_names(export_dir) if name != CONSOLIDATED_ARCHIVE_NAME]
+if len(archive_names) > 0:
+    metrics.start_phase('consolidate')
+    consolidated_file_name = export_dir + '/' + CONSOLIDATED_ARCHIVE_NAME
+    source_file_names = [export_dir + '/' + name for name in archive_names]
+    if os.path.isfile(consolidated_file_name):
+        source_file_names.insert(0, consolidated_file_name)
+    try:
+        member_count = consolidate_archives(source_file_names, consolidated_file_name, count_manifest_entries(export_dir))
+    except Exception as e:
+        member_count = None
+        print(f"Error merging the archives: {e}")
+        print(f"The batch archives were kept and are still listed in \'{export_dir}/{MANIFEST_FILE_NAME}\'")
+    if member_count is not None:
+        set_manifest_archive(export_dir, CONSOLIDATED_ARCHIVE_NAME)
+        for name in archive_names:
+            os.remove(export_dir + '/' + name)
+        print(f"Merged the archives into the file \'{consolidated_file_name}\' with {member_count} members")
+    metrics.end_phase('consolidate', items=len(archive_names))
+    print("---------------------------------")
+
+# Report how much space the store saved
+if store is not None:
+    store.describe()
+    print("---------------------------------")
+
+journal.close()
+if cache is not None:
+    cache.close()
+if client is not None:
+    client.close()
+print(f"The outcome of each export was recorded in the journal '{journal_file}'")
+print("---------------------------------")
+metrics.report(args)
+print("---------------------------------")
 
 print('Done')
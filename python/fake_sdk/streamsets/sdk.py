@@ -0,0 +1,10 @@
+#################################################################
+# FILE:  sdk.py
+#
+# DESCRIPTION:    A shim that stands in for the StreamSets SDK when this directory is put first on
+#                 PYTHONPATH, so the scripts run against the synthetic tenant in pipeline_cleanup/fakehub.py.
+#                 benchmark.py sets this up; it is never used in a normal run.
+#
+#################################################################
+
+from pipeline_cleanup.fakehub import ControlHub
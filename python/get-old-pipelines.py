@@ -10,8 +10,73 @@
 #                 - output_file        - The full path to a file where the list of old pipelines will be written.
 #                                        Directories in the path will be created as needed, and if an existing
 #                                        file of the same name exists, it will be overwritten.
+#                                        For draft pipelines, the commit ID and version of the most recent
+#                                        published version are recorded too, for export-old-pipelines.py.
 #
-# USAGE:          $ python3 get-old-pipelines.py <last_modification_date_threshold> <output_file>
+#                 - --format           - (Optional) 'json' (the default) writes one JSON object per line.
+#                                        'inventory' writes a compact, memory-mappable columnar file instead,
+#                                        sorted by last modified date, which the export and delete scripts
+#                                        and slice-inventory.py read in place of the JSON lines file.
+#                                        With --streaming, only the job report is streamed.
+#
+#                 - --name             - (Optional) Only include pipelines whose name matches this glob pattern.
+#
+#                 - --name-regex       - (Optional) Only include pipelines whose name contains a match for this
+#                                        regular expression.
+#
+#                 - --label            - (Optional) Only include pipelines with this label. May be repeated.
+#
+#                 - --creator          - (Optional) Only include pipelines created by this user. May be repeated.
+#
+#                 - --engine-type      - (Optional) Only include pipelines for this engine type: COLLECTOR,
+#                                        TRANSFORMER or SNOWPARK.
+#
+#                 - --drafts-only      - (Optional) Only include pipelines whose latest version is a draft,
+#                   --published-only     or only those whose latest version is published.
+#
+#                 - --filter-locally   - (Optional) The threshold, draft flag, engine type, labels and a name
+#                                        without wildcards are sent to Control Hub as a search query, so only
+#                                        candidate pipelines are listed; the other filters are applied locally.
+#                                        With this option every pipeline is listed and all filters are local.
+#                                        The query is not used with --cache, which keeps every pipeline.
+#
+#                 - --streaming        - (Optional) Write pipelines to disk as they are found and sort them at the end
+#                                        with a bounded-memory external merge sort. --sort-run-size sets how many
+#                                        pipelines are sorted in memory at a time.
+#
+#                 - --cache            - (Optional) A local SQLite file to cache pipeline and Job metadata in.
+#                                        Later runs only fetch what has changed since the previous run, and
+#                                        re-read everything once the cache is older than --cache-ttl hours.
+#
+#                 - --incremental      - (Optional) Requires --cache. Keep this run's result in the cache, and on
+#                                        the next run only re-check the pipelines that changed since: those the
+#                                        cache refresh fetched, those used by Jobs that were modified, and those
+#                                        that a changed threshold makes old or no longer old. The changes are
+#                                        merged into the previous result, and the pipelines that became old,
+#                                        stopped being old or became used by Jobs are counted. Deleted pipelines
+#                                        and Jobs are only seen on a full refresh, so for weekly runs set
+#                                        --cache-ttl to a longer period, such as 720 hours.
+#
+#                 - --scan-shards      - (Optional) Split the pipeline and Job listings into this many shards by last
+#                                        modified date and fetch them concurrently.
+#
+#                 - --async-http       - (Optional) List the pipelines and Jobs with the built-in asyncio REST client
+#                                        instead of the SDK, requesting every page of both listings at once over
+#                                        pooled keep-alive connections. Can't be used with --cache or --scan-shards.
+#                                        --sch-url sets the Control Hub URL (default: $SCH_URL or na01).
+#
+#                 - --job-report       - (Optional) The full path to a file where old pipelines that are still
+#                                        associated with Jobs will be written, along with the Jobs that use them.
+#
+#                 - --dry-run          - (Optional) Check the arguments and output files without connecting to
+#                                        Control Hub or creating any directories. With --cache, list the old
+#                                        pipelines in the cache that would be written to the output file, and
+#                                        count those that are still associated with Jobs.
+#
+#                 - --metrics, --prometheus - (Optional) Files to write API call counts, latencies and per-phase
+#                                  timings to, as JSON and in the Prometheus text format.
+#
+# USAGE:          $ python3 get-old-pipelines.py <last_modification_date_threshold> <output_file> [options]
 #
 # USAGE EXAMPLE:  $ $ python3 get-old-pipelines.py 2024-06-30 /Users/mark/old-pipelines/old_pipelines.json
 #
@@ -32,51 +97,25 @@
 #
 #################################################################
 
-import os,sys,json
+import os,sys,json,argparse,asyncio
 from pathlib import Path
-from datetime import date, datetime, timedelta
-from streamsets.sdk import ControlHub
-
-# Method to convert millis to datetime string
-def millis_to_datetime_string(millis):
-    seconds = millis / 1000.0
-    dt = datetime.fromtimestamp(seconds)
-    dt_string = dt.strftime('%Y-%m-%d %H:%M:%S')
-    return dt_string
-
-# Method to convert datetime string to millis
-def convert_datetime_string_to_millis(datetime_string):
-    try:
-        dt = datetime.strptime(datetime_string, "%Y-%m-%d")
-        millis = int(dt.timestamp() * 1000)
-        return millis
-    except Exception as e:
-        print(f"Error: Error converting \'{datetime_string}\' to millis: \'{e}\'.")
-    return None
-
-# Method that validates the last_modification_date_threshold parameter is a valid date
-def is_valid_date(the_date_str):
-    try:
-        # This line will throw an exception if the date string is not valid
-        datetime.strptime(the_date_str, "%Y-%m-%d")
-        return True
-    except ValueError:
-        print(f"Error: The last_modification_date_threshold parameter \'{the_date_str}\' is not a valid date in yyyy-mm-dd format.")
-    return False
-
-# Method that validates that the last_modification_date_threshold parameter is at
-# least one day behind the current date.
-def date_is_at_least_one_day_old(the_date_str):
-    the_date = datetime.strptime(the_date_str, "%Y-%m-%d")
-    if the_date.date() <= date.today() - timedelta(days=1):
-        return True
-    else:
-        print(f"Error: The last_modification_date_threshold parameter \'{the_date_str}\' is not at least one day earlier than the current date.")
-    return False
+from pipeline_cleanup.cache import DEFAULT_TTL_HOURS, MetadataCache
+from pipeline_cleanup.connection import DEFAULT_SCH_URL, connect_to_control_hub, validate_credentials
+from pipeline_cleanup.dates import millis_to_datetime_string, convert_datetime_string_to_millis, is_valid_date, \
+    date_is_at_least_one_day_old
+from pipeline_cleanup.preview import preview_old_pipelines, validate_cache_file_parameter
+from pipeline_cleanup.scan import ShardedScan, list_all
+from pipeline_cleanup.extsort import DEFAULT_RUN_SIZE, JsonLinesWriter, sort_json_lines_file
+from pipeline_cleanup import metrics
+from pipeline_cleanup.associations import JobAssociationIndex
+from pipeline_cleanup.exports import get_latest_published_commit
+from pipeline_cleanup.filters import add_filter_arguments, PipelineFilter
+from pipeline_cleanup.inventory import InventoryWriter
 
 # Method that validates the output file and creates the directories in the path if necessary.
+# In a dry run the directories are not created.
 # Returns True if the output file and path are valid or False if not.
-def validate_output_file_parameter(the_output_file):
+def validate_output_file_parameter(the_output_file, create=True):
 
     # Get output file's path
     path = Path(the_output_file)
@@ -85,6 +124,9 @@ def validate_output_file_parameter(the_output_file):
     parent_dir = path.parent
     if parent_dir.is_dir():
         return True
+    elif not create:
+        print(f"Directory \'{parent_dir}\' does not exist yet and would be created")
+        return True
     else:
         try:
             parent_dir.mkdir(parents=True, exist_ok=True)
@@ -97,13 +139,101 @@ def validate_output_file_parameter(the_output_file):
             print(f"Error: OS error when trying to create directory \'{parent_dir}\': {e}")
             return False
 
-# Method that returns True if any version of the pipeline is associated with a Job or False otherwise
-def is_pipeline_associated_with_a_job(the_pipeline):
-    # Loop through every version of the pipeline
-    for commit in the_pipeline.commits:
-        if commit.commit_id in pipelines_used_in_jobs:
-            return True
-    return False
+# Method that records the most recent published version of a draft pipeline in its pipeline info,
+# so export-old-pipelines.py can look up the published versions of all the drafts in bulk.
+# published_version is None if the pipeline has never been published. If the versions can't be
+# read the fields are left out, and the exporter looks the pipeline up on its own instead
+def add_published_version(the_pipeline_info, the_pipeline):
+    global published_version_lookups
+    try:
+        published_version_lookups += 1
+        commit = get_latest_published_commit(the_pipeline, cache)
+    except Exception as e:
+        print(f"Error: Unable to read the versions of draft pipeline '{the_pipeline.name}': {e}")
+        return
+    the_pipeline_info['published_commit_id'] = commit.commit_id if commit is not None else None
+    the_pipeline_info['published_version'] = commit.version if commit is not None else None
+
+# Method that checks a pipeline against the threshold and the filters, and if it passes them, against
+# the Jobs. Returns None if the pipeline is not old, or else a tuple of its pipeline info and True if
+# it is still used by Jobs, in which case the Jobs are recorded in the pipeline info
+def check_pipeline(the_pipeline):
+
+    # See if the pipeline's last modification is before the threshold and if it passes the other
+    # filters before doing any of the more expensive Job association checks
+    if not pipeline_filter.matches(the_pipeline):
+        return None
+    last_modified_date = millis_to_datetime_string(the_pipeline.last_modified_on)
+    pipeline_info = {'pipeline_name': the_pipeline.name,
+                     'pipeline_id': the_pipeline.pipeline_id,
+                     'last_modified': last_modified_date,
+                     'version': the_pipeline.version,
+                     'is_draft': the_pipeline.draft}
+
+    # Keep track of the Jobs that are keeping the pipeline alive, if there are any
+    jobs = job_index.get_jobs_for_pipeline(the_pipeline)
+    if len(jobs) > 0:
+        pipeline_info['jobs'] = jobs
+        return pipeline_info, True
+    if the_pipeline.draft:
+        add_published_version(pipeline_info, the_pipeline)
+    return pipeline_info, False
+
+# Method that lists the pipelines matching the search, or every pipeline, and every Job with the async
+# HTTP client, both at the same time. Returns a tuple of (the pipelines, the Jobs)
+async def list_pipelines_and_jobs_async():
+    pipelines, jobs = await asyncio.gather(client.list_pipelines(search=pipeline_search), client.list_jobs())
+    return pipelines, jobs
+
+# Method that prints how the old pipelines changed since the previous incremental run, given the
+# statuses ('old' or 'job_bound') of the re-checked pipelines before and after this run
+def print_incremental_changes(the_previous_statuses, the_statuses):
+    became_old = stopped_being_old = became_job_bound = released_by_jobs = 0
+    for pipeline_id in set(the_previous_statuses) | set(the_statuses):
+        before = the_previous_statuses.get(pipeline_id)
+        after = the_statuses.get(pipeline_id)
+        if before == after:
+            continue
+        if after == 'old':
+            became_old += 1
+            if before == 'job_bound':
+                released_by_jobs += 1
+        elif before == 'old':
+            stopped_being_old += 1
+            if after == 'job_bound':
+                became_job_bound += 1
+    print(f"Since the previous run, {became_old} pipelines became old pipelines not associated with Jobs "
+          f"({released_by_jobs} of them are no longer used by Jobs)")
+    print(f"and {stopped_being_old} stopped being old pipelines not associated with Jobs "
+          f"({became_job_bound} of them are now used by Jobs; the rest were modified, filtered out or deleted)")
+
+# Method that adds a pipeline to the old pipelines found so far. In streaming mode it is written
+# straight to the unsorted output file rather than kept in memory. When writing an inventory it is
+# added to the inventory's compact rows, along with its last modified date in millis
+def record_old_pipeline(the_pipeline_info, the_last_modified_millis):
+    if inventory_writer is not None:
+        inventory_writer.append(the_pipeline_info, the_last_modified_millis)
+    elif old_pipelines_writer is not None:
+        old_pipelines_writer.write(the_pipeline_info)
+    else:
+        old_pipelines.append(the_pipeline_info)
+
+# Method that adds a pipeline to the old pipelines that are still used by Jobs found so far
+def record_old_pipeline_used_by_jobs(the_pipeline_info):
+    if old_pipelines_used_by_jobs_writer is not None:
+        old_pipelines_used_by_jobs_writer.write(the_pipeline_info)
+    else:
+        old_pipelines_used_by_jobs.append(the_pipeline_info)
+
+# Method that closes a streaming writer and sorts its unsorted file by pipeline name into the_output_file,
+# using a bounded-memory external merge sort. Returns the number of pipelines written
+def finish_streaming_output(the_writer, the_output_file):
+    the_writer.close()
+    count = the_writer.count
+    if count > 0:
+        sort_json_lines_file(the_writer.path, the_output_file, lambda x: x['pipeline_name'], run_size=sort_run_size)
+    os.remove(the_writer.path)
+    return count
 
 #####################################
 # Main Program
@@ -118,93 +248,305 @@ CRED_TOKEN = os.getenv('CRED_TOKEN')
 # A list of old pipelines not associated with Jobs
 old_pipelines = []
 
-# Check the number of command line args
-if len(sys.argv) != 3:
-    print('Error: Wrong number of arguments')
-    print('Usage: $ python3 get-old-pipelines.py <last_modification_date_threshold> <output_file>')
-    print('Usage Example: $ python3 get-old-pipelines.py 2024-06-30 /Users/mark/old-pipelines/old_pipelines.json')
-    sys.exit(1)
+# A list of old pipelines that are kept alive by Jobs
+old_pipelines_used_by_jobs = []
+
+# Parse the command line args
+parser = argparse.ArgumentParser(prog='get-old-pipelines.py',
+                                 epilog='Usage Example: $ python3 get-old-pipelines.py 2024-06-30 /Users/mark/old-pipelines/old_pipelines.json')
+parser.add_argument('last_modification_date_threshold', help='A String in the form yyyy-mm-dd')
+parser.add_argument('output_file', help='The full path to a file where the list of old pipelines will be written')
+add_filter_arguments(parser)
+parser.add_argument('--format', dest='output_format', choices=['json', 'inventory'], default='json',
+                    help='The format of the output file: one JSON object per line, or a compact, memory-mappable '
+                         'columnar inventory sorted by last modified date (default: json)')
+parser.add_argument('--job-report', dest='job_report_file', default=None,
+                    help='Optional file where old pipelines that are still associated with Jobs will be written, '
+                         'along with the Jobs that use them')
+parser.add_argument('--streaming', action='store_true',
+                    help='Write pipelines to disk as they are found and sort them at the end with a bounded-memory '
+                         'external merge sort, rather than holding them all in memory')
+parser.add_argument('--sort-run-size', type=int, default=DEFAULT_RUN_SIZE,
+                    help=f'In streaming mode, the number of pipelines to sort in memory at a time (default: {DEFAULT_RUN_SIZE})')
+parser.add_argument('--cache', dest='cache_file', default=None,
+                    help='A local SQLite file to cache pipeline and Job metadata in. Later runs only fetch '
+                         'what has changed since the previous run')
+parser.add_argument('--cache-ttl', type=float, default=DEFAULT_TTL_HOURS,
+                    help=f'The number of hours after which the cache is fully refreshed (default: {DEFAULT_TTL_HOURS})')
+parser.add_argument('--scan-shards', type=int, default=1,
+                    help='Split the pipeline and Job listings into this many shards by last modified date and fetch '
+                         'them concurrently (default: 1, a single serial listing)')
+parser.add_argument('--async-http', action='store_true',
+                    help='List the pipelines and Jobs with the built-in asyncio REST client, requesting all of their '
+                         'pages at once over a pool of keep-alive connections, instead of the StreamSets SDK')
+parser.add_argument('--sch-url', default=None,
+                    help=f'The Control Hub URL used by --async-http (default: $SCH_URL or {DEFAULT_SCH_URL})')
+parser.add_argument('--incremental', action='store_true',
+                    help='Requires --cache. Keep the result in the cache and on the next run only re-check the '
+                         'pipelines that changed since, merging them into the previous result')
+parser.add_argument('--dry-run', action='store_true',
+                    help='Check the arguments and output files and, with --cache, list the old pipelines in the cache '
+                         'that would be written, without connecting to Control Hub')
+metrics.add_metrics_arguments(parser)
+args = parser.parse_args()
+if args.incremental and args.cache_file is None:
+    parser.error('--incremental requires --cache')
+if args.scan_shards < 1:
+    parser.error('--scan-shards must be at least 1')
+if args.async_http and args.cache_file is not None:
+    parser.error('--async-http can\'t be used with --cache')
+if args.async_http and args.scan_shards > 1:
+    parser.error('--async-http already requests every page at once, so it can\'t be used with --scan-shards')
+if args.sort_run_size < 1:
+    parser.error('--sort-run-size must be at least 1')
 
 # Validate the last_modification_date_threshold parameter
-last_modification_date_threshold = sys.argv[1]
+last_modification_date_threshold = args.last_modification_date_threshold
 last_modification_date_threshold_millis = None
 if is_valid_date(last_modification_date_threshold) and date_is_at_least_one_day_old(last_modification_date_threshold):
     last_modification_date_threshold_millis = convert_datetime_string_to_millis(last_modification_date_threshold)
-if last_modification_date_threshold is None:
+if last_modification_date_threshold_millis is None:
     sys.exit(1)
 
+# The threshold and the optional filters
+pipeline_filter = PipelineFilter.from_args(last_modification_date_threshold_millis, args)
+
+# The search query that narrows the pipeline listing, unless the filters are only applied locally
+pipeline_search = None if args.filter_locally else pipeline_filter.build_search_query()
+
 # Validate the output_file parameter
-output_file = sys.argv[2]
-if not validate_output_file_parameter(output_file):
+output_file = args.output_file
+if not validate_output_file_parameter(output_file, create=not args.dry_run):
+    sys.exit(1)
+
+# Validate the job_report_file parameter
+job_report_file = args.job_report_file
+if job_report_file is not None and not validate_output_file_parameter(job_report_file, create=not args.dry_run):
+    sys.exit(1)
+
+# In a dry run, list the old pipelines that the metadata cache knows of and stop before connecting to Control Hub
+if args.dry_run:
+    print("---------------------------------")
+    if args.cache_file is None:
+        print('Dry run: the arguments are valid. Use --cache to list the old pipelines that would be written')
+        print("---------------------------------")
+        sys.exit(0)
+    if not validate_cache_file_parameter(args.cache_file):
+        sys.exit(1)
+    cache = MetadataCache(args.cache_file)
+    old_pipeline_count, used_by_jobs_count, unknown_count = preview_old_pipelines(cache, pipeline_filter, 'write')
+    cache.close()
+    print("---------------------------------")
+    print(f"Dry run: would write {old_pipeline_count} old pipelines in the metadata cache to \'{output_file}\'")
+    print(f"{used_by_jobs_count} old pipelines are still associated with Jobs")
+    if unknown_count > 0:
+        print(f"{unknown_count} old pipelines would be checked for Jobs with a call to Control Hub")
+    print('The cache may be out of date; a real run refreshes it first')
+    print("---------------------------------")
+    sys.exit(0)
+
+# Check the API credentials before connecting
+if not validate_credentials(CRED_ID, CRED_TOKEN):
     sys.exit(1)
 
 print("---------------------------------")
 print('Searching for old pipelines not associated with Jobs')
 print(f"Last Modification Date Threshold: '{last_modification_date_threshold}'")
 print(f"Output file: '{output_file}'")
+pipeline_filter.describe()
+if pipeline_search is not None:
+    print(f"Control Hub search: '{pipeline_search}'")
+
+# In streaming mode, pipelines are written to unsorted files next to the output files as they are found.
+# An inventory keeps its rows in memory in a compact form, and is written when the scan is done
+sort_run_size = args.sort_run_size
+old_pipelines_writer = None
+old_pipelines_used_by_jobs_writer = None
+inventory_writer = None
+if args.output_format == 'inventory':
+    inventory_writer = InventoryWriter()
+elif args.streaming:
+    old_pipelines_writer = JsonLinesWriter(output_file + '.unsorted')
+if args.streaming:
+    if job_report_file is not None:
+        old_pipelines_used_by_jobs_writer = JsonLinesWriter(job_report_file + '.unsorted')
 
 # Connect to Control Hub
 print("---------------------------------")
 print('Connecting to Control Hub')
 print("---------------------------------")
-sch = ControlHub(credential_id=CRED_ID, token=CRED_TOKEN)
+sch = None
+client = None
+if args.async_http:
+    from pipeline_cleanup.async_client import AsyncControlHubClient
+    client = AsyncControlHubClient(CRED_ID, CRED_TOKEN, server_url=args.sch_url)
+else:
+    sch = connect_to_control_hub(CRED_ID, CRED_TOKEN)
 
-# Store which pipelines are used by Jobs
-pipelines_used_in_jobs = []
+# Read pipelines and Jobs from the local cache, after fetching any changes, or from Control Hub
+if args.cache_file is not None:
+    print(f"Refreshing the metadata cache '{args.cache_file}'")
+    cache = MetadataCache(args.cache_file, args.cache_ttl)
+    with metrics.phase('cache_refresh'):
+        pipeline_count, job_count = cache.refresh(sch, shards=args.scan_shards)
+    metrics.count('cache_refresh', items=pipeline_count + job_count)
+    print(f"Fetched {pipeline_count} pipelines and {job_count} Jobs from Control Hub")
+    print("---------------------------------")
+    all_jobs = cache.jobs()
+    all_pipelines = cache.pipelines()
+elif args.async_http:
+    # Every page of both listings is requested at once. Pipeline versions are fetched later, as needed
+    print('Listing pipelines and Jobs with the async HTTP client')
+    print("---------------------------------")
+    cache = None
+    all_pipelines, all_jobs = asyncio.run(list_pipelines_and_jobs_async())
+elif args.scan_shards > 1 or pipeline_search is not None:
+    # Start listing the pipelines and the Jobs concurrently. The Job listing is needed first to build
+    # the association index, while the pipelines keep arriving in the background
+    if args.scan_shards > 1:
+        print(f"Listing pipelines and Jobs in {args.scan_shards} concurrent shards")
+    else:
+        print('Listing the pipelines that match the search and all of the Jobs concurrently')
+    print("---------------------------------")
+    cache = None
+    scan = ShardedScan(sch, args.scan_shards, pipeline_search=pipeline_search,
+                       before_millis=last_modification_date_threshold_millis)
+    all_jobs = scan.jobs()
+    all_pipelines = scan.pipelines()
+else:
+    # List every Job and then every pipeline, one page at a time, timed as the shard searches are
+    cache = None
+    all_jobs = list_all(sch.jobs, 'jobs.get_all')
+    all_pipelines = list_all(sch.pipelines, 'pipelines.get_all')
 
 # Get pipelines associated with Jobs
 print('Getting Job/Pipeline associations')
 print("---------------------------------")
-for job in sch.jobs:
-    pipelines_used_in_jobs.append(job.commit_id)
+metrics.start_phase('list_jobs')
+job_index = JobAssociationIndex(all_jobs)
+metrics.end_phase('list_jobs', items=sum(len(jobs) for jobs in job_index.jobs_by_commit_id.values()))
 
 # Look for old pipelines
 print('Searching for old pipelines not associated with Jobs.')
 print('Please be patient; this may take a while...')
 print('...')
 
-# Loop through every pipeline
-for pipeline in sch.pipelines:
-
-    # If the pipeline is not associated with a Job
-    if not is_pipeline_associated_with_a_job(pipeline):
+# In incremental mode, only the pipelines that may have changed since the previous run are re-checked,
+# as long as the previous run used the same filters and the cache was not fully refreshed since
+incremental_merge = False
+if args.incremental:
+    results_settings = dict(pipeline_filter.get_settings(), threshold_millis=last_modification_date_threshold_millis)
+    previous_settings = cache.get_results_settings()
+    if previous_settings is None:
+        print('No previous incremental result was found in the cache, so every pipeline will be checked.')
+    elif cache.last_refresh_was_full:
+        print('The cache was fully refreshed, so every pipeline will be checked.')
+    elif {k: v for k, v in previous_settings.items() if k != 'threshold_millis'} != pipeline_filter.get_settings():
+        print('The filters have changed since the previous incremental run, so every pipeline will be checked.')
+    else:
+        incremental_merge = True
+        candidate_ids = cache.get_incremental_candidates(previous_settings['threshold_millis'],
+                                                         last_modification_date_threshold_millis)
+        all_pipelines = cache.get_pipelines(candidate_ids)
+        previous_statuses = cache.get_result_statuses(candidate_ids)
+        print(f'Re-checking {len(all_pipelines)} pipelines that may have changed since the previous incremental run.')
+    print('...')
 
-        # See if the pipeline's last modification is before the threshold
-        if pipeline.last_modified_on < last_modification_date_threshold_millis:
+# Loop through every pipeline
+metrics.start_phase('scan')
+pipelines_scanned = 0
+published_version_lookups = 0
+result_updates = {}
+for pipeline in all_pipelines:
+    pipelines_scanned += 1
+    result = check_pipeline(pipeline)
 
-            last_modified_date = millis_to_datetime_string(pipeline.last_modified_on)
-            is_draft = pipeline.draft
+    # In incremental mode the result is merged into the previous result in the cache. Otherwise, if the
+    # pipeline is not associated with a Job add it to the list of old pipelines, or else to the job report
+    if result is None:
+        continue
+    pipeline_info, job_bound = result
+    if args.incremental:
+        result_updates[pipeline.pipeline_id] = (pipeline_info, pipeline.last_modified_on, job_bound)
+    elif job_bound:
+        record_old_pipeline_used_by_jobs(pipeline_info)
+    else:
+        record_old_pipeline(pipeline_info, pipeline.last_modified_on)
 
-            # Add the pipeline id to the list of old pipelines
-            old_pipelines.append({'pipeline_name': pipeline.name,
-                                  'pipeline_id': pipeline.pipeline_id,
-                                  'last_modified': last_modified_date,
-                                  'version': pipeline.version,
-                                  'is_draft': is_draft})
+metrics.end_phase('scan', items=pipelines_scanned)
+print(f'Fetched the version history of {job_index.commit_lookups + published_version_lookups} pipelines.')
 
+# Merge the re-checked pipelines into the previous result, and record the whole result as before
+if args.incremental:
+    removed_ids = candidate_ids - result_updates.keys() if incremental_merge else set()
+    cache.save_results(results_settings, result_updates, removed_ids, replace=not incremental_merge)
+    if incremental_merge:
+        print("---------------------------------")
+        print_incremental_changes(previous_statuses, {pipeline_id: 'job_bound' if job_bound else 'old'
+                                                      for pipeline_id, (_, _, job_bound) in result_updates.items()})
+    for pipeline_info, last_modified_millis in cache.get_results():
+        record_old_pipeline(pipeline_info, last_modified_millis)
+    for pipeline_info, last_modified_millis in cache.get_results(job_bound=True):
+        record_old_pipeline_used_by_jobs(pipeline_info)
+if cache is not None:
+    cache.close()
+if client is not None:
+    client.close()
 print("---------------------------------")
     # Write the old pipelines to the output file in alphabetical order
     # This will overwrite a pre-existing file of the same name
 
 
-if len(old_pipelines) > 0:
+metrics.start_phase('write_output')
+
+# Write the inventory, sorted by last modified date
+if inventory_writer is not None:
+    if len(inventory_writer) > 0:
+        print(f'Found {len(inventory_writer)} old pipelines not associated with any Jobs.')
+    else:
+        print("No old pipelines not associated with Jobs were found.")
+    print('Writing the inventory of old pipelines to the output file.')
+    metrics.count('write_output', byte_count=inventory_writer.write(output_file))
+
+# In streaming mode the old pipelines have already been written as they were found,
+# so they only need to be sorted into the output file
+elif old_pipelines_writer is not None:
+    print('Sorting the list of old pipelines into the output file.')
+    old_pipelines_count = finish_streaming_output(old_pipelines_writer, output_file)
+    if old_pipelines_count > 0:
+        print(f'Found {old_pipelines_count} old pipelines not associated with any Jobs.')
+    else:
+        print("No old pipelines not associated with Jobs were found.")
+
+elif len(old_pipelines) > 0:
 
     old_pipelines_sorted = sorted(old_pipelines, key=lambda x: x['pipeline_name'])
     # Write to JSON file
     with open(output_file, 'w') as output_file:
         for pipeline in old_pipelines_sorted:
-            pipeline_name = pipeline['pipeline_name']
-            pipeline_id = pipeline['pipeline_id']
-            last_modified = pipeline['last_modified']
-            version = pipeline['version']
-            is_draft = pipeline['is_draft']
-            line = json.dumps({"pipeline_name": pipeline_name, "pipeline_id": pipeline_id,
-                               "last_modified": last_modified, "version": version, "is_draft": is_draft}) + '\n'
+            line = json.dumps(pipeline) + '\n'
             output_file.write(line)
     print(f'Found {len(old_pipelines)} old pipelines not associated with any Jobs.')
     print('Writing the list of old pipelines to the output file.')
 else:
     print("No old pipelines not associated with Jobs were found.")
 
+# Write the old pipelines that are still used by Jobs, along with those Jobs, to the job report file
+if job_report_file is not None:
+    print("---------------------------------")
+    if old_pipelines_used_by_jobs_writer is not None:
+        old_pipelines_used_by_jobs_count = finish_streaming_output(old_pipelines_used_by_jobs_writer, job_report_file)
+    else:
+        with open(job_report_file, 'w') as f:
+            for pipeline in sorted(old_pipelines_used_by_jobs, key=lambda x: x['pipeline_name']):
+                f.write(json.dumps(pipeline) + '\n')
+        old_pipelines_used_by_jobs_count = len(old_pipelines_used_by_jobs)
+    print(f'Found {old_pipelines_used_by_jobs_count} old pipelines that are still associated with Jobs.')
+    print(f"Writing the list of those pipelines and their Jobs to the job report file '{job_report_file}'.")
+
+metrics.end_phase('write_output')
+
+print("---------------------------------")
+metrics.report(args)
 print("---------------------------------")
 print('Done')
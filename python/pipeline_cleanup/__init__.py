@@ -0,0 +1,12 @@
+#################################################################
+# PACKAGE:  pipeline_cleanup
+#
+# DESCRIPTION:    Shared helpers used by the get, export and delete old pipelines scripts.
+#                 resolve_pipeline_infos, export_pipeline_infos and delete_pipeline_infos run the
+#                 steps of the scripts as functions that return their results, and run_script runs
+#                 any of the scripts in the calling process.
+#
+#################################################################
+
+from pipeline_cleanup.runner import SCRIPTS, run_script
+from pipeline_cleanup.steps import resolve_pipeline_infos, export_pipeline_infos, delete_pipeline_infos
@@ -0,0 +1,149 @@
+#################################################################
+# FILE:  archives.py
+#
+# DESCRIPTION:    Helpers for writing pipeline export archives to disk.
+#
+#################################################################
+
+import hashlib, json, os, re, shutil, tempfile, zipfile
+
+# The name of the manifest file written alongside batched exports
+MANIFEST_FILE_NAME = 'manifest.json'
+
+# The name of the journal file that records the outcome of each pipeline's export
+JOURNAL_FILE_NAME = 'export-journal.json'
+
+# The name of the consolidated archive written when all batches are merged into one file
+CONSOLIDATED_ARCHIVE_NAME = 'pipelines.zip'
+
+# Method that returns the name of the archive a single pipeline is exported to. The name includes the
+# UUID of the pipeline ID, so pipelines with the same name never overwrite each other's export
+def get_pipeline_archive_name(the_pipeline_name, the_pipeline_id):
+    return the_pipeline_name.replace('/', '_') + '-' + the_pipeline_id.split(':')[0] + '.zip'
+
+# Method that creates an empty temporary file next to the_path and returns its path. Each call gets a
+# file of its own, so concurrent writers of the same path never write into each other's temporary file
+def create_temp_file(the_path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(the_path) or '.', suffix='.part')
+    os.close(fd)
+    return tmp_path
+
+# Method that removes a temporary file left behind by a failed write, if it is still there
+def remove_temp_file(the_tmp_path):
+    if os.path.exists(the_tmp_path):
+        os.remove(the_tmp_path)
+
+# Method that writes data to a temporary file next to the_path, flushes it to disk and then
+# renames it into place, so a partially written archive is never left behind under its real name
+def write_file_atomically(the_path, data):
+    tmp_path = create_temp_file(the_path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, the_path)
+    except BaseException:
+        remove_temp_file(tmp_path)
+        raise
+
+# Method that appends one JSON line per exported pipeline to the manifest in the_export_dir
+def append_to_manifest(the_export_dir, the_entries):
+    with open(os.path.join(the_export_dir, MANIFEST_FILE_NAME), 'a') as f:
+        for entry in the_entries:
+            f.write(json.dumps(entry) + '\n')
+
+# Method that returns the distinct archive names listed in the manifest in the_export_dir, in the
+# order they were written. Returns an empty list if there is no manifest
+def get_manifest_archive_names(the_export_dir):
+    manifest_path = os.path.join(the_export_dir, MANIFEST_FILE_NAME)
+    if not os.path.isfile(manifest_path):
+        return []
+    names = {}
+    with open(manifest_path, 'r') as f:
+        for line in f:
+            names[json.loads(line)['archive']] = True
+    return list(names)
+
+# Method that returns the highest batch-<n>.zip number listed in the manifest in the_export_dir,
+# or 0 if there are none, so that a resumed export doesn't reuse an existing archive name
+def get_last_batch_number(the_export_dir):
+    numbers = [int(m.group(1)) for m in map(re.compile(r'batch-(\d+)\.zip').fullmatch, get_manifest_archive_names(the_export_dir)) if m]
+    return max(numbers, default=0)
+
+# Method that rewrites the manifest in the_export_dir so every entry points at the_archive_name,
+# used after the batch archives have been merged into a single archive
+def set_manifest_archive(the_export_dir, the_archive_name):
+    manifest_path = os.path.join(the_export_dir, MANIFEST_FILE_NAME)
+    tmp_path = create_temp_file(manifest_path)
+    try:
+        with open(manifest_path, 'r') as src, open(tmp_path, 'w') as dst:
+            for line in src:
+                entry = json.loads(line)
+                entry['archive'] = the_archive_name
+                dst.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, manifest_path)
+    except BaseException:
+        remove_temp_file(tmp_path)
+        raise
+
+# Method that returns the number of pipelines listed in the manifest in the_export_dir, or 0 if there is no manifest
+def count_manifest_entries(the_export_dir):
+    manifest_path = os.path.join(the_export_dir, MANIFEST_FILE_NAME)
+    if not os.path.isfile(manifest_path):
+        return 0
+    with open(manifest_path, 'r') as f:
+        return sum(1 for line in f if line.strip())
+
+# Method that returns the sha256 of a member of an open zip file, read a block at a time
+def hash_archive_member(the_archive, the_member):
+    digest = hashlib.sha256()
+    with the_archive.open(the_member) as src:
+        for block in iter(lambda: src.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Method that merges the members of the_archive_paths into a single zip file at the_output_path.
+# Members are copied one at a time, so memory use does not depend on archive size. A member is only
+# skipped if a member with the same name and the same content has already been written, such as a
+# fragment shared by several pipelines. A member whose name is taken by different content, such as
+# another pipeline with the same name, is written under its name with the start of its content hash
+# appended. The merged archive is only moved into place once it holds the content of every member of
+# the_archive_paths and at least the_expected_count members, one per exported pipeline; otherwise a
+# ValueError is raised and the_output_path is left as it was. Returns the number of members written.
+def consolidate_archives(the_archive_paths, the_output_path, the_expected_count=0):
+    written = {}
+    source_hashes = set()
+    tmp_path = create_temp_file(the_output_path)
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as output:
+            for archive_path in the_archive_paths:
+                with zipfile.ZipFile(archive_path) as archive:
+                    for member in archive.infolist():
+                        member_hash = hash_archive_member(archive, member)
+                        source_hashes.add(member_hash)
+                        name = member.filename
+                        if written.get(name) == member_hash:
+                            continue
+                        if name in written:
+                            stem, extension = os.path.splitext(name)
+                            name = f"{stem}-{member_hash[:8]}{extension}"
+                            if written.get(name) == member_hash:
+                                continue
+                        written[name] = member_hash
+                        with archive.open(member) as src, output.open(name, 'w') as dst:
+                            shutil.copyfileobj(src, dst)
+
+        # Check the merged archive before the archives it was merged from can be removed
+        with zipfile.ZipFile(tmp_path) as output:
+            output_hashes = {hash_archive_member(output, member) for member in output.infolist()}
+            member_count = len(output.infolist())
+        missing_count = len(source_hashes - output_hashes)
+        if missing_count > 0 or member_count < the_expected_count:
+            raise ValueError(f"The merged archive would hold {member_count} members for {the_expected_count} exported "
+                             f"pipelines and is missing {missing_count} of the merged members")
+        os.replace(tmp_path, the_output_path)
+    except BaseException:
+        remove_temp_file(tmp_path)
+        raise
+    return member_count
@@ -0,0 +1,56 @@
+#################################################################
+# FILE:  associations.py
+#
+# DESCRIPTION:    An index of which Control Hub Jobs use which pipelines, used to find the old
+#                 pipelines that are not associated with any Job.
+#
+#################################################################
+
+from pipeline_cleanup import metrics
+from pipeline_cleanup.models import get_job_id
+
+# The Job/Pipeline association index built from the Jobs in Control Hub. It holds a dict of
+# commit_id -> list of Jobs using that pipeline version, a dict of pipeline_id -> list of Jobs using
+# any version of that pipeline, and a set of the commit IDs of Jobs that do not record which
+# pipeline_id they were created from
+class JobAssociationIndex:
+
+    def __init__(self, the_jobs):
+        self.jobs_by_commit_id = {}
+        self.jobs_by_pipeline_id = {}
+        self.unmatched_commit_ids = set()
+        # The number of pipelines whose versions had to be fetched from Control Hub
+        self.commit_lookups = 0
+        for job in the_jobs:
+            job_info = {'job_name': job.job_name, 'job_id': get_job_id(job)}
+            self.jobs_by_commit_id.setdefault(job.commit_id, []).append(job_info)
+            if job.pipeline_id is None:
+                self.unmatched_commit_ids.add(job.commit_id)
+            else:
+                self.jobs_by_pipeline_id.setdefault(job.pipeline_id, []).append(job_info)
+
+    # Method that returns the list of Jobs that use any version of the pipeline, or an empty list
+    # if the pipeline is not associated with any Job
+    def get_jobs_for_pipeline(self, the_pipeline):
+
+        # Jobs record the pipeline_id they were created from, so this is usually a single dict lookup
+        jobs = self.jobs_by_pipeline_id.get(the_pipeline.pipeline_id)
+        if jobs:
+            return jobs
+
+        # Only Jobs without a pipeline_id require looking at the pipeline's versions, which costs
+        # a call to Control Hub per pipeline. Once every such Job has been matched to a pipeline
+        # there is nothing left to look for
+        if len(self.unmatched_commit_ids) == 0:
+            return []
+
+        self.commit_lookups += 1
+        with metrics.timed('pipeline.commits'):
+            commits = the_pipeline.commits
+        # Different versions of the pipeline may each be used by Jobs, so every version is matched
+        jobs = []
+        for commit in commits:
+            if commit.commit_id in self.unmatched_commit_ids:
+                self.unmatched_commit_ids.discard(commit.commit_id)
+                jobs.extend(self.jobs_by_commit_id[commit.commit_id])
+        return jobs
@@ -0,0 +1,227 @@
+#################################################################
+# FILE:  async_client.py
+#
+# DESCRIPTION:    An asyncio client for the handful of Control Hub REST endpoints the cleanup
+#                 scripts use: listing pipelines and Jobs, reading a pipeline's versions, searching
+#                 by pipeline_id, exporting and deleting. get-old-pipelines.py --async-http lists
+#                 with it, export-old-pipelines.py --async-http streams its exports to disk with it
+#                 and delete-old-pipelines.py --async-http looks up and deletes pipelines with it.
+#                 Requests share one pooled keep-alive session, with up to 'concurrency' of them in
+#                 flight at once, and the pages of a listing are all requested at once.
+#
+#                 The calls are blocking calls of the requests library, which the StreamSets SDK
+#                 already depends on, run on a thread pool sized to the connection pool, so no extra
+#                 packages are needed. Authentication uses the same CRED_ID and CRED_TOKEN API
+#                 credentials as the SDK, sent as headers on each request, so there is no separate
+#                 login round trip.
+#
+#################################################################
+
+import asyncio, base64, functools, json, os, threading, weakref
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from pipeline_cleanup.archives import create_temp_file, remove_temp_file
+from pipeline_cleanup.concurrency import call_with_retry
+from pipeline_cleanup.connection import DEFAULT_SCH_URL
+from pipeline_cleanup.resolver import DEFAULT_BATCH_SIZE, build_pipeline_id_query
+
+# The number of objects to request per page when listing
+PAGE_SIZE = 50
+
+# The default number of requests in flight at once
+DEFAULT_CONCURRENCY = 8
+
+# The REST endpoints used by the SDK for the same operations
+PIPELINES_PATH = '/pipelinestore/rest/v1/pipelines'
+PIPELINES_SEARCH_PATH = '/pipelinestore/rest/v1/saql/pipelines/search'
+PIPELINE_PATH = '/pipelinestore/rest/v1/pipeline/'
+JOBS_PATH = '/jobrunner/rest/v1/jobs'
+EXPORT_PATH = '/pipelinestore/rest/v1/pipelines/exportPipelineCommits'
+DELETE_PATH = '/pipelinestore/rest/v1/pipeline/'
+BULK_DELETE_PATH = '/pipelinestore/rest/v1/pipelines/deletePipelines'
+
+# Method that returns the organization ID from the 'o' claim of an API credential token, which is a JWT
+def get_organization_from_token(the_token):
+    payload = the_token.split('.')[1]
+    payload += '=' * (-len(payload) % 4)
+    return json.loads(base64.urlsafe_b64decode(payload))['o']
+
+# A version (commit) of a pipeline returned by the REST API, with the same attributes as the SDK's
+class RestCommit:
+
+    def __init__(self, data):
+        self.commit_id = data.get('commitId')
+        self.version = data.get('version')
+        self.commit_time = data.get('commitTime')
+
+# A pipeline returned by the REST API, with the same attributes the scripts use on SDK pipelines.
+# As with the SDK, its versions are fetched from Control Hub when commits is read
+class RestPipeline:
+
+    def __init__(self, data, client=None):
+        self._client = client
+        self.pipeline_id = data.get('pipelineId')
+        self.commit_id = data.get('commitId')
+        self.name = data.get('name')
+        self.version = data.get('version')
+        self.last_modified_on = data.get('lastModifiedOn')
+        self.draft = data.get('draft', str(self.version).endswith('DRAFT'))
+        self.labels = [label.get('label') for label in data.get('pipelineLabels') or []]
+        self.creator = data.get('creator')
+        self.executor_type = data.get('executorType')
+
+    @property
+    def commits(self):
+        return self._client.get_pipeline_commits(self.pipeline_id)
+
+# A Job returned by the REST API, with the same attributes the scripts use on SDK Jobs
+class RestJob:
+
+    def __init__(self, data):
+        self.id = data.get('id')
+        self.job_name = data.get('name')
+        self.pipeline_id = data.get('pipelineId')
+        self.commit_id = data.get('pipelineCommitId')
+        self.last_modified_on = data.get('lastModifiedOn')
+
+class AsyncControlHubClient:
+
+    def __init__(self, credential_id, token, server_url=None, concurrency=DEFAULT_CONCURRENCY,
+                 rate_limiter=None, max_retries=5, timeout=300):
+        self.server_url = (server_url or os.getenv('SCH_URL') or DEFAULT_SCH_URL).rstrip('/')
+        self.organization = get_organization_from_token(token)
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'X-SS-App-Component-Id': credential_id,
+                                     'X-SS-App-Auth-Token': token,
+                                     'X-SS-Org-Id': self.organization,
+                                     'X-SS-REST-CALL': 'true',
+                                     'X-Requested-By': 'pipeline_cleanup',
+                                     'Content-Type': 'application/json'})
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.semaphores = weakref.WeakKeyDictionary()
+        self.semaphores_lock = threading.Lock()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    # Method that sends one request, raising requests.HTTPError on a non-2xx response
+    def _send(self, method, path, **kwargs):
+        response = self.session.request(method, self.server_url + path, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response
+
+    # Method that runs a blocking function on the client's thread pool, at most 'concurrency' at a time,
+    # counting each attempt under the endpoint name in the metrics. Each event loop gets its own semaphore,
+    # so the client can be used across asyncio.run calls and from the scripts' worker threads
+    async def _run(self, fn, *args, endpoint=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        with self.semaphores_lock:
+            semaphore = self.semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self.semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        async with semaphore:
+            call = functools.partial(call_with_retry, fn, *args, rate_limiter=self.rate_limiter,
+                                     max_retries=self.max_retries, endpoint=endpoint, **kwargs)
+            return await loop.run_in_executor(self.executor, call)
+
+    # Method that sends one request and returns its decoded JSON body
+    async def _request_json(self, method, path, endpoint=None, **kwargs):
+        response = await self._run(self._send, method, path, endpoint=endpoint, **kwargs)
+        return response.json() if response.content else None
+
+    # Method that lists every object at the_path. The first page is fetched to learn the total count,
+    # then the remaining pages are all requested concurrently
+    async def _list_paged(self, the_path, the_params, the_endpoint):
+        first = await self._request_json('GET', the_path, endpoint=the_endpoint,
+                                         params=dict(the_params, offset=0, len=PAGE_SIZE))
+        if isinstance(first, list):
+            return first
+        data = list(first.get('data') or [])
+        total = first.get('totalCount') or len(data)
+        pages = await asyncio.gather(*[self._request_json('GET', the_path, endpoint=the_endpoint,
+                                                          params=dict(the_params, offset=offset, len=PAGE_SIZE))
+                                       for offset in range(PAGE_SIZE, total, PAGE_SIZE)])
+        for page in pages:
+            data.extend(page.get('data') or [])
+        return data
+
+    # Method that lists every pipeline, or only those matching a search query
+    async def list_pipelines(self, search=None):
+        if search is None:
+            data = await self._list_paged(PIPELINES_PATH, {}, 'pipelines.get_all')
+        else:
+            data = await self._list_paged(PIPELINES_SEARCH_PATH, {'search': search, 'orgId': self.organization},
+                                          'pipelines.get_all')
+        return [RestPipeline(d, self) for d in data]
+
+    # Method that lists every Job
+    async def list_jobs(self):
+        return [RestJob(d) for d in await self._list_paged(JOBS_PATH, {}, 'jobs.get_all')]
+
+    # Method that returns the versions of a pipeline. Like the SDK's pipeline.commits, which RestPipeline
+    # calls it for, it blocks until the response arrives, so it can be called from any thread
+    def get_pipeline_commits(self, the_pipeline_id):
+        response = call_with_retry(self._send, 'GET', PIPELINE_PATH + the_pipeline_id + '/log', endpoint='pipeline.commits',
+                                   rate_limiter=self.rate_limiter, max_retries=self.max_retries)
+        return [RestCommit(d) for d in response.json() or []]
+
+    # Method that looks up the given pipeline IDs with batch_size IDs per search, running the searches
+    # concurrently. Returns a tuple of (a dict of pipeline_id -> pipeline for the pipelines that were
+    # found, a dict of pipeline_id -> error message for those that could not be retrieved)
+    async def get_pipelines_by_id(self, the_pipeline_ids, batch_size=DEFAULT_BATCH_SIZE):
+        unique_ids = list(dict.fromkeys(the_pipeline_ids))
+        batches = [unique_ids[i:i + batch_size] for i in range(0, len(unique_ids), batch_size)]
+        results = await asyncio.gather(*[self.list_pipelines(build_pipeline_id_query(batch)) for batch in batches],
+                                       return_exceptions=True)
+        found = {}
+        errors = {}
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                for pipeline_id in batch:
+                    errors[pipeline_id] = str(result)
+                continue
+            for pipeline in result:
+                found.setdefault(pipeline.pipeline_id, pipeline)
+        return found, errors
+
+    # Method that exports the given pipelines (SDK or REST pipelines at the versions to export) and streams
+    # the archive straight to the_path, writing to a temp file first and renaming it into place once
+    # complete. Returns the size of the archive in bytes
+    async def export_pipelines_to_file(self, the_pipelines, the_path, fragments=True):
+        params = {'fragments': str(fragments).lower(), 'includePlainTextCredentials': 'false'}
+        body = json.dumps([p.commit_id for p in the_pipelines])
+
+        def export():
+            tmp_path = create_temp_file(the_path)
+            try:
+                with self._send('POST', EXPORT_PATH, params=params, data=body, stream=True) as response:
+                    with open(tmp_path, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=1024 * 1024):
+                            f.write(chunk)
+                        f.flush()
+                        os.fsync(f.fileno())
+                os.replace(tmp_path, the_path)
+            except BaseException:
+                remove_temp_file(tmp_path)
+                raise
+            return os.path.getsize(the_path)
+
+        return await self._run(export, endpoint='export_pipelines')
+
+    # Method that deletes every version of a pipeline
+    async def delete_pipeline(self, the_pipeline):
+        await self._request_json('DELETE', DELETE_PATH + the_pipeline.pipeline_id, endpoint='delete_pipeline')
+
+    # Method that deletes every version of each of the given pipelines with a single request
+    async def delete_pipelines(self, the_pipelines):
+        await self._request_json('POST', BULK_DELETE_PATH, endpoint='delete_pipelines',
+                                 data=json.dumps([p.pipeline_id for p in the_pipelines]))
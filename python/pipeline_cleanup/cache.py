@@ -0,0 +1,341 @@
+#################################################################
+# FILE:  cache.py
+#
+# DESCRIPTION:    A local SQLite cache of Control Hub pipeline, pipeline version (commit) and Job
+#                 metadata, shared by the get, export and delete old pipelines scripts.
+#
+#                 Each refresh only fetches the pipelines and Jobs modified since the newest
+#                 last_modified_on already in the cache. Deletions can't be seen that way, so once
+#                 the cache is older than its TTL the next refresh re-reads everything.
+#
+#                 The cache can also keep the result of the previous get-old-pipelines.py --incremental
+#                 run, so the next run only has to re-check the pipelines that the refresh changed.
+#
+#################################################################
+
+import json, os, sqlite3, threading, time
+from requests.exceptions import HTTPError
+from pipeline_cleanup import metrics
+from pipeline_cleanup.models import get_job_id, get_label_names, get_pipeline_id
+from pipeline_cleanup.scan import list_all, list_sharded
+
+# The default number of hours after which the next refresh is a full refresh
+DEFAULT_TTL_HOURS = 24
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pipelines (
+    pipeline_id      TEXT PRIMARY KEY,
+    commit_id        TEXT,
+    name             TEXT,
+    version          TEXT,
+    draft            INTEGER,
+    last_modified_on INTEGER,
+    labels           TEXT,
+    creator          TEXT,
+    executor_type    TEXT,
+    commits_fetched  INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS pipelines_last_modified_on ON pipelines (last_modified_on);
+CREATE TABLE IF NOT EXISTS commits (
+    commit_id   TEXT PRIMARY KEY,
+    pipeline_id TEXT,
+    version     TEXT,
+    commit_time INTEGER
+);
+CREATE INDEX IF NOT EXISTS commits_pipeline_id ON commits (pipeline_id);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id           TEXT PRIMARY KEY,
+    job_name         TEXT,
+    pipeline_id      TEXT,
+    commit_id        TEXT,
+    last_modified_on INTEGER
+);
+CREATE TABLE IF NOT EXISTS results (
+    pipeline_id      TEXT PRIMARY KEY,
+    pipeline_name    TEXT,
+    last_modified_on INTEGER,
+    job_bound        INTEGER,
+    info             TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+# Method that returns a search query for the objects modified after the_millis. Control Hub's search
+# language calls the last_modified_on attribute modified_on
+def build_modified_since_query(the_millis):
+    return 'modified_on>' + str(the_millis)
+
+# A pipeline version read from the cache, with the same attributes the scripts use on SDK commits
+class CachedCommit:
+
+    def __init__(self, commit_id, version, commit_time):
+        self.commit_id = commit_id
+        self.version = version
+        self.commit_time = commit_time
+
+# A Job read from the cache, with the same attributes the scripts use on SDK Jobs
+class CachedJob:
+
+    def __init__(self, job_id, job_name, pipeline_id, commit_id, last_modified_on):
+        self.job_id = job_id
+        self.job_name = job_name
+        self.pipeline_id = pipeline_id
+        self.commit_id = commit_id
+        self.last_modified_on = last_modified_on
+
+# A pipeline read from the cache, with the same attributes the scripts use on SDK pipelines.
+# Its commits are read from the cache, and fetched from Control Hub the first time they are needed
+class CachedPipeline:
+
+    def __init__(self, cache, row):
+        self._cache = cache
+        (self.pipeline_id, self.commit_id, self.name, self.version, draft, self.last_modified_on,
+         labels, self.creator, self.executor_type) = row
+        self.draft = bool(draft)
+        self.labels = json.loads(labels) if labels else []
+
+    @property
+    def commits(self):
+        return self._cache.get_commits(self)
+
+# The cache itself. All methods are safe to call from worker threads
+class MetadataCache:
+
+    def __init__(self, the_path, ttl_hours=DEFAULT_TTL_HOURS):
+        parent_dir = os.path.dirname(os.path.abspath(the_path))
+        os.makedirs(parent_dir, exist_ok=True)
+        self.path = the_path
+        self.ttl_millis = int(ttl_hours * 3600 * 1000)
+        self.sch = None
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(the_path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+        # What the last refresh changed: whether it was a full refresh, the IDs of the pipelines it fetched,
+        # and the pipeline IDs and commit IDs that the Jobs it fetched referred to, before and after
+        self.last_refresh_was_full = True
+        self.changed_pipeline_ids = set()
+        self.changed_job_references = set()
+
+    def close(self):
+        self.db.close()
+
+    def _get_meta(self, key):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    # Method that returns True if the cache has been fully refreshed within its TTL
+    def is_fresh(self):
+        refreshed_at = self._get_meta('full_refresh_time')
+        return refreshed_at is not None and int(time.time() * 1000) - int(refreshed_at) < self.ttl_millis
+
+    # Method that brings the cache up to date with Control Hub. Returns a tuple of the number of
+    # pipelines and Jobs that were fetched. If the cache is within its TTL, only the objects modified
+    # since the last refresh are fetched; otherwise, or if full is True, everything is re-read.
+    # A full refresh lists each collection in 'shards' concurrent shards
+    def refresh(self, sch, full=False, shards=1):
+        self.sch = sch
+        with self.lock:
+            full = full or not self.is_fresh()
+            started_at = int(time.time() * 1000)
+            pipelines = self._fetch_modified(sch.pipelines, 'pipelines', get_pipeline_id, full, shards)
+            jobs = self._fetch_modified(sch.jobs, 'jobs', get_job_id, full, shards)
+            self.last_refresh_was_full = full
+            self.changed_pipeline_ids = {pipeline.pipeline_id for pipeline in pipelines}
+            self.changed_job_references = set()
+            if full:
+                self.db.execute('DELETE FROM pipelines')
+                self.db.execute('DELETE FROM commits')
+                self.db.execute('DELETE FROM jobs')
+            for pipeline in pipelines:
+                self._put_pipeline(pipeline)
+            for job in jobs:
+                previous = self.db.execute('SELECT pipeline_id, commit_id FROM jobs WHERE job_id = ?',
+                                           (get_job_id(job),)).fetchone()
+                self.changed_job_references.update(previous or ())
+                self.changed_job_references.update((job.pipeline_id, job.commit_id))
+                self.db.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?)',
+                                (get_job_id(job), job.job_name, job.pipeline_id, job.commit_id,
+                                 getattr(job, 'last_modified_on', None)))
+            if full:
+                self._set_meta('full_refresh_time', started_at)
+            self.db.commit()
+            return len(pipelines), len(jobs)
+
+    # Method that attaches the cache to a Control Hub connection without refreshing it, so that
+    # commits that aren't cached yet can still be fetched
+    def attach(self, sch):
+        self.sch = sch
+
+    # Method that returns the objects in the_collection (sch.pipelines or sch.jobs) that were modified
+    # after the newest last_modified_on in the_table, or all of them if full is True. If Control Hub
+    # rejects the search with an HTTP error, every object is listed and filtered locally instead
+    def _fetch_modified(self, the_collection, the_table, the_get_id, full, shards):
+        watermark = None if full else self.db.execute(f'SELECT MAX(last_modified_on) FROM {the_table}').fetchone()[0]
+        if watermark is None:
+            return list_sharded(the_collection, the_get_id, shards, the_endpoint=the_table + '.get_all', the_name=the_table)
+        try:
+            with metrics.timed(the_table + '.get_all'):
+                return list(the_collection.get_all(search=build_modified_since_query(watermark)))
+        except HTTPError:
+            return [o for o in list_all(the_collection, the_table + '.get_all')
+                    if (getattr(o, 'last_modified_on', None) or 0) > watermark]
+
+    def _put_pipeline(self, pipeline):
+        existing = self.db.execute('SELECT last_modified_on FROM pipelines WHERE pipeline_id = ?',
+                                   (pipeline.pipeline_id,)).fetchone()
+        if existing is not None and existing[0] != pipeline.last_modified_on:
+            # The pipeline has changed since its commits were cached
+            self.db.execute('DELETE FROM commits WHERE pipeline_id = ?', (pipeline.pipeline_id,))
+        self.db.execute('INSERT OR REPLACE INTO pipelines VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)',
+                        (pipeline.pipeline_id, pipeline.commit_id, pipeline.name, pipeline.version,
+                         int(bool(pipeline.draft)), pipeline.last_modified_on,
+                         json.dumps(get_label_names(pipeline)),
+                         getattr(pipeline, 'creator', None), getattr(pipeline, 'executor_type', None)))
+
+    # Method that returns all of the cached pipelines
+    def pipelines(self):
+        with self.lock:
+            rows = self.db.execute('SELECT pipeline_id, commit_id, name, version, draft, last_modified_on, labels, '
+                                   'creator, executor_type FROM pipelines').fetchall()
+        return [CachedPipeline(self, row) for row in rows]
+
+    # Method that returns all of the cached Jobs
+    def jobs(self):
+        with self.lock:
+            rows = self.db.execute('SELECT job_id, job_name, pipeline_id, commit_id, last_modified_on FROM jobs '
+                                   'ORDER BY job_id').fetchall()
+        return [CachedJob(*row) for row in rows]
+
+    # Method that returns the commits of a pipeline (an SDK or cached pipeline) from the cache. If they
+    # have not been cached yet they are fetched from Control Hub and cached. A cached pipeline that is
+    # no longer in Control Hub, such as one deleted outside of these scripts, is removed from the cache
+    # and has no commits
+    def get_commits(self, the_pipeline):
+        with self.lock:
+            row = self.db.execute('SELECT commits_fetched, last_modified_on FROM pipelines WHERE pipeline_id = ?',
+                                  (the_pipeline.pipeline_id,)).fetchone()
+            if row is not None and row[0] and row[1] == the_pipeline.last_modified_on:
+                rows = self.db.execute('SELECT commit_id, version, commit_time FROM commits WHERE pipeline_id = ?',
+                                       (the_pipeline.pipeline_id,)).fetchall()
+                return [CachedCommit(*r) for r in rows]
+
+        # Fetch outside of the lock so other threads aren't blocked on the network call
+        if self.sch is None:
+            raise RuntimeError(f"The versions of pipeline '{the_pipeline.pipeline_id}' are not in the cache")
+        sdk_pipeline = the_pipeline
+        if isinstance(the_pipeline, CachedPipeline):
+            query = 'pipeline_id=="' + the_pipeline.pipeline_id + '"'
+            with metrics.timed('pipelines.get_all'):
+                matches = self.sch.pipelines.get_all(search=query)
+            if len(matches) == 0:
+                self.remove_pipeline(the_pipeline.pipeline_id)
+                return []
+            sdk_pipeline = matches[0]
+        with metrics.timed('pipeline.commits'):
+            commits = [CachedCommit(c.commit_id, c.version, c.commit_time) for c in sdk_pipeline.commits or []]
+
+        with self.lock:
+            if not isinstance(the_pipeline, CachedPipeline):
+                self._put_pipeline(the_pipeline)
+            self.db.execute('DELETE FROM commits WHERE pipeline_id = ?', (the_pipeline.pipeline_id,))
+            self.db.executemany('INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?)',
+                                [(c.commit_id, the_pipeline.pipeline_id, c.version, c.commit_time) for c in commits])
+            self.db.execute('UPDATE pipelines SET commits_fetched = 1 WHERE pipeline_id = ?', (the_pipeline.pipeline_id,))
+            self.db.commit()
+        return commits
+
+    # Method that returns the cached commits of the pipeline with the_pipeline_id, or None if they have not been cached
+    def get_cached_commits(self, the_pipeline_id):
+        with self.lock:
+            row = self.db.execute('SELECT commits_fetched FROM pipelines WHERE pipeline_id = ?', (the_pipeline_id,)).fetchone()
+            if row is None or not row[0]:
+                return None
+            rows = self.db.execute('SELECT commit_id, version, commit_time FROM commits WHERE pipeline_id = ?',
+                                   (the_pipeline_id,)).fetchall()
+        return [CachedCommit(*r) for r in rows]
+
+    # Method that removes a pipeline that has been deleted from Control Hub from the cache
+    def remove_pipeline(self, the_pipeline_id):
+        with self.lock:
+            self.db.execute('DELETE FROM commits WHERE pipeline_id = ?', (the_pipeline_id,))
+            self.db.execute('DELETE FROM pipelines WHERE pipeline_id = ?', (the_pipeline_id,))
+            self.db.execute('DELETE FROM results WHERE pipeline_id = ?', (the_pipeline_id,))
+            self.db.commit()
+
+    # Method that returns the cached pipelines with the_pipeline_ids. IDs that are not in the cache are left out
+    def get_pipelines(self, the_pipeline_ids):
+        with self.lock:
+            self.db.execute('CREATE TEMP TABLE IF NOT EXISTS wanted_ids (pipeline_id TEXT PRIMARY KEY)')
+            self.db.execute('DELETE FROM wanted_ids')
+            self.db.executemany('INSERT OR IGNORE INTO wanted_ids VALUES (?)', [(i,) for i in the_pipeline_ids])
+            rows = self.db.execute('SELECT p.pipeline_id, commit_id, name, version, draft, last_modified_on, labels, '
+                                   'creator, executor_type FROM pipelines p JOIN wanted_ids USING (pipeline_id)').fetchall()
+        return [CachedPipeline(self, row) for row in rows]
+
+    # Method that returns the settings that the saved results were found with, as written by
+    # save_results, or None if no results have been saved
+    def get_results_settings(self):
+        settings = self._get_meta('results_settings')
+        return None if settings is None else json.loads(settings)
+
+    # Method that returns a dict of pipeline_id -> 'old' or 'job_bound' for the saved results
+    # among the_pipeline_ids
+    def get_result_statuses(self, the_pipeline_ids):
+        statuses = {}
+        with self.lock:
+            for pipeline_id, job_bound in self.db.execute('SELECT pipeline_id, job_bound FROM results'):
+                if pipeline_id in the_pipeline_ids:
+                    statuses[pipeline_id] = 'job_bound' if job_bound else 'old'
+        return statuses
+
+    # Method that returns the IDs of the pipelines whose result may differ from the saved results, given
+    # the threshold of the saved results and the new threshold, both in millis: the pipelines that the last
+    # refresh fetched, those that the Jobs it fetched refer to or used to refer to, those that the new
+    # threshold makes old or no longer old, and saved results that are no longer in the cache
+    def get_incremental_candidates(self, the_previous_threshold, the_threshold):
+        with self.lock:
+            candidates = set(self.changed_pipeline_ids)
+            references = list(self.changed_job_references - {None})
+            for i in range(0, len(references), 500):
+                batch = references[i:i + 500]
+                marks = ','.join('?' * len(batch))
+                candidates.update(r[0] for r in self.db.execute(
+                    f'SELECT pipeline_id FROM pipelines WHERE pipeline_id IN ({marks}) OR commit_id IN ({marks})', batch + batch))
+                candidates.update(r[0] for r in self.db.execute(
+                    f'SELECT pipeline_id FROM commits WHERE commit_id IN ({marks})', batch))
+            low, high = min(the_previous_threshold, the_threshold), max(the_previous_threshold, the_threshold)
+            candidates.update(r[0] for r in self.db.execute(
+                'SELECT pipeline_id FROM pipelines WHERE last_modified_on >= ? AND last_modified_on < ?', (low, high)))
+            candidates.update(r[0] for r in self.db.execute(
+                'SELECT pipeline_id FROM results WHERE pipeline_id NOT IN (SELECT pipeline_id FROM pipelines)'))
+        return candidates
+
+    # Method that saves the result of a get-old-pipelines.py run, found with the_settings (a dict that
+    # includes the threshold). the_updates is a dict of pipeline_id -> a tuple of (pipeline info, last
+    # modified millis, True if the pipeline is used by Jobs), and the_removed_ids are pipelines that are
+    # no longer in the result. If replace is True the previous results are discarded first
+    def save_results(self, the_settings, the_updates, the_removed_ids, replace=False):
+        with self.lock:
+            if replace:
+                self.db.execute('DELETE FROM results')
+            self.db.executemany('DELETE FROM results WHERE pipeline_id = ?', [(i,) for i in the_removed_ids])
+            self.db.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                                [(pipeline_id, info['pipeline_name'], millis, int(job_bound), json.dumps(info))
+                                 for pipeline_id, (info, millis, job_bound) in the_updates.items()])
+            self._set_meta('results_settings', json.dumps(the_settings, sort_keys=True))
+            self.db.commit()
+
+    # Method that returns the saved results, as a list of (pipeline info, last modified millis) tuples sorted by
+    # pipeline name: the old pipelines that are not used by Jobs, or if job_bound is True, those that are
+    def get_results(self, job_bound=False):
+        with self.lock:
+            rows = self.db.execute('SELECT info, last_modified_on FROM results WHERE job_bound = ? '
+                                   'ORDER BY pipeline_name', (int(job_bound),)).fetchall()
+        return [(json.loads(info), millis) for info, millis in rows]
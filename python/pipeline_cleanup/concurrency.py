@@ -0,0 +1,84 @@
+#################################################################
+# FILE:  concurrency.py
+#
+# DESCRIPTION:    Helpers for running Control Hub calls on a bounded pool of worker threads
+#                 with client-side rate limiting and retries on throttled or failed requests.
+#
+#################################################################
+
+import random, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pipeline_cleanup import metrics
+
+# HTTP status codes that are worth retrying: throttling and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# A thread-safe token bucket. Tokens are added at 'rate' per second up to 'capacity',
+# and acquire() blocks until a token is available. A rate of None or 0 disables limiting.
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate or 1)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Method that returns the HTTP status code carried by an exception raised by the SDK
+# (which raises requests.HTTPError subclasses), or None if there isn't one
+def get_status_code(ex):
+    response = getattr(ex, 'response', None)
+    return getattr(response, 'status_code', None)
+
+# Method that calls fn(*args, **kwargs), waiting on the rate limiter before each attempt and
+# retrying with exponential backoff and jitter if the call fails with a retryable status code.
+# Any other exception, or the last retryable one, is raised to the caller. If an endpoint name
+# is given, each attempt is counted and timed under it in the metrics
+def call_with_retry(fn, *args, rate_limiter=None, max_retries=5, base_delay=1.0, max_delay=30.0, endpoint=None, **kwargs):
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            if endpoint is None:
+                return fn(*args, **kwargs)
+            with metrics.timed(endpoint):
+                return fn(*args, **kwargs)
+        except Exception as ex:
+            if attempt >= max_retries or get_status_code(ex) not in RETRYABLE_STATUS_CODES:
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            time.sleep(delay / 2 + random.uniform(0, delay / 2))
+            attempt += 1
+
+# Method that runs fn on each item on a pool of 'workers' threads and yields (item, result)
+# tuples in the same order as the input items. At most a few items per worker are in flight
+# at a time, so the input can be an arbitrarily long iterator such as the lines of a file.
+# If fn raises an exception it is re-raised when that item's turn comes to be yielded.
+def map_in_order(fn, items, workers):
+    max_in_flight = workers * 4
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            in_flight.append((item, executor.submit(fn, item)))
+            if len(in_flight) >= max_in_flight:
+                item, future = in_flight.popleft()
+                yield item, future.result()
+        while in_flight:
+            item, future = in_flight.popleft()
+            yield item, future.result()
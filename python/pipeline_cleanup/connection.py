@@ -0,0 +1,29 @@
+#################################################################
+# FILE:  connection.py
+#
+# DESCRIPTION:    Connecting to Control Hub. The StreamSets SDK takes seconds to import, so it is only
+#                 imported here, once a script has validated its arguments and inputs and is about to
+#                 connect. Mistakes in the arguments are reported at once, and --dry-run never imports it.
+#
+#################################################################
+
+import os
+
+# The default Control Hub URL, used by the async HTTP client unless the SCH_URL environment variable is set
+DEFAULT_SCH_URL = 'https://na01.hub.streamsets.com'
+
+# Method that returns a tuple of the API credentials from the CRED_ID and CRED_TOKEN environment variables
+def get_credentials():
+    return os.getenv('CRED_ID'), os.getenv('CRED_TOKEN')
+
+# Method that checks that the API credentials are set. Returns True if they are or False otherwise
+def validate_credentials(the_cred_id, the_cred_token):
+    if not the_cred_id or not the_cred_token:
+        print("Error: Export the environment variables CRED_ID and CRED_TOKEN with the StreamSets Platform API Credentials")
+        return False
+    return True
+
+# Method that imports the SDK and connects to Control Hub with the API credentials
+def connect_to_control_hub(the_cred_id, the_cred_token):
+    from streamsets.sdk import ControlHub
+    return ControlHub(credential_id=the_cred_id, token=the_cred_token)
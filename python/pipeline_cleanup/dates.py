@@ -0,0 +1,45 @@
+#################################################################
+# FILE:  dates.py
+#
+# DESCRIPTION:    Conversions between epoch millis and the date strings that the scripts read and
+#                 write, and the checks of the last_modification_date_threshold parameter.
+#
+#################################################################
+
+import time
+from datetime import date, datetime, timedelta
+
+# Method to convert millis to the datetime string that get-old-pipelines.py writes. time.strftime gives
+# the same result as formatting a datetime, in half the time
+def millis_to_datetime_string(millis):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(millis / 1000.0))
+
+# Method to convert datetime string to millis
+def convert_datetime_string_to_millis(datetime_string):
+    try:
+        dt = datetime.strptime(datetime_string, "%Y-%m-%d")
+        millis = int(dt.timestamp() * 1000)
+        return millis
+    except Exception as e:
+        print(f"Error: Error converting \'{datetime_string}\' to millis: \'{e}\'.")
+    return None
+
+# Method that validates the last_modification_date_threshold parameter is a valid date
+def is_valid_date(the_date_str):
+    try:
+        # This line will throw an exception if the date string is not valid
+        datetime.strptime(the_date_str, "%Y-%m-%d")
+        return True
+    except ValueError:
+        print(f"Error: The last_modification_date_threshold parameter \'{the_date_str}\' is not a valid date in yyyy-mm-dd format.")
+    return False
+
+# Method that validates that the last_modification_date_threshold parameter is at
+# least one day behind the current date.
+def date_is_at_least_one_day_old(the_date_str):
+    the_date = datetime.strptime(the_date_str, "%Y-%m-%d")
+    if the_date.date() <= date.today() - timedelta(days=1):
+        return True
+    else:
+        print(f"Error: The last_modification_date_threshold parameter \'{the_date_str}\' is not at least one day earlier than the current date.")
+    return False
@@ -0,0 +1,59 @@
+#################################################################
+# FILE:  deletion.py
+#
+# DESCRIPTION:    Batched deletion of pipelines for delete-old-pipelines.py, and the structured
+#                 result file it writes once the deletions have been verified.
+#
+#                 The SDK only deletes one pipeline per call, so a batch is sent to Control Hub's
+#                 pipeline store deletePipelines endpoint, which takes a list of pipeline IDs, through
+#                 the SDK's own authenticated API client. If a batch fails, for example because one of
+#                 its pipelines is still used by a Job, the caller deletes its pipelines one at a time.
+#
+#################################################################
+
+import json, os
+from pipeline_cleanup.concurrency import get_status_code
+
+# The pipeline store endpoint that deletes a list of pipelines
+BULK_DELETE_ENDPOINT = '/v{}/pipelines/deletePipelines'
+
+# The default number of pipelines per delete call. 1 deletes each pipeline with its own call
+DEFAULT_DELETE_BATCH_SIZE = 1
+
+# Responses that mean this Control Hub does not offer the bulk endpoint at all, rather than that
+# one of the pipelines in the batch could not be deleted
+UNSUPPORTED_STATUS_CODES = {405, 501}
+
+# Method that deletes every version of each of the_pipelines with a single call
+def delete_pipelines_in_bulk(sch, the_pipelines):
+    api_client = sch.api_client
+    return api_client._post(app='pipelinestore', endpoint=BULK_DELETE_ENDPOINT.format(api_client.api_version),
+                            data=[pipeline.pipeline_id for pipeline in the_pipelines])
+
+# Method that returns True if a failed bulk delete shows that the endpoint is not available,
+# in which case there is no point sending any more batches to it
+def is_bulk_delete_unsupported(ex):
+    return get_status_code(ex) in UNSUPPORTED_STATUS_CODES
+
+# The lists of pipelines in a results file
+RESULT_STATUSES = ['deleted', 'failed', 'not_found', 'unverified']
+
+# Method that writes the outcome of a run to the_path as a single JSON object with lists of the
+# 'deleted', 'failed', 'not_found' and 'unverified' pipelines, each with its pipeline_id and
+# pipeline_name, and for failures the error. Unverified pipelines were deleted, but the check
+# that they are gone could not be made. If merge is True, the outcomes already in the file are kept,
+# except for the pipelines in the_results, whose outcome in this run replaces the earlier one. Returns the
+# results that were written
+def write_delete_results(the_path, the_results, merge=False):
+    results = {status: list(the_results.get(status, [])) for status in RESULT_STATUSES}
+    if merge and os.path.isfile(the_path):
+        with open(the_path, 'r') as f:
+            previous = json.load(f)
+        current_ids = {entry['pipeline_id'] for entries in results.values() for entry in entries}
+        for status in RESULT_STATUSES:
+            results[status] = [entry for entry in previous.get(status, []) if entry['pipeline_id'] not in current_ids] + results[status]
+    tmp_path = the_path + '.part'
+    with open(tmp_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp_path, the_path)
+    return results
@@ -0,0 +1,94 @@
+#################################################################
+# FILE:  exports.py
+#
+# DESCRIPTION:    Selects the version of a pipeline to export and exports pipelines from Control Hub,
+#                 shared by the export and cleanup old pipelines scripts.
+#
+#################################################################
+
+from pipeline_cleanup.concurrency import call_with_retry
+from pipeline_cleanup.resolver import DEFAULT_BATCH_SIZE, resolve_pipeline_versions
+
+# Method that returns the most recent published version (commit) of a pipeline, or None if it has
+# never been published, using the metadata cache for the pipeline's versions if one is given
+def get_latest_published_commit(pipeline, cache=None, rate_limiter=None, max_retries=5):
+    if cache is not None:
+        commits = call_with_retry(cache.get_commits, pipeline, rate_limiter=rate_limiter, max_retries=max_retries)
+    else:
+        commits = call_with_retry(lambda: pipeline.commits, endpoint='pipeline.commits',
+                                  rate_limiter=rate_limiter, max_retries=max_retries)
+    if commits is None or len(commits) == 0:
+        return None
+    return max(commits, key=lambda c: c.commit_time)
+
+# Method that returns the version of the pipeline that should be exported, or None if there isn't one.
+# If the pipeline is a draft, the most recent published version is looked up and returned instead,
+# using the metadata cache for the pipeline's versions if one is given. If published_versions is given,
+# it is a dict of pipeline_id -> the published version to export, or None if there isn't one, already
+# looked up in bulk from the versions recorded by get-old-pipelines.py; those drafts need no more calls
+def get_exportable_pipeline(sch, the_pipeline_info, pipeline, cache=None, rate_limiter=None, max_retries=5, log=print,
+                            published_versions=None):
+    pipeline_name = the_pipeline_info["pipeline_name"]
+    pipeline_id = the_pipeline_info["pipeline_id"]
+
+    if not pipeline.draft:
+        return pipeline
+
+    log(f"Pipeline \'{pipeline_name}\' version \'{pipeline.version}\' with pipeline ID \'{pipeline_id}\' is a draft pipeline and can't be exported.")
+
+    # Use the published version recorded when the list of old pipelines was written
+    if published_versions is not None and pipeline_id in published_versions:
+        published_pipeline = published_versions[pipeline_id]
+        if published_pipeline is None:
+            log("No published versions found for this pipeline")
+            log(f"Warning: Pipeline \'{pipeline_name}\' with pipeline ID \'{pipeline_id}\' was not exported!")
+        else:
+            log(f"Found version \'{published_pipeline.version}\' of the pipeline")
+        return published_pipeline
+
+    log("Looking for the most recent published version of the pipeline...")
+
+    # See if a version of the pipeline has been published
+    most_recent_commit = get_latest_published_commit(pipeline, cache, rate_limiter, max_retries)
+    if most_recent_commit is None:
+        log("No published versions found for this pipeline")
+        log(f"Warning: Pipeline \'{pipeline_name}\' with pipeline ID \'{pipeline_id}\' was not exported!")
+        return None
+
+    # Get the most recent commit of the pipeline from Control Hub using its ID
+    query = 'pipeline_id=="' + pipeline_id + '" and version=="' +  most_recent_commit.version + '"'
+    pipelines = call_with_retry(sch.pipelines.get_all, search=query, endpoint='pipelines.get_all',
+                                rate_limiter=rate_limiter, max_retries=max_retries)
+
+    if pipelines is None or len(pipelines) == 0:
+        raise Exception("Unable to retrieve a published version of this pipeline")
+
+    pipeline = pipelines[0]
+    log(f"Found version \'{pipeline.version}\' of the pipeline")
+    return pipeline
+
+# Method that looks up, in bulk, the published versions that get-old-pipelines.py recorded for the draft
+# pipelines among the_items, a list of (pipeline_info, pipeline) tuples. Returns a dict of pipeline_id ->
+# the pipeline at its recorded published version, or None if it had never been published, for use as
+# get_exportable_pipeline's published_versions. Drafts that have changed since the list was written, or
+# whose recorded version can't be found, are left out so that they are looked up one by one as before
+def resolve_recorded_published_versions(sch, the_items, batch_size=DEFAULT_BATCH_SIZE, rate_limiter=None, max_retries=5):
+    published_versions = {}
+    wanted = []
+    for pipeline_info, pipeline in the_items:
+        if not pipeline.draft or 'published_version' not in pipeline_info or pipeline_info['version'] != pipeline.version:
+            continue
+        if pipeline_info['published_version'] is None:
+            published_versions[pipeline_info['pipeline_id']] = None
+        else:
+            wanted.append((pipeline_info['pipeline_id'], pipeline_info['published_version']))
+    found, errors = resolve_pipeline_versions(sch, wanted, batch_size=batch_size, rate_limiter=rate_limiter,
+                                              max_retries=max_retries)
+    published_versions.update(found)
+    return published_versions
+
+# Method that exports a list of pipelines, with their fragments and without plain text credentials,
+# and returns the archive's bytes
+def export_pipelines(sch, the_pipelines, rate_limiter=None, max_retries=5):
+    return call_with_retry(sch.export_pipelines, the_pipelines, fragments=True, include_plain_text_credentials=False,
+                           endpoint='export_pipelines', rate_limiter=rate_limiter, max_retries=max_retries)
@@ -0,0 +1,81 @@
+#################################################################
+# FILE:  extsort.py
+#
+# DESCRIPTION:    Bounded-memory writing and sorting of JSON-lines files, used to write
+#                 scan results as they are found and sort them afterwards.
+#
+#################################################################
+
+import heapq, json, os, tempfile
+
+# The default number of records to hold in memory at once when sorting
+DEFAULT_RUN_SIZE = 100000
+
+# The default number of records to write between flushes of a JsonLinesWriter
+DEFAULT_FLUSH_INTERVAL = 1000
+
+# Writes one JSON record per line, flushing to disk every flush_interval records so that the
+# records found so far survive a failure later in a long scan
+class JsonLinesWriter:
+
+    def __init__(self, the_path, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.path = the_path
+        self.flush_interval = flush_interval
+        self.count = 0
+        self.file = open(the_path, 'w')
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.count += 1
+        if self.count % self.flush_interval == 0:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+# Method that writes a sorted run of records to a new temporary file in the_tmp_dir and returns its path
+def _write_run(the_records, the_key, the_tmp_dir):
+    the_records.sort(key=the_key)
+    fd, run_path = tempfile.mkstemp(suffix='.run', dir=the_tmp_dir)
+    with os.fdopen(fd, 'w') as f:
+        for record in the_records:
+            f.write(json.dumps(record) + '\n')
+    return run_path
+
+# Method that yields the records in a run file
+def _read_run(the_run_path):
+    with open(the_run_path, 'r') as f:
+        for line in f:
+            yield json.loads(line)
+
+# Method that sorts the JSON-lines file at the_input_path into the_output_path by the given key, holding
+# at most run_size records in memory at a time. Sorted runs are spilled to temporary files next to
+# the output file and then merged. Returns the number of records written
+def sort_json_lines_file(the_input_path, the_output_path, the_key, run_size=DEFAULT_RUN_SIZE):
+    tmp_dir = tempfile.mkdtemp(prefix='.sort-', dir=os.path.dirname(os.path.abspath(the_output_path)))
+    run_paths = []
+    count = 0
+    try:
+        records = []
+        with open(the_input_path, 'r') as f:
+            for line in f:
+                records.append(json.loads(line))
+                if len(records) >= run_size:
+                    run_paths.append(_write_run(records, the_key, tmp_dir))
+                    records = []
+        if len(records) > 0:
+            run_paths.append(_write_run(records, the_key, tmp_dir))
+            records = []
+
+        with open(the_output_path, 'w') as output:
+            for record in heapq.merge(*[_read_run(path) for path in run_paths], key=the_key):
+                output.write(json.dumps(record) + '\n')
+                count += 1
+    finally:
+        for path in run_paths:
+            os.remove(path)
+        os.rmdir(tmp_dir)
+    return count
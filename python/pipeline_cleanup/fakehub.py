@@ -0,0 +1,339 @@
+#################################################################
+# FILE:  fakehub.py
+#
+# DESCRIPTION:    An in-memory stand-in for the StreamSets SDK's ControlHub class, used to benchmark
+#                 the scripts without a Control Hub tenant. It generates a synthetic tenant of pipelines,
+#                 pipeline versions (commits) and Jobs, and can add latency and retryable errors to
+#                 every call. Only the attributes and methods that the scripts use are implemented.
+#
+#                 The scripts load it through the streamsets/sdk.py shim in the fake_sdk directory,
+#                 configured by a JSON object in the FAKE_CONTROL_HUB environment variable. If
+#                 FAKE_CONTROL_HUB_STATS names a file, the number of calls to each endpoint is
+#                 written to it when the process exits.
+#
+#################################################################
+
+import atexit, io, itertools, json, os, random, re, threading, time, zipfile
+from requests.exceptions import HTTPError
+
+# The default shape of a synthetic tenant
+DEFAULT_CONFIG = {'pipelines': 1000,        # The number of pipelines
+                  'commits': 3,             # The number of published versions of each pipeline
+                  'jobs': 200,              # The number of Jobs, each using a random pipeline version
+                  'draft_rate': 0.3,        # The fraction of pipelines whose latest version is a draft
+                  'unpublished_rate': 0.05, # The fraction of draft pipelines with no published version
+                  'history_days': 5 * 365,  # Pipelines were last modified at random within this many days
+                  'pipeline_kb': 20,        # The approximate size of each exported pipeline's own configuration
+                  'library_kb': 50,         # The approximate size of the stage library definitions in every export
+                  'fragments': 20,          # The number of fragments, each shared by many pipelines
+                  'fragments_per_pipeline': 2,  # The number of fragments that each pipeline uses
+                  'fragment_kb': 10,        # The approximate size of each exported fragment's JSON
+                  'latency_ms': 0,          # The latency added to every call
+                  'error_rate': 0.0,        # The fraction of calls that fail with a retryable 503 error
+                  'page_size': 50,          # The number of objects per page of a listing
+                  'partial_bulk_delete': False,  # Whether a failed bulk delete keeps the pipelines it deleted before failing
+                  'names': 0,               # The number of distinct pipeline names, or 0 for a different name per pipeline
+                  'seed': 1,
+                  'now': None}              # The current time in millis; fixing it lets repeated runs see the same tenant
+
+# The fields that the fake understands in search queries
+SEARCH_CONDITION = re.compile(r'^\s*(\w+)\s*(==|>=|<=|>|<)\s*(?:"([^"]*)"|(\S+))\s*$')
+
+
+# The error raised for injected failures and rejected queries. Like the SDK's errors it is a
+# requests HTTPError that carries the HTTP response, so the scripts' retry logic can read its status code
+class FakeHTTPError(HTTPError):
+
+    def __init__(self, status_code, message):
+        super().__init__(f'{status_code}: {message}',
+                         response=type('FakeResponse', (), {'status_code': status_code})())
+
+
+class FakePipelineLabel:
+
+    def __init__(self, label):
+        self.label = label
+
+
+class FakeCommit:
+
+    def __init__(self, commit_id, version, commit_time):
+        self.commit_id = commit_id
+        self.version = version
+        self.commit_time = commit_time
+
+
+class FakePipeline:
+
+    def __init__(self, hub, pipeline_id, name, commit_id, version, draft, last_modified_on, labels, commits):
+        self._hub = hub
+        self.pipeline_id = pipeline_id
+        self.name = name
+        self.commit_id = commit_id
+        self.version = version
+        self.draft = draft
+        self.last_modified_on = last_modified_on
+        self.labels = [FakePipelineLabel(label) for label in labels]
+        self.creator = 'benchmark'
+        self.executor_type = 'COLLECTOR'
+        self._commits = commits
+        self._fragments = []
+
+    # Returns the pipeline as it was at one of its published versions
+    def at_version(self, the_commit):
+        pipeline = FakePipeline(self._hub, self.pipeline_id, self.name, the_commit.commit_id, the_commit.version, False,
+                                self.last_modified_on, [label.label for label in self.labels], self._commits)
+        pipeline._fragments = self._fragments
+        pipeline.creator = self.creator
+        pipeline.executor_type = self.executor_type
+        return pipeline
+
+    @property
+    def commits(self):
+        self._hub._call('pipeline.commits')
+        return list(self._commits)
+
+
+class FakeJob:
+
+    def __init__(self, job_id, job_name, pipeline_id, commit_id, last_modified_on):
+        self.id = job_id
+        self.job_name = job_name
+        self.pipeline_id = pipeline_id
+        self.commit_id = commit_id
+        self.last_modified_on = last_modified_on
+
+
+# Comparison operators of the search language
+OPERATORS = {'==': lambda a, b: a == b, '>=': lambda a, b: a >= b, '<=': lambda a, b: a <= b,
+             '>': lambda a, b: a > b, '<': lambda a, b: a < b}
+
+# Method that parses one 'field op value' search condition into a tuple of (attribute, operator, value)
+def _parse_condition(the_condition):
+    match = SEARCH_CONDITION.match(the_condition)
+    if match is None:
+        raise FakeHTTPError(400, f"Unsupported search condition '{the_condition}'")
+    field, op, quoted, bare = match.groups()
+    attribute = {'pipeline_id': 'pipeline_id', 'version': 'version', 'name': 'name',
+                 'modified_on': 'last_modified_on', 'id': 'id', 'draft': 'draft',
+                 'engine_type': 'executor_type', 'label': 'labels'}.get(field)
+    if attribute is None:
+        raise FakeHTTPError(400, f"Unsupported search field '{field}'")
+    if quoted is not None:
+        value = quoted
+    elif bare in ('true', 'false'):
+        value = bare == 'true'
+    else:
+        value = int(bare)
+    return attribute, op, value
+
+
+# A paged collection like sch.pipelines or sch.jobs. Iterating over it fetches one page per call
+class FakeCollection:
+
+    def __init__(self, hub, name, objects):
+        self._hub = hub
+        self._name = name
+        self._objects = objects
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __iter__(self):
+        offset = 0
+        while True:
+            self._hub._call(self._name + '.list_page', inject_errors=False)
+            with self._hub.lock:
+                page = list(itertools.islice(self._objects.values(), offset, offset + self._hub.config['page_size']))
+            if len(page) == 0:
+                return
+            yield from page
+            offset += len(page)
+
+    # Method that returns the objects matching a search query of conditions joined by 'and' and 'or', where
+    # each clause of 'and' conditions may be parenthesized. A version condition on a pipeline returns that
+    # published version of the pipeline
+    def get_all(self, search=None, **kwargs):
+        self._hub._call(self._name + '.get_all')
+        with self._hub.lock:
+            objects = self._objects.copy()
+        if search is None:
+            return list(objects.values())
+        results = []
+        for clause in search.split(' or '):
+            clause = clause.strip()
+            if clause.startswith('(') and clause.endswith(')'):
+                clause = clause[1:-1]
+            conditions = [_parse_condition(c) for c in clause.split(' and ')]
+            # Look pipelines up by ID directly rather than testing every pipeline
+            id_values = [value for attribute, op, value in conditions if attribute == 'pipeline_id' and op == '==']
+            if len(id_values) > 0:
+                candidates = [o for o in [objects.get(id_values[0])] if o is not None]
+            else:
+                candidates = objects.values()
+            for o in candidates:
+                version = None
+                matched = True
+                for attribute, op, value in conditions:
+                    if attribute == 'version':
+                        version = value
+                        continue
+                    if attribute == 'labels':
+                        actual = value if value in [label.label for label in o.labels] else None
+                    else:
+                        actual = getattr(o, attribute, None)
+                    if not OPERATORS[op](actual, value):
+                        matched = False
+                        break
+                if not matched:
+                    continue
+                if version is None:
+                    results.append(o)
+                elif o.version == version:
+                    results.append(o)
+                else:
+                    results.extend(o.at_version(c) for c in o._commits if c.version == version)
+        return results
+
+
+# The stand-in for the SDK's API client, which the scripts use to reach endpoints the SDK has no method for
+class FakeAPIClient:
+
+    def __init__(self, hub):
+        self._hub = hub
+        self.api_version = 1
+
+    def _post(self, endpoint, app=None, data=None, **kwargs):
+        if app == 'pipelinestore' and endpoint == '/v1/pipelines/deletePipelines':
+            return self._hub.delete_pipelines(data)
+        raise FakeHTTPError(404, f"Unsupported endpoint '{app}{endpoint}'")
+
+
+# The stand-in for streamsets.sdk.ControlHub
+class FakeControlHub:
+
+    def __init__(self, credential_id=None, token=None, config=None):
+        self.config = dict(DEFAULT_CONFIG, **(config or {}))
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.random = random.Random(self.config['seed'])
+        self.api_client = FakeAPIClient(self)
+        self._generate()
+
+    def _generate(self):
+        config = self.config
+        now = config.get('now') or int(time.time() * 1000)
+        day = 24 * 3600 * 1000
+        pipelines = {}
+        for i in range(config['pipelines']):
+            pipeline_id = f'{i:08d}-0000-4000-8000-{self.random.getrandbits(48):012x}:benchmark-org'
+            last_modified_on = now - self.random.randint(1, config['history_days']) * day
+            commits = [FakeCommit(f'{pipeline_id}-c{k}', str(k + 1), last_modified_on - (config['commits'] - k) * day)
+                       for k in range(config['commits'])]
+            draft = self.random.random() < config['draft_rate']
+            if draft and self.random.random() < config['unpublished_rate']:
+                commits = []
+            if draft or len(commits) == 0:
+                commit_id, version, draft = f'{pipeline_id}-draft', f'{len(commits) + 1}-DRAFT', True
+            else:
+                commit_id, version = commits[-1].commit_id, commits[-1].version
+            labels = ['benchmark', f'team-{i % 10}']
+            pipelines[pipeline_id] = FakePipeline(self, pipeline_id, f'Benchmark Pipeline {i % config["names"] if config["names"] else i}', commit_id, version, draft,
+                                                  last_modified_on, labels, commits)
+            pipelines[pipeline_id].creator = f'user{i % 5}@benchmark'
+            pipelines[pipeline_id].executor_type = 'TRANSFORMER' if i % 4 == 3 else 'COLLECTOR'
+            if config['fragments'] > 0:
+                pipelines[pipeline_id]._fragments = sorted({f'Benchmark Fragment {(i * (k + 1)) % config["fragments"]}'
+                                                            for k in range(config['fragments_per_pipeline'])})
+        jobs = {}
+        published = [p for p in pipelines.values() if len(p._commits) > 0]
+        for j in range(config['jobs'] if published else 0):
+            pipeline = self.random.choice(published)
+            commit = self.random.choice(pipeline._commits)
+            job_id = f'job-{j:08d}:benchmark-org'
+            jobs[job_id] = FakeJob(job_id, f'Benchmark Job {j}', pipeline.pipeline_id, commit.commit_id,
+                                   now - self.random.randint(1, config['history_days']) * day)
+        self._pipelines = pipelines
+        self.pipelines = FakeCollection(self, 'pipelines', pipelines)
+        self.jobs = FakeCollection(self, 'jobs', jobs)
+
+    # Method that counts a call to an endpoint, waits for the configured latency, and fails with
+    # a retryable error at the configured rate
+    def _call(self, the_endpoint, inject_errors=True):
+        with self.lock:
+            self.calls[the_endpoint] = self.calls.get(the_endpoint, 0) + 1
+            failed = inject_errors and self.random.random() < self.config['error_rate']
+            if failed:
+                self.calls['injected_errors'] = self.calls.get('injected_errors', 0) + 1
+        if self.config['latency_ms']:
+            time.sleep(self.config['latency_ms'] / 1000.0)
+        if failed:
+            raise FakeHTTPError(503, f'Injected error calling {the_endpoint}')
+
+    def export_pipelines(self, pipelines, fragments=False, include_plain_text_credentials=False):
+        self._call('export_pipelines')
+        # Each pipeline's configuration is different, while the stage library definitions exported with
+        # every pipeline are the same
+        library_definitions = {'stages': random.Random(0).randbytes(self.config['library_kb'] * 512).hex()}
+        fragment_padding = 'x' * (self.config['fragment_kb'] * 1024)
+        buffer = io.BytesIO()
+        exported_fragments = set()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for pipeline in pipelines:
+                padding = random.Random(pipeline.commit_id).randbytes(self.config['pipeline_kb'] * 512).hex()
+                definition = {'pipelineConfig': {'pipelineId': pipeline.pipeline_id, 'title': pipeline.name,
+                                                 'description': padding, 'fragments': pipeline._fragments},
+                              'pipelineRules': {}, 'libraryDefinitions': library_definitions,
+                              'commitId': pipeline.commit_id, 'version': pipeline.version}
+                archive.writestr(pipeline.name.replace('/', '_') + '.json', json.dumps(definition))
+                # Each fragment a pipeline uses is exported with it, once per archive
+                for fragment in pipeline._fragments if fragments else []:
+                    if fragment not in exported_fragments:
+                        exported_fragments.add(fragment)
+                        archive.writestr(fragment + '.json', json.dumps({'pipelineFragmentConfig': {
+                            'title': fragment, 'description': fragment_padding}}))
+        return buffer.getvalue()
+
+    # Method that raises the error Control Hub returns for a pipeline that can't be deleted. Call with the lock held
+    def _check_deletable(self, the_pipeline_id):
+        if the_pipeline_id not in self._pipelines:
+            raise FakeHTTPError(404, f"Pipeline '{the_pipeline_id}' not found")
+        if any(job.pipeline_id == the_pipeline_id for job in self.jobs._objects.values()):
+            raise FakeHTTPError(400, f"Pipeline '{the_pipeline_id}' is used by one or more Jobs")
+
+    def delete_pipeline(self, pipeline):
+        self._call('delete_pipeline')
+        with self.lock:
+            self._check_deletable(pipeline.pipeline_id)
+            del self._pipelines[pipeline.pipeline_id]
+
+    # Method that deletes a list of pipeline IDs, like the pipeline store's deletePipelines endpoint. It
+    # deletes all or none of them, unless partial_bulk_delete is set, in which case the pipelines before
+    # the first one that can't be deleted are deleted
+    def delete_pipelines(self, the_pipeline_ids):
+        self._call('delete_pipelines')
+        with self.lock:
+            if not self.config['partial_bulk_delete']:
+                for pipeline_id in the_pipeline_ids:
+                    self._check_deletable(pipeline_id)
+            for pipeline_id in the_pipeline_ids:
+                self._check_deletable(pipeline_id)
+                del self._pipelines[pipeline_id]
+
+    # Method that writes the call counts to the_path as JSON
+    def write_stats(self, the_path):
+        with self.lock:
+            calls = dict(self.calls)
+        with open(the_path, 'w') as f:
+            json.dump({'calls': calls}, f, indent=2)
+
+
+# Method that creates a FakeControlHub configured by the FAKE_CONTROL_HUB environment variable,
+# which writes its call counts to FAKE_CONTROL_HUB_STATS on exit. This is what the shim exposes
+# as streamsets.sdk.ControlHub
+def ControlHub(credential_id=None, token=None):
+    hub = FakeControlHub(credential_id, token, json.loads(os.getenv('FAKE_CONTROL_HUB') or '{}'))
+    stats_file = os.getenv('FAKE_CONTROL_HUB_STATS')
+    if stats_file:
+        atexit.register(hub.write_stats, stats_file)
+    return hub
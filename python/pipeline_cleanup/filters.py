@@ -0,0 +1,134 @@
+#################################################################
+# FILE:  filters.py
+#
+# DESCRIPTION:    The filters that select which old pipelines a run applies to, shared by the
+#                 get and cleanup old pipelines scripts.
+#
+#                 The filters that Control Hub's search language can express are also turned into a
+#                 search query, so Control Hub only returns candidate pipelines. Every filter is still
+#                 applied locally, so the query only has to narrow the listing, never to be exact.
+#
+#################################################################
+
+import argparse, fnmatch, re
+from pipeline_cleanup.models import get_label_names
+
+# The engine types a pipeline can have
+ENGINE_TYPES = ['COLLECTOR', 'TRANSFORMER', 'SNOWPARK']
+
+# Method that compiles a --name-regex argument, so a bad pattern is reported as a usage error
+def _compile_regex(the_pattern):
+    try:
+        return re.compile(the_pattern)
+    except re.error as e:
+        raise argparse.ArgumentTypeError(f"'{the_pattern}' is not a valid regular expression: {e}")
+
+# Method that returns a search condition comparing a field to a string, or None if the string can't
+# be quoted in the search language
+def _build_string_condition(the_field, the_value):
+    if '"' in the_value or '\\' in the_value:
+        return None
+    return the_field + '=="' + the_value + '"'
+
+# Method that adds the pipeline filter options to a script's argument parser
+def add_filter_arguments(parser):
+    parser.add_argument('--name', dest='name_pattern', default=None,
+                        help='Only include pipelines whose name matches this glob pattern, for example "Test*"')
+    parser.add_argument('--name-regex', type=_compile_regex, default=None,
+                        help='Only include pipelines whose name contains a match for this regular expression. '
+                             'Use ^ and $ to match the whole name')
+    parser.add_argument('--label', dest='labels', action='append', default=[],
+                        help='Only include pipelines that have this label. May be specified more than once')
+    parser.add_argument('--creator', dest='creators', action='append', default=[],
+                        help='Only include pipelines created by this user. May be specified more than once')
+    parser.add_argument('--engine-type', type=str.upper, choices=ENGINE_TYPES, default=None,
+                        help='Only include pipelines for this engine type')
+    parser.add_argument('--filter-locally', action='store_true',
+                        help='List every pipeline and apply the filters locally, rather than also sending them '
+                             'to Control Hub as a search query')
+    draft_group = parser.add_mutually_exclusive_group()
+    draft_group.add_argument('--drafts-only', dest='draft_filter', action='store_const', const='drafts-only',
+                             help='Only include pipelines whose latest version is a draft')
+    draft_group.add_argument('--published-only', dest='draft_filter', action='store_const', const='published-only',
+                             help='Only include pipelines whose latest version is published')
+
+# Selects old pipelines using only attributes that are already in hand, so no extra calls to
+# Control Hub are needed: the last modification date threshold, the draft flag, the name pattern
+# and regular expression, the labels, the creator and the engine type
+class PipelineFilter:
+
+    def __init__(self, threshold_millis, name_pattern=None, labels=None, draft_filter=None,
+                 name_regex=None, creators=None, engine_type=None):
+        self.threshold_millis = threshold_millis
+        self.name_pattern = name_pattern
+        self.labels = labels or []
+        self.draft_filter = draft_filter
+        self.name_regex = re.compile(name_regex) if isinstance(name_regex, str) else name_regex
+        self.creators = creators or []
+        self.engine_type = engine_type
+
+    # Method that creates the filter from the arguments added by add_filter_arguments
+    @classmethod
+    def from_args(cls, threshold_millis, args):
+        return cls(threshold_millis, args.name_pattern, args.labels, args.draft_filter,
+                   args.name_regex, args.creators, args.engine_type)
+
+    # Method that prints the optional filters that are set
+    def describe(self, log=print):
+        if self.name_pattern is not None:
+            log(f"Name pattern: '{self.name_pattern}'")
+        if self.name_regex is not None:
+            log(f"Name regular expression: '{self.name_regex.pattern}'")
+        if self.labels:
+            log(f"Labels: {self.labels}")
+        if self.creators:
+            log(f"Creators: {self.creators}")
+        if self.engine_type is not None:
+            log(f"Engine type: '{self.engine_type}'")
+        if self.draft_filter is not None:
+            log(f"Draft filter: '{self.draft_filter}'")
+
+    # Method that returns the settings of the filter, other than the threshold, as a dict that can be
+    # saved as JSON and compared with the settings of a later run
+    def get_settings(self):
+        return {'name_pattern': self.name_pattern,
+                'name_regex': self.name_regex.pattern if self.name_regex is not None else None,
+                'labels': sorted(self.labels),
+                'creators': sorted(self.creators),
+                'engine_type': self.engine_type,
+                'draft_filter': self.draft_filter}
+
+    # Method that returns a search query for the pipelines that may pass the filter. The threshold,
+    # the draft flag, the engine type and the labels can be searched on, and so can a name pattern
+    # without wildcards. Name regular expressions, glob patterns and creators are only checked locally
+    def build_search_query(self):
+        conditions = ['modified_on<' + str(self.threshold_millis)]
+        if self.draft_filter is not None:
+            conditions.append('draft==' + ('true' if self.draft_filter == 'drafts-only' else 'false'))
+        if self.engine_type is not None:
+            conditions.append('engine_type=="' + self.engine_type + '"')
+        for label in self.labels:
+            conditions.append(_build_string_condition('label', label))
+        if self.name_pattern is not None and not any(c in self.name_pattern for c in '*?['):
+            conditions.append(_build_string_condition('name', self.name_pattern))
+        return ' and '.join(c for c in conditions if c is not None)
+
+    # Method that returns True if the pipeline passes every filter
+    def matches(self, the_pipeline):
+        if the_pipeline.last_modified_on >= self.threshold_millis:
+            return False
+        if self.draft_filter == 'drafts-only' and not the_pipeline.draft:
+            return False
+        if self.draft_filter == 'published-only' and the_pipeline.draft:
+            return False
+        if self.engine_type is not None and getattr(the_pipeline, 'executor_type', None) != self.engine_type:
+            return False
+        if self.creators and getattr(the_pipeline, 'creator', None) not in self.creators:
+            return False
+        if self.name_pattern is not None and not fnmatch.fnmatchcase(the_pipeline.name, self.name_pattern):
+            return False
+        if self.name_regex is not None and self.name_regex.search(the_pipeline.name) is None:
+            return False
+        if self.labels and not set(self.labels).issubset(get_label_names(the_pipeline)):
+            return False
+        return True
@@ -0,0 +1,310 @@
+#################################################################
+# FILE:  inventory.py
+#
+# DESCRIPTION:    A compact, columnar, memory-mappable file format for lists of pipelines, written by
+#                 get-old-pipelines.py --format inventory and read by the export and delete scripts in
+#                 place of the JSON lines output. Rows are sorted by last modified date, which is stored
+#                 as epoch millis, so a date range is found with a binary search and the draft flag is
+#                 a column of single bytes, without parsing any rows.
+#
+#                 Layout of an inventory file, little-endian throughout:
+#                   8 bytes   INVENTORY_MAGIC
+#                   4 bytes   the length of the header
+#                   header    JSON: the format version, the row count, and the type, offset and
+#                             length of each column's sections
+#                   columns   each section starting on an 8 byte boundary:
+#                             - int64 columns: one 8 byte integer per row
+#                             - bool columns: one byte per row
+#                             - string columns: n + 1 uint32 offsets into a UTF-8 heap, and the heap,
+#                               or, when there are few distinct values, one uint16 code per row into
+#                               a list of the distinct values kept in the header
+#                             - uuid columns: 16 bytes per row, for the UUID part of pipeline IDs
+#                             Nullable columns have an extra section of one byte per row, 1 for null.
+#
+#################################################################
+
+import bisect, json, mmap, os, re, sys, time
+from array import array
+from pipeline_cleanup.dates import millis_to_datetime_string
+
+# The first bytes of every inventory file
+INVENTORY_MAGIC = b'PLINV\x00\x00\x01'
+
+# The version of the layout described above
+INVENTORY_FORMAT_VERSION = 1
+
+# String columns with at most this many distinct values are dictionary encoded
+MAX_DICTIONARY_SIZE = 65535
+
+# The columns of an inventory, in the order of the pipeline info keys written by get-old-pipelines.py.
+# last_modified is epoch millis; it is formatted as a date string again when rows are read as pipeline info.
+# published_version_known is False for a draft whose published version could not be looked up, which
+# the pipeline info shows by leaving out the published version, rather than by a null published version,
+# which means the draft was never published. Inventories written before it was added don't have it
+INVENTORY_COLUMNS = [('pipeline_name', 'string'),
+                     ('pipeline_id', 'pipeline_id'),
+                     ('last_modified', 'int64'),
+                     ('version', 'string'),
+                     ('is_draft', 'bool'),
+                     ('published_commit_id', 'string'),
+                     ('published_version', 'string'),
+                     ('published_version_known', 'bool')]
+
+# Pipeline IDs are a UUID followed by the ID of the organization
+PIPELINE_ID_PATTERN = re.compile(r'^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}):(.*)$')
+
+# Method that returns True if the_path is an inventory file rather than a JSON lines file
+def is_inventory_file(the_path):
+    with open(the_path, 'rb') as f:
+        return f.read(len(INVENTORY_MAGIC)) == INVENTORY_MAGIC
+
+def _to_little_endian(the_array):
+    if sys.byteorder != 'little':
+        the_array.byteswap()
+    return the_array.tobytes()
+
+def _padding(the_length):
+    return b'\0' * (-the_length % 8)
+
+
+# Collects pipelines and writes them to an inventory file. The rows are sorted by last modified date,
+# then by name, when the file is written
+class InventoryWriter:
+
+    def __init__(self):
+        self.rows = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    # Method that adds a pipeline, given its pipeline info dict and its last modified date in millis
+    def append(self, the_pipeline_info, the_last_modified_millis):
+        self.rows.append((the_pipeline_info['pipeline_name'],
+                          the_pipeline_info['pipeline_id'],
+                          int(the_last_modified_millis),
+                          the_pipeline_info['version'],
+                          bool(the_pipeline_info['is_draft']),
+                          the_pipeline_info.get('published_commit_id'),
+                          the_pipeline_info.get('published_version'),
+                          'published_version' in the_pipeline_info))
+
+    # Method that returns the encoded sections of a column, and its entry in the header
+    def _encode_column(self, the_index, the_type):
+        values = [row[the_index] for row in self.rows]
+        entry = {'type': the_type}
+        sections = []
+        nulls = bytes(1 if value is None else 0 for value in values)
+        if any(nulls):
+            entry['nullable'] = True
+            values = [value if value is not None else '' for value in values]
+
+        # Split pipeline IDs into a 16 byte UUID and an organization ID, which is almost always the same
+        if the_type == 'pipeline_id':
+            matches = [PIPELINE_ID_PATTERN.match(value) for value in values]
+            if all(matches):
+                entry['type'] = 'uuid'
+                sections.append(('uuids', b''.join(bytes.fromhex(m.group(1).replace('-', '')) for m in matches)))
+                entry['suffix'] = self._encode_strings([':' + m.group(2) for m in matches], entry, sections, 'suffix_')
+            else:
+                entry['type'] = 'string'
+                self._encode_strings(values, entry, sections)
+        elif the_type == 'string':
+            self._encode_strings(values, entry, sections)
+        elif the_type == 'int64':
+            sections.append(('values', _to_little_endian(array('q', values))))
+        elif the_type == 'bool':
+            sections.append(('values', bytes(1 if value else 0 for value in values)))
+        if entry.get('nullable'):
+            sections.append(('nulls', nulls))
+        return entry, sections
+
+    # Method that adds the sections of a string column to sections, dictionary encoded if there are few
+    # distinct values, and records its encoding in entry. Returns the encoding
+    def _encode_strings(self, the_values, entry, sections, prefix=''):
+        distinct = list(dict.fromkeys(the_values))
+        if len(distinct) <= MAX_DICTIONARY_SIZE and len(distinct) * 2 <= max(len(the_values), 2):
+            codes = {value: code for code, value in enumerate(distinct)}
+            entry[prefix + 'dictionary'] = distinct
+            sections.append((prefix + 'codes', _to_little_endian(array('H', [codes[value] for value in the_values]))))
+            return 'dictionary'
+        heap = bytearray()
+        offsets = array('I', [0])
+        for value in the_values:
+            heap += value.encode('utf-8')
+            if len(heap) > 0xFFFFFFFF:
+                raise ValueError('An inventory string column is limited to 4 GB')
+            offsets.append(len(heap))
+        sections.append((prefix + 'offsets', _to_little_endian(offsets)))
+        sections.append((prefix + 'heap', bytes(heap)))
+        return 'heap'
+
+    # Method that writes the inventory to the_path. The file is written under a temporary name and
+    # renamed into place, so readers never see a partial inventory
+    def write(self, the_path):
+        self.rows.sort(key=lambda row: (row[2], row[0]))
+        columns = {}
+        all_sections = []
+        offset = 0
+        for index, (name, column_type) in enumerate(INVENTORY_COLUMNS):
+            entry, sections = self._encode_column(index, column_type)
+            entry['sections'] = {}
+            for section_name, data in sections:
+                entry['sections'][section_name] = [offset, len(data)]
+                all_sections.append(data)
+                offset += len(data) + len(_padding(len(data)))
+            columns[name] = entry
+        header = json.dumps({'format_version': INVENTORY_FORMAT_VERSION,
+                             'rows': len(self.rows),
+                             'sorted_by': ['last_modified', 'pipeline_name'],
+                             'created_at': int(time.time() * 1000),
+                             'columns': columns}).encode('utf-8')
+        preamble = INVENTORY_MAGIC + len(header).to_bytes(4, 'little') + header
+        preamble += _padding(len(preamble))
+
+        tmp_path = the_path + '.part'
+        with open(tmp_path, 'wb') as f:
+            f.write(preamble)
+            for data in all_sections:
+                f.write(data)
+                f.write(_padding(len(data)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, the_path)
+        return len(preamble) + offset
+
+
+# A read-only, memory-mapped inventory file. Columns are read straight from the mapping, so opening
+# an inventory costs the same however many rows it has, and only the rows that are used are decoded
+class Inventory:
+
+    def __init__(self, the_path):
+        self.path = the_path
+        self._file = open(the_path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+        self._view = memoryview(self._mmap)
+        if bytes(self._view[:len(INVENTORY_MAGIC)]) != INVENTORY_MAGIC:
+            self.close()
+            raise ValueError(f"'{the_path}' is not an inventory file")
+        header_length = int.from_bytes(self._view[8:12], 'little')
+        header = json.loads(bytes(self._view[12:12 + header_length]))
+        if header['format_version'] != INVENTORY_FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Inventory '{the_path}' has unsupported format version {header['format_version']}")
+        self.header = header
+        self.row_count = header['rows']
+        self._data_start = 12 + header_length + len(_padding(12 + header_length))
+        if self._data_start + max([start + length for column in header['columns'].values()
+                                   for start, length in column['sections'].values()], default=0) > size:
+            self.close()
+            raise ValueError(f"Inventory '{the_path}' is truncated")
+        self.columns = header['columns']
+        self.last_modified = self._array_section('last_modified', 'values', 'q')
+        self.is_draft = self._section('is_draft', 'values')
+
+    def __len__(self):
+        return self.row_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Method that returns the raw bytes of one section of a column as a memoryview of the mapping
+    def _section(self, the_column, the_section):
+        start, length = self.columns[the_column]['sections'][the_section]
+        start += self._data_start
+        return self._view[start:start + length]
+
+    # Method that returns a section of fixed size numbers. On little-endian machines this is a view
+    # of the mapping; elsewhere the numbers are copied and byte swapped
+    def _array_section(self, the_column, the_section, the_typecode):
+        section = self._section(the_column, the_section)
+        if sys.byteorder == 'little':
+            return section.cast(the_typecode)
+        values = array(the_typecode, section.tobytes())
+        values.byteswap()
+        return values
+
+    # Method that returns the values of a string column for the_rows
+    def _string_values(self, the_column, the_rows, prefix=''):
+        column = self.columns[the_column]
+        if prefix + 'dictionary' in column:
+            dictionary = column[prefix + 'dictionary']
+            codes = self._array_section(the_column, prefix + 'codes', 'H')
+            return [dictionary[codes[row]] for row in the_rows]
+        offsets = self._array_section(the_column, prefix + 'offsets', 'I')
+        heap = self._section(the_column, prefix + 'heap')
+        return [str(heap[offsets[row]:offsets[row + 1]], 'utf-8') for row in the_rows]
+
+    # Method that returns the values of a column for the_rows, a list of row numbers. Only those rows are decoded
+    def column_values(self, the_column, the_rows):
+        column = self.columns[the_column]
+        if column['type'] == 'int64':
+            numbers = self._array_section(the_column, 'values', 'q')
+            values = [numbers[row] for row in the_rows]
+        elif column['type'] == 'bool':
+            flags = self._section(the_column, 'values')
+            values = [flags[row] == 1 for row in the_rows]
+        elif column['type'] == 'uuid':
+            uuids = self._section(the_column, 'uuids')
+            values = []
+            for row, suffix in zip(the_rows, self._string_values(the_column, the_rows, 'suffix_')):
+                h = uuids[row * 16:row * 16 + 16].hex()
+                values.append(f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}{suffix}')
+        else:
+            values = self._string_values(the_column, the_rows)
+        if column.get('nullable'):
+            nulls = self._section(the_column, 'nulls')
+            values = [None if nulls[row] else value for row, value in zip(the_rows, values)]
+        return values
+
+    # Method that returns the value of a column in a row
+    def get(self, the_column, the_row):
+        return self.column_values(the_column, [the_row])[0]
+
+    # Method that returns the row numbers of the pipelines last modified at or after modified_after and
+    # before modified_before, both in millis, and that are drafts if draft is True or are published if
+    # draft is False. The date range is found with a binary search of the sorted last modified column
+    def select(self, modified_after=None, modified_before=None, draft=None):
+        first = 0 if modified_after is None else bisect.bisect_left(self.last_modified, modified_after)
+        last = self.row_count if modified_before is None else bisect.bisect_left(self.last_modified, modified_before)
+        if last <= first:
+            return range(0)
+        if draft is None:
+            return range(first, last)
+        flags = bytes(self.is_draft[first:last])
+        wanted = b'\x01' if draft else b'\x00'
+        return [first + m.start() for m in re.finditer(re.escape(wanted), flags)]
+
+    # Method that returns the_rows, or every row, in order as the pipeline info dicts that get-old-pipelines.py
+    # writes to a JSON lines file. Draft pipelines include their published version, as in the JSON lines file,
+    # unless it could not be looked up
+    def pipeline_infos(self, the_rows=None):
+        rows = list(the_rows) if the_rows is not None else range(self.row_count)
+        values = {name: self.column_values(name, rows) for name, column_type in INVENTORY_COLUMNS if name in self.columns}
+        known = values.get('published_version_known') or [True] * len(rows)
+        pipeline_infos = []
+        for i in range(len(rows)):
+            pipeline_info = {'pipeline_name': values['pipeline_name'][i],
+                             'pipeline_id': values['pipeline_id'][i],
+                             'last_modified': millis_to_datetime_string(values['last_modified'][i]),
+                             'version': values['version'][i],
+                             'is_draft': values['is_draft'][i]}
+            if pipeline_info['is_draft'] and known[i]:
+                pipeline_info['published_commit_id'] = values['published_commit_id'][i]
+                pipeline_info['published_version'] = values['published_version'][i]
+            pipeline_infos.append(pipeline_info)
+        return pipeline_infos
+
+    def close(self):
+        for view in (getattr(self, 'last_modified', None), getattr(self, 'is_draft', None)):
+            if isinstance(view, memoryview):
+                view.release()
+        self.last_modified = None
+        self.is_draft = None
+        self._view.release()
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
@@ -0,0 +1,76 @@
+#################################################################
+# FILE:  journal.py
+#
+# DESCRIPTION:    An append-only journal of per-pipeline outcomes for export and delete runs,
+#                 so an interrupted run can be resumed without redoing finished pipelines.
+#
+#################################################################
+
+import json, os, threading, time
+
+# Outcomes that mean a pipeline does not need to be processed again when a run is resumed.
+# Anything else, such as 'failed', is retried
+FINISHED_STATUSES = {'exported', 'not_exportable', 'deleted', 'not_found'}
+
+# Method that reads the journal at the_path and returns a dict of pipeline_id -> the last entry
+# recorded for that pipeline. Returns an empty dict if the journal does not exist. A truncated
+# last line, left by a crash in the middle of a write, is ignored
+def load_journal(the_path):
+    entries = {}
+    if not os.path.isfile(the_path):
+        return entries
+    with open(the_path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            entries[entry['pipeline_id']] = entry
+    return entries
+
+# Method that returns the set of pipeline IDs in a loaded journal that are finished, that is whose
+# last outcome is one of the_statuses
+def get_finished_pipeline_ids(the_entries, the_statuses=FINISHED_STATUSES):
+    return {pipeline_id for pipeline_id, entry in the_entries.items() if entry['status'] in the_statuses}
+
+# Method that cuts a truncated last line, left by a crash in the middle of a write, off the journal at
+# the_path, so that the next entry appended to it starts on a line of its own
+def remove_torn_last_line(the_path):
+    if not os.path.isfile(the_path):
+        return
+    with open(the_path, 'r+b') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            block_start = max(0, position - 65536)
+            f.seek(block_start)
+            newline = f.read(position - block_start).rfind(b'\n')
+            if newline >= 0:
+                position = block_start + newline + 1
+                break
+            position = block_start
+        if position < end:
+            f.truncate(position)
+
+# An append-only journal file. Each call to record() writes one JSON line and fsyncs it before
+# returning, so an outcome that has been recorded survives a crash. Safe to use from worker threads
+class Journal:
+
+    def __init__(self, the_path, resume=False):
+        self.path = the_path
+        self.lock = threading.Lock()
+        if resume:
+            remove_torn_last_line(the_path)
+        self.file = open(the_path, 'a' if resume else 'w')
+
+    def record(self, pipeline_id, status, **details):
+        entry = {'pipeline_id': pipeline_id, 'status': status, 'time': int(time.time() * 1000)}
+        entry.update(details)
+        line = json.dumps(entry) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
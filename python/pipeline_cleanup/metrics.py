@@ -0,0 +1,188 @@
+#################################################################
+# FILE:  metrics.py
+#
+# DESCRIPTION:    Process-wide instrumentation for the old pipelines scripts: Control Hub API call
+#                 counts and latency histograms by endpoint, and the time, item count, bytes and
+#                 throughput of each phase of a run. The metrics can be written as a JSON summary
+#                 and in the Prometheus text exposition format.
+#
+#################################################################
+
+import json, threading, time
+from contextlib import contextmanager
+
+# The upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# The prefix of every Prometheus metric name
+PROMETHEUS_PREFIX = 'pipeline_cleanup'
+
+_lock = threading.Lock()
+_started_at = time.monotonic()
+_api_calls = {}
+_phases = {}
+_phase_starts = {}
+
+def _new_endpoint():
+    return {'count': 0, 'errors': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+
+def _new_phase():
+    return {'seconds': 0.0, 'items': 0, 'bytes': 0}
+
+# Method that discards the metrics recorded so far and restarts the clock, for a new run in the same process
+def reset():
+    global _started_at
+    with _lock:
+        _started_at = time.monotonic()
+        _api_calls.clear()
+        _phases.clear()
+        _phase_starts.clear()
+
+# Method that records one call to a Control Hub endpoint that took the_seconds
+def record_call(the_endpoint, the_seconds, failed=False):
+    bucket = len(LATENCY_BUCKETS)
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if the_seconds <= bound:
+            bucket = i
+            break
+    with _lock:
+        endpoint = _api_calls.setdefault(the_endpoint, _new_endpoint())
+        endpoint['count'] += 1
+        endpoint['sum'] += the_seconds
+        endpoint['max'] = max(endpoint['max'], the_seconds)
+        endpoint['buckets'][bucket] += 1
+        if failed:
+            endpoint['errors'] += 1
+
+# Context manager that times a call to a Control Hub endpoint. A call that raises is counted as an error
+@contextmanager
+def timed(the_endpoint):
+    start = time.monotonic()
+    try:
+        yield
+    except BaseException:
+        record_call(the_endpoint, time.monotonic() - start, failed=True)
+        raise
+    record_call(the_endpoint, time.monotonic() - start)
+
+def _add_phase_time(the_phase, the_seconds, the_items):
+    with _lock:
+        entry = _phases.setdefault(the_phase, _new_phase())
+        entry['seconds'] += the_seconds
+        entry['items'] += the_items
+
+# Method that marks the start of a timed section of a script's main program
+def start_phase(the_phase):
+    with _lock:
+        _phase_starts[the_phase] = time.monotonic()
+
+# Method that adds the time since start_phase to the_phase, along with the number of items it processed
+def end_phase(the_phase, items=0):
+    with _lock:
+        start = _phase_starts.pop(the_phase)
+    _add_phase_time(the_phase, time.monotonic() - start, items)
+
+# Context manager that adds the time spent in its block to the_phase
+@contextmanager
+def phase(the_phase):
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        _add_phase_time(the_phase, time.monotonic() - start, 0)
+
+# Method that adds to the number of items processed, and bytes written, by the_phase
+def count(the_phase, items=0, byte_count=0):
+    with _lock:
+        entry = _phases.setdefault(the_phase, _new_phase())
+        entry['items'] += items
+        entry['bytes'] += byte_count
+
+# Method that returns the metrics recorded so far as a dict that can be written as JSON
+def summary():
+    with _lock:
+        api_calls = {}
+        for name, endpoint in sorted(_api_calls.items()):
+            cumulative = 0
+            buckets = {}
+            for bound, n in zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], endpoint['buckets']):
+                cumulative += n
+                buckets[bound] = cumulative
+            api_calls[name] = {'count': endpoint['count'],
+                               'errors': endpoint['errors'],
+                               'latency_seconds': {'sum': round(endpoint['sum'], 6),
+                                                   'mean': round(endpoint['sum'] / endpoint['count'], 6),
+                                                   'max': round(endpoint['max'], 6),
+                                                   'buckets': buckets}}
+        phases = {}
+        for name, entry in _phases.items():
+            seconds = entry['seconds']
+            phases[name] = {'seconds': round(seconds, 3),
+                            'items': entry['items'],
+                            'bytes': entry['bytes'],
+                            'items_per_second': round(entry['items'] / seconds, 3) if seconds > 0 else None,
+                            'bytes_per_second': round(entry['bytes'] / seconds, 1) if seconds > 0 else None}
+        return {'total_seconds': round(time.monotonic() - _started_at, 3),
+                'api_calls': api_calls,
+                'phases': phases}
+
+# Method that returns the metrics recorded so far in the Prometheus text exposition format
+def to_prometheus():
+    the_summary = summary()
+    p = PROMETHEUS_PREFIX
+    lines = [f'# HELP {p}_api_calls_total Control Hub API calls by endpoint, including retries',
+             f'# TYPE {p}_api_calls_total counter']
+    for name, endpoint in the_summary['api_calls'].items():
+        lines.append(f'{p}_api_calls_total{{endpoint="{name}"}} {endpoint["count"]}')
+    lines += [f'# HELP {p}_api_errors_total Control Hub API calls that raised an error, by endpoint',
+              f'# TYPE {p}_api_errors_total counter']
+    for name, endpoint in the_summary['api_calls'].items():
+        lines.append(f'{p}_api_errors_total{{endpoint="{name}"}} {endpoint["errors"]}')
+    lines += [f'# HELP {p}_api_latency_seconds Control Hub API call latency by endpoint',
+              f'# TYPE {p}_api_latency_seconds histogram']
+    for name, endpoint in the_summary['api_calls'].items():
+        for bound, n in endpoint['latency_seconds']['buckets'].items():
+            lines.append(f'{p}_api_latency_seconds_bucket{{endpoint="{name}",le="{bound}"}} {n}')
+        lines.append(f'{p}_api_latency_seconds_sum{{endpoint="{name}"}} {endpoint["latency_seconds"]["sum"]}')
+        lines.append(f'{p}_api_latency_seconds_count{{endpoint="{name}"}} {endpoint["count"]}')
+    for metric, key, kind, help_text in (('phase_seconds', 'seconds', 'gauge', 'Time spent in each phase of the run'),
+                                         ('phase_items_total', 'items', 'counter', 'Items processed by each phase'),
+                                         ('phase_bytes_total', 'bytes', 'counter', 'Bytes written by each phase')):
+        lines += [f'# HELP {p}_{metric} {help_text}', f'# TYPE {p}_{metric} {kind}']
+        for name, entry in the_summary['phases'].items():
+            lines.append(f'{p}_{metric}{{phase="{name}"}} {entry[key]}')
+    lines += [f'# HELP {p}_run_seconds Wall time of the run', f'# TYPE {p}_run_seconds gauge',
+              f'{p}_run_seconds {the_summary["total_seconds"]}']
+    return '\n'.join(lines) + '\n'
+
+# Method that adds the metrics output options to a script's argument parser
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics', dest='metrics_file', default=None,
+                        help='Write a JSON summary of API call counts and latencies and per-phase timings to this file')
+    parser.add_argument('--prometheus', dest='prometheus_file', default=None,
+                        help='Write the same metrics to this file in the Prometheus text exposition format')
+
+# Method that prints the time spent in each phase and writes the metrics files requested on the command line
+def report(args, log=print):
+    the_summary = summary()
+    log(f"Finished in {the_summary['total_seconds']:.1f} seconds")
+    for name, entry in the_summary['phases'].items():
+        line = f"- {name}: {entry['seconds']:.1f} seconds"
+        if entry['items'] > 0:
+            line += f", {entry['items']} items"
+            if entry['items_per_second'] is not None:
+                line += f" ({entry['items_per_second']:.1f}/sec)"
+        if entry['bytes'] > 0:
+            line += f", {entry['bytes']} bytes"
+            if entry['bytes_per_second'] is not None:
+                line += f" ({entry['bytes_per_second'] / 1024 / 1024:.2f} MB/sec)"
+        log(line)
+    log(f"Control Hub API calls: {sum(e['count'] for e in the_summary['api_calls'].values())}")
+    if args.metrics_file is not None:
+        with open(args.metrics_file, 'w') as f:
+            json.dump(the_summary, f, indent=2)
+        log(f"Wrote the metrics to '{args.metrics_file}'")
+    if args.prometheus_file is not None:
+        with open(args.prometheus_file, 'w') as f:
+            f.write(to_prometheus())
+        log(f"Wrote the metrics in Prometheus format to '{args.prometheus_file}'")
@@ -0,0 +1,20 @@
+#################################################################
+# FILE:  models.py
+#
+# DESCRIPTION:    Accessors for SDK object attributes whose names differ between SDK versions.
+#
+#################################################################
+
+# Method that returns a pipeline's ID
+def get_pipeline_id(the_pipeline):
+    return the_pipeline.pipeline_id
+
+# Method that returns a Job's ID. SDK 6 exposes it as job_id, while SDK 7 exposes it as id
+def get_job_id(the_job):
+    job_id = getattr(the_job, 'job_id', None)
+    return job_id if job_id is not None else the_job.id
+
+# Method that returns the names of a pipeline's labels. The SDK returns PipelineLabel objects,
+# which hold the name in their label attribute, while cached pipelines hold plain strings
+def get_label_names(the_pipeline):
+    return [getattr(label, 'label', label) for label in getattr(the_pipeline, 'labels', None) or []]
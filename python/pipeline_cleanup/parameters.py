@@ -0,0 +1,51 @@
+#################################################################
+# FILE:  parameters.py
+#
+# DESCRIPTION:    Checks of the input file and export directory parameters shared by the export,
+#                 delete and cleanup old pipelines scripts.
+#
+#################################################################
+
+import os
+from pathlib import Path
+from pipeline_cleanup.store import is_export_store
+
+# Method that validates the input_file command line parameter.
+# Returns True if the input_file exists and is readable or False otherwise
+def validate_input_file_parameter(the_input_file):
+    file_path = Path(the_input_file)
+    if file_path.is_file() and os.access(file_path, os.R_OK):
+        return True
+    else:
+        print(f"Error: Input File \'{the_input_file}\' either does not exist or is not readable")
+        return False
+
+# Method that validates that the directory specified in the export_dir command line parameter either
+# does not exist or exists but is an empty dir. If the directory does not exist it will be created.
+# When resuming a previous run the directory may already contain that run's exports, and when
+# exporting into a store it may already hold the store written by a previous run. In a dry run
+# the directory is not created.
+# Returns True if the directory is OK or False if not.
+def validate_export_dir_parameter(the_export_dir, resume=False, store=False, create=True):
+
+    # If export_dir already exists...
+    if os.path.isdir(the_export_dir):
+        # ... make sure it is empty
+        if not resume and not (store and is_export_store(the_export_dir)) and os.listdir(the_export_dir):
+            print(f"Error: Export directory \'{the_export_dir}\' already exists but is not empty. ")
+            print("Please specify a new or empty directory for the exports, or use --resume to continue a previous run")
+            return False
+
+    # Create export dir if it does not yet exist
+    elif not create:
+        print(f"Export directory \'{the_export_dir}\' does not exist yet and would be created")
+    else:
+        try:
+            os.makedirs(the_export_dir, exist_ok=True)
+            if not os.path.isdir(the_export_dir):
+                print("Error: directory creation failed.")
+                return False
+        except Exception as ex:
+            print(f"Exception when trying to create directory \'{the_export_dir}\': {ex}")
+            return False
+    return True
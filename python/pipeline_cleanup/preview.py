@@ -0,0 +1,82 @@
+#################################################################
+# FILE:  preview.py
+#
+# DESCRIPTION:    The --dry-run previews of the get, export, delete and cleanup scripts. A preview lists
+#                 what a real run would do using only the input file and the local metadata cache, so
+#                 it never imports the StreamSets SDK or connects to Control Hub. The cache may be
+#                 out of date, so a preview can only say what the cache knows.
+#
+#################################################################
+
+import os
+from pipeline_cleanup.associations import JobAssociationIndex
+
+# Method that returns the version a dry run expects to be exported for a pipeline, as a message. the_cached_pipeline
+# is the pipeline from the cache, or None. A draft's published version is taken from the version recorded in the
+# input file by get-old-pipelines.py, or else from the versions in the cache
+def describe_planned_export(the_pipeline_info, the_cached_pipeline, cache):
+    draft = the_cached_pipeline.draft if the_cached_pipeline is not None else the_pipeline_info.get('is_draft')
+    version = the_cached_pipeline.version if the_cached_pipeline is not None else the_pipeline_info.get('version')
+    if not draft:
+        return f"- Would export version '{version}'"
+    if 'published_version' in the_pipeline_info:
+        published_version = the_pipeline_info['published_version']
+    else:
+        commits = cache.get_cached_commits(the_pipeline_info['pipeline_id']) if cache is not None else None
+        if commits is None:
+            return f"- Version '{version}' is a draft; its most recent published version will be looked up and exported"
+        published_version = max(commits, key=lambda c: c.commit_time).version if len(commits) > 0 else None
+    if published_version is None:
+        return f"- Version '{version}' is a draft with no published version, so it would not be exported"
+    return f"- Version '{version}' is a draft, so published version '{published_version}' would be exported"
+
+# Method that prints what a run would do with each of the_pipeline_infos: the_actions is a description such
+# as 'export' or 'delete'. With a cache, pipelines that are not in it are flagged, since they may already be
+# gone. If export is True the version that would be exported is shown too. Returns the number of pipelines
+# that are in the cache, or all of them if there is no cache
+def preview_pipeline_infos(the_pipeline_infos, the_actions, cache=None, export=False, log=print):
+    cached_pipelines = {}
+    if cache is not None:
+        cached_pipelines = {p.pipeline_id: p for p in cache.get_pipelines([info['pipeline_id'] for info in the_pipeline_infos])}
+    for number, info in enumerate(the_pipeline_infos, start=1):
+        cached_pipeline = cached_pipelines.get(info['pipeline_id'])
+        log(f"[{number}] Would {the_actions} pipeline \'{info['pipeline_name']}\' with ID \'{info['pipeline_id']}\'")
+        if cache is not None and cached_pipeline is None:
+            log("- Not in the metadata cache, so it may no longer exist")
+        if export:
+            log(describe_planned_export(info, cached_pipeline, cache))
+    return len(cached_pipelines) if cache is not None else len(the_pipeline_infos)
+
+# Method that prints what a run would do with each old pipeline in the metadata cache that the_pipeline_filter
+# matches and that is not associated with any Job: the_actions is a description such as 'export and delete'.
+# If export is True the version that would be exported is shown too. A pipeline whose Jobs could only be found
+# from versions that are not in the cache is reported as unknown. Returns a tuple of the number of pipelines the
+# run would act on, the number still associated with Jobs and the number that are unknown
+def preview_old_pipelines(cache, the_pipeline_filter, the_actions, export=False, log=print):
+    job_index = JobAssociationIndex(cache.jobs())
+    old_pipelines = sorted((p for p in cache.pipelines() if the_pipeline_filter.matches(p)), key=lambda p: p.name)
+    would_act_count = 0
+    unknown_count = 0
+    for pipeline in old_pipelines:
+        try:
+            used_by_jobs = len(job_index.get_jobs_for_pipeline(pipeline)) > 0
+        except RuntimeError:
+            log(f"Pipeline \'{pipeline.name}\' with ID \'{pipeline.pipeline_id}\' "
+                "would be checked for Jobs, but its versions are not in the metadata cache")
+            unknown_count += 1
+            continue
+        if used_by_jobs:
+            continue
+        would_act_count += 1
+        log(f"[{would_act_count}] Would {the_actions} pipeline \'{pipeline.name}\' with ID \'{pipeline.pipeline_id}\'")
+        if export:
+            log(describe_planned_export({'pipeline_name': pipeline.name, 'pipeline_id': pipeline.pipeline_id}, pipeline, cache))
+    return would_act_count, len(old_pipelines) - would_act_count - unknown_count, unknown_count
+
+# Method that checks that a dry run's cache file exists, since opening a cache that doesn't exist would create an
+# empty one. Returns True if the cache file exists or False otherwise
+def validate_cache_file_parameter(the_cache_file):
+    if not os.path.isfile(the_cache_file):
+        print(f"Error: Cache File \'{the_cache_file}\' does not exist; run get-old-pipelines.py --cache to create it")
+        return False
+    return True
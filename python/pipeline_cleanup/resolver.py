@@ -0,0 +1,94 @@
+#################################################################
+# FILE:  resolver.py
+#
+# DESCRIPTION:    Resolves the pipelines listed in an input file written by get-old-pipelines.py
+#                 using a small number of batched Control Hub searches rather than one search per line.
+#
+#################################################################
+
+import json
+from pipeline_cleanup.concurrency import call_with_retry
+from pipeline_cleanup.inventory import Inventory, is_inventory_file
+
+# The default number of pipeline IDs to OR together in a single search query. Each ID adds
+# roughly 90 characters to the request URL, so this keeps queries well under common URL limits
+DEFAULT_BATCH_SIZE = 50
+
+# Method that reads the input file and returns a list of the pipeline info dicts on each line.
+# Lines that are not valid JSON are reported and skipped. The input file may also be an inventory
+# written by get-old-pipelines.py --format inventory or slice-inventory.py
+def read_pipeline_infos(the_input_file):
+    if is_inventory_file(the_input_file):
+        with Inventory(the_input_file) as inventory:
+            return inventory.pipeline_infos()
+    pipeline_infos = []
+    with open(the_input_file, 'r') as f:
+        for line in f:
+            try:
+                pipeline_infos.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                print(f"Error: Invalid JSON for line {line}: {e}")
+    return pipeline_infos
+
+# Method that returns a search query matching any of the given pipeline IDs
+def build_pipeline_id_query(the_pipeline_ids):
+    return ' or '.join('pipeline_id=="' + pipeline_id + '"' for pipeline_id in the_pipeline_ids)
+
+# Method that returns a search query matching any of the given (pipeline_id, version) pairs. Each pair is
+# parenthesized, so the query doesn't depend on 'and' binding more tightly than 'or'
+def build_pipeline_version_query(the_versions):
+    return ' or '.join('(pipeline_id=="' + pipeline_id + '" and version=="' + version + '")'
+                       for pipeline_id, version in the_versions)
+
+# Method that looks up specific versions of pipelines, given as (pipeline_id, version) pairs, in batches
+# of batch_size versions per search. Returns a tuple of (a dict of pipeline_id -> the pipeline at that
+# version for the versions that were found, a dict of pipeline_id -> error message for the versions that
+# could not be retrieved)
+def resolve_pipeline_versions(sch, the_versions, batch_size=DEFAULT_BATCH_SIZE, rate_limiter=None, max_retries=5):
+    found = {}
+    errors = {}
+    wanted = dict(the_versions)
+    pairs = list(wanted.items())
+    for i in range(0, len(pairs), batch_size):
+        batch = pairs[i:i + batch_size]
+        try:
+            pipelines = call_with_retry(sch.pipelines.get_all, search=build_pipeline_version_query(batch),
+                                        endpoint='pipelines.get_all', rate_limiter=rate_limiter, max_retries=max_retries)
+            for pipeline in pipelines or []:
+                if wanted.get(pipeline.pipeline_id) == pipeline.version:
+                    found.setdefault(pipeline.pipeline_id, pipeline)
+        except Exception as ex:
+            for pipeline_id, version in batch:
+                errors[pipeline_id] = str(ex)
+    return found, errors
+
+# Method that looks up the given pipeline IDs in batches of batch_size IDs per search and returns
+# a tuple of (a dict of pipeline_id -> pipeline for the pipelines that were found, a dict of
+# pipeline_id -> error message for the pipelines that could not be retrieved).
+# Pipelines that simply don't exist appear in neither dict.
+def resolve_pipelines(sch, the_pipeline_ids, batch_size=DEFAULT_BATCH_SIZE, rate_limiter=None, max_retries=5):
+    found = {}
+    errors = {}
+    unique_ids = list(dict.fromkeys(the_pipeline_ids))
+    for i in range(0, len(unique_ids), batch_size):
+        batch = unique_ids[i:i + batch_size]
+        try:
+            pipelines = call_with_retry(sch.pipelines.get_all, search=build_pipeline_id_query(batch),
+                                        endpoint='pipelines.get_all', rate_limiter=rate_limiter, max_retries=max_retries)
+            for pipeline in pipelines or []:
+                found.setdefault(pipeline.pipeline_id, pipeline)
+        except Exception as ex:
+            for pipeline_id in batch:
+                errors[pipeline_id] = str(ex)
+    return found, errors
+
+# Method that prints a single summary of the pipelines from the input file that could not be resolved
+def print_unresolved_summary(the_pipeline_infos, the_found, the_errors, log=print):
+    missing = [info for info in the_pipeline_infos if info['pipeline_id'] not in the_found]
+    if len(missing) == 0:
+        return
+    log(f"{len(missing)} pipelines from the input file could not be retrieved from Control Hub:")
+    for info in missing:
+        reason = the_errors.get(info['pipeline_id'], 'Pipeline not found')
+        log(f"- \'{info['pipeline_name']}\' with ID \'{info['pipeline_id']}\': {reason}")
+    log("---------------------------------")
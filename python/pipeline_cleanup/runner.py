@@ -0,0 +1,48 @@
+#################################################################
+# FILE:  runner.py
+#
+# DESCRIPTION:    Runs the old pipelines scripts in the calling process, for orchestration code that
+#                 would otherwise start each script as a subprocess. A script runs exactly as it does
+#                 from the command line, with the given arguments, and its exit code is returned.
+#
+#                 A script's results are only in its output and the files it writes; the exit code is
+#                 all that is returned. The scripts keep their state in module-level globals, and
+#                 run_script swaps sys.argv and resets the shared metrics for each run, so only one
+#                 script can run at a time in a process, and never from two threads at once. Code that
+#                 needs the results, or runs steps concurrently, should call the functions in steps.py.
+#
+#################################################################
+
+import os, runpy, sys
+from pipeline_cleanup import metrics
+
+# The directory the scripts are in
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The scripts, by short name
+SCRIPTS = {'get': 'get-old-pipelines.py',
+           'export': 'export-old-pipelines.py',
+           'delete': 'delete-old-pipelines.py',
+           'cleanup': 'cleanup-old-pipelines.py',
+           'slice': 'slice-inventory.py',
+           'rebuild': 'rebuild-export-archive.py'}
+
+# Method that runs a script, given by its short name or file name, with the_args as its command line
+# arguments, and returns its exit code. Each run starts with fresh metrics. The script prints to
+# sys.stdout, which the caller can redirect with contextlib.redirect_stdout
+def run_script(the_script, the_args):
+    script_path = os.path.join(SCRIPT_DIR, SCRIPTS.get(the_script, the_script))
+    if not os.path.isfile(script_path):
+        raise ValueError(f"Unknown script '{the_script}'; expected one of {sorted(SCRIPTS)}")
+    saved_argv = sys.argv
+    sys.argv = [script_path] + [str(arg) for arg in the_args]
+    metrics.reset()
+    try:
+        runpy.run_path(script_path, run_name='__main__')
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    finally:
+        sys.argv = saved_argv
+    return 0
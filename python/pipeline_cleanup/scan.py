@@ -0,0 +1,129 @@
+#################################################################
+# FILE:  scan.py
+#
+# DESCRIPTION:    Lists Control Hub pipelines and Jobs in parallel by splitting each listing into
+#                 shards, one search query per modified_on window, and merging the results.
+#
+#                 The windows cover every possible last_modified_on value, so where the windows
+#                 fall only affects how evenly the work is spread. If Control Hub rejects a shard's
+#                 query, the error is logged and the whole collection is listed serially instead, so results
+#                 are never lost.
+#
+#                 The pipeline listing can also be narrowed by a search query built from the filters,
+#                 which is added to every shard's query.
+#
+#################################################################
+
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pipeline_cleanup.concurrency import call_with_retry
+from pipeline_cleanup.models import get_job_id, get_pipeline_id
+
+# Shard boundaries are spread evenly over this many days before now
+DEFAULT_SHARD_SPAN_DAYS = 5 * 365
+
+# Method that returns the_shards search queries that together match every object exactly once,
+# by splitting the modification time into windows. Control Hub's search language calls the
+# last_modified_on attribute modified_on. The first and last windows are open-ended. If the_search
+# is given, it is added to every query. If the_before_millis is given, the windows end there rather
+# than now, for a search that only matches objects modified before then
+def build_last_modified_shard_queries(the_shards, the_span_days=DEFAULT_SHARD_SPAN_DAYS, the_search=None,
+                                      the_before_millis=None):
+    if the_shards <= 1:
+        return [the_search]
+    now = the_before_millis if the_before_millis is not None else int(time.time() * 1000)
+    start = now - the_span_days * 24 * 3600 * 1000
+    step = (now - start) // the_shards
+    boundaries = [start + step * i for i in range(1, the_shards)]
+    queries = ['modified_on<' + str(boundaries[0])]
+    for low, high in zip(boundaries, boundaries[1:]):
+        queries.append('modified_on>=' + str(low) + ' and modified_on<' + str(high))
+    queries.append('modified_on>=' + str(boundaries[-1]))
+    if the_search is not None:
+        queries = [query + ' and ' + the_search for query in queries]
+    return queries
+
+# Method that lists every object in the_collection serially. The listing is timed and counted under
+# the_endpoint in the metrics, and retried, as a shard search is
+def list_all(the_collection, the_endpoint, rate_limiter=None, max_retries=5):
+    return call_with_retry(list, the_collection, endpoint=the_endpoint, rate_limiter=rate_limiter, max_retries=max_retries)
+
+# Method that fetches one shard of a collection. Searches are counted under the_endpoint in the metrics
+def _fetch_shard(the_collection, the_endpoint, the_query, rate_limiter, max_retries):
+    if the_query is None:
+        return list_all(the_collection, the_endpoint, rate_limiter, max_retries)
+    return list(call_with_retry(the_collection.get_all, search=the_query, endpoint=the_endpoint,
+                                rate_limiter=rate_limiter, max_retries=max_retries))
+
+# Method that yields the distinct objects, identified by the_get_id, from the_futures, a dict of
+# future -> shard query, as each shard completes. If any shard failed, the first error is logged once
+# and the_collection, named the_name in the message, is then listed serially to fill in the gaps, timed
+# under the_endpoint
+def _merge_shards(the_futures, the_collection, the_get_id, the_name, the_endpoint, rate_limiter, max_retries, log=print):
+    seen = set()
+    failures = []
+    for future in as_completed(the_futures):
+        try:
+            shard = future.result()
+        except Exception as e:
+            failures.append((the_futures[future], e))
+            continue
+        for o in shard:
+            object_id = the_get_id(o)
+            if object_id not in seen:
+                seen.add(object_id)
+                yield o
+    if len(failures) > 0:
+        query, error = failures[0]
+        log(f"Warning: {len(failures)} of the {len(the_futures)} {the_name} shard searches failed. "
+            f"The search \'{query}\' failed with: {error}")
+        log(f"Listing all {the_name} serially instead, without the shard searches")
+        for o in list_all(the_collection, the_endpoint, rate_limiter, max_retries):
+            object_id = the_get_id(o)
+            if object_id not in seen:
+                seen.add(object_id)
+                yield o
+
+# Lists sch.pipelines and sch.jobs concurrently, each split into shards, on a shared pool of worker
+# threads. Both listings start as soon as the scan is created. jobs() waits for the Job listing,
+# while pipelines() yields pipelines shard by shard as each shard arrives. The pipeline listing is
+# narrowed by pipeline_search, if given, which only matches pipelines modified before before_millis
+class ShardedScan:
+
+    def __init__(self, sch, shards, rate_limiter=None, max_retries=5, pipeline_search=None, before_millis=None):
+        self.sch = sch
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        job_queries = build_last_modified_shard_queries(shards)
+        pipeline_queries = build_last_modified_shard_queries(shards, the_search=pipeline_search,
+                                                             the_before_millis=before_millis)
+        self.executor = ThreadPoolExecutor(max_workers=len(job_queries) + len(pipeline_queries))
+        self.job_futures = {self.executor.submit(_fetch_shard, sch.jobs, 'jobs.get_all', q, rate_limiter, max_retries): q
+                            for q in job_queries}
+        self.pipeline_futures = {self.executor.submit(_fetch_shard, sch.pipelines, 'pipelines.get_all', q, rate_limiter, max_retries): q
+                                 for q in pipeline_queries}
+
+    def jobs(self):
+        return list(_merge_shards(self.job_futures, self.sch.jobs, get_job_id, 'Jobs', 'jobs.get_all',
+                                  self.rate_limiter, self.max_retries))
+
+    def pipelines(self):
+        try:
+            yield from _merge_shards(self.pipeline_futures, self.sch.pipelines, get_pipeline_id, 'pipelines',
+                                     'pipelines.get_all', self.rate_limiter, self.max_retries)
+        finally:
+            self.executor.shutdown(wait=False)
+
+# Method that lists every object in the_collection, identified by the_get_id, using the_shards
+# concurrent shard queries, or a serial listing for a single shard, which are counted under the_endpoint
+# in the metrics. the_name names the objects in the message logged if a shard fails
+def list_sharded(the_collection, the_get_id, the_shards, rate_limiter=None, max_retries=5, the_endpoint=None,
+                 the_name='objects', log=print):
+    queries = build_last_modified_shard_queries(the_shards)
+    if len(queries) == 1:
+        return list_all(the_collection, the_endpoint, rate_limiter, max_retries)
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        futures = {executor.submit(_fetch_shard, the_collection, the_endpoint, q, rate_limiter, max_retries): q
+                   for q in queries}
+        return list(_merge_shards(futures, the_collection, the_get_id, the_name, the_endpoint, rate_limiter,
+                                  max_retries, log))
@@ -0,0 +1,410 @@
+#################################################################
+# FILE:  steps.py
+#
+# DESCRIPTION:    The resolve, export and delete steps of the old pipelines scripts as functions that
+#                 return their results. export-old-pipelines.py and delete-old-pipelines.py run their
+#                 exports and deletions through these functions, and orchestration code can call them
+#                 from Python instead of running the scripts. Each takes a Control Hub connection, such
+#                 as the one returned by connection.connect_to_control_hub, and a list of the pipeline
+#                 info dicts written by get-old-pipelines.py, and returns a dict of status -> list of
+#                 pipelines, in the same form as the results file of delete-old-pipelines.py.
+#
+#                 Progress is written through the 'log' function, in the order of the input list even
+#                 when 'workers' is greater than 1. The outcome of each pipeline is recorded in the
+#                 journal, and deleted pipelines are removed from the metadata cache, only if one is
+#                 given. The functions keep no state between calls, so they can run on several threads
+#                 at once.
+#
+#################################################################
+
+import asyncio, os, threading
+from pipeline_cleanup import metrics
+from pipeline_cleanup.archives import MANIFEST_FILE_NAME, append_to_manifest, get_last_batch_number, get_pipeline_archive_name, write_file_atomically
+from pipeline_cleanup.concurrency import call_with_retry, map_in_order
+from pipeline_cleanup.deletion import DEFAULT_DELETE_BATCH_SIZE, delete_pipelines_in_bulk, is_bulk_delete_unsupported
+from pipeline_cleanup.exports import export_pipelines, get_exportable_pipeline, resolve_recorded_published_versions
+from pipeline_cleanup.resolver import DEFAULT_BATCH_SIZE, resolve_pipelines, print_unresolved_summary
+
+# Method that returns the entry for a pipeline in the results of a step
+def _entry(the_pipeline_info, **details):
+    return dict({'pipeline_id': the_pipeline_info['pipeline_id'], 'pipeline_name': the_pipeline_info['pipeline_name']}, **details)
+
+# Method that records the outcome of a pipeline in the journal, if there is one
+def _record(journal, the_pipeline_id, the_status, **details):
+    if journal is not None:
+        journal.record(the_pipeline_id, the_status, **details)
+
+# Method that logs the buffered messages of a worker, prefixing the first with the_number if it is given
+def _log_messages(the_messages, log, the_number=None):
+    for i, message in enumerate(the_messages):
+        log(f"[{the_number}] {message}" if i == 0 and the_number is not None else message)
+
+# Method that looks up the_pipeline_ids with batch_size IDs per search, through the async HTTP client if
+# one is given, and otherwise the SDK. Returns the (found, errors) dicts of resolver.resolve_pipelines
+def _find_pipelines(sch, client, the_pipeline_ids, batch_size, rate_limiter, max_retries):
+    if client is not None:
+        return asyncio.run(client.get_pipelines_by_id(the_pipeline_ids, batch_size=batch_size))
+    return resolve_pipelines(sch, the_pipeline_ids, batch_size=batch_size, rate_limiter=rate_limiter, max_retries=max_retries)
+
+# Method that looks up the_pipeline_infos in Control Hub, batch_size pipelines per search, through the async HTTP
+# client if one is given. Returns a dict with the lists of 'found' pipelines, each with the SDK pipeline under
+# 'pipeline', 'not_found' pipelines, and 'failed' pipelines, each with the error of the search that should have
+# found them. The pipelines that are not found, or could not be looked up, are recorded in the journal
+def resolve_pipeline_infos(sch, the_pipeline_infos, batch_size=DEFAULT_BATCH_SIZE, rate_limiter=None, max_retries=5,
+                           journal=None, client=None):
+    with metrics.phase('resolve'):
+        found, errors = _find_pipelines(sch, client, [info['pipeline_id'] for info in the_pipeline_infos],
+                                        batch_size, rate_limiter, max_retries)
+    metrics.count('resolve', items=len(the_pipeline_infos))
+    results = {'found': [], 'not_found': [], 'failed': []}
+    for info in the_pipeline_infos:
+        if info['pipeline_id'] in found:
+            results['found'].append(_entry(info, pipeline=found[info['pipeline_id']]))
+        elif info['pipeline_id'] in errors:
+            _record(journal, info['pipeline_id'], 'failed', error=errors[info['pipeline_id']])
+            results['failed'].append(_entry(info, error=errors[info['pipeline_id']]))
+        else:
+            _record(journal, info['pipeline_id'], 'not_found')
+            results['not_found'].append(_entry(info))
+    return results
+
+# Method that prints the summary of the pipelines that a step could not look up
+def _log_unresolved(the_pipeline_infos, the_resolved, log):
+    found_ids = {entry['pipeline_id'] for entry in the_resolved['found']}
+    lookup_errors = {entry['pipeline_id']: entry['error'] for entry in the_resolved['failed']}
+    print_unresolved_summary(the_pipeline_infos, found_ids, lookup_errors, log)
+
+# The exports of one call to export_pipeline_infos. Each method runs on a worker thread and returns the
+# messages to log and a list of (status, entry, details) outcomes, which are recorded in the order of the input
+class _PipelineExporter:
+
+    def __init__(self, sch, export_dir, cache, store, client, rate_limiter, max_retries, published_versions):
+        self.sch = sch
+        self.export_dir = export_dir
+        self.cache = cache
+        self.store = store
+        self.client = client
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.published_versions = published_versions
+
+    # Method that returns the version of the pipeline that should be exported, or None if there isn't one
+    def get_exportable_version(self, the_pipeline_info, pipeline, log):
+        return get_exportable_pipeline(self.sch, the_pipeline_info, pipeline, cache=self.cache, rate_limiter=self.rate_limiter,
+                                       max_retries=self.max_retries, log=log, published_versions=self.published_versions)
+
+    # Method that exports a list of pipelines and returns the archive's bytes
+    def export_pipeline_list(self, the_pipelines):
+        return export_pipelines(self.sch, the_pipelines, rate_limiter=self.rate_limiter, max_retries=self.max_retries)
+
+    # Method that exports a list of pipelines into the archive at the_path and returns its size in bytes. With
+    # the async HTTP client the archive is streamed straight to disk instead of held in memory
+    def export_pipeline_list_to_file(self, the_pipelines, the_path):
+        if self.client is not None:
+            return asyncio.run(self.client.export_pipelines_to_file(the_pipelines, the_path))
+        data = self.export_pipeline_list(the_pipelines)
+        write_file_atomically(the_path, data)
+        return len(data)
+
+    # Method that exports the most recent published version of a found pipeline to its own zip file in the
+    # export_dir, or into the store
+    def export_pipeline(self, the_found):
+        messages = []
+        try:
+            pipeline = self.get_exportable_version(the_found, the_found['pipeline'], messages.append)
+            if pipeline is None:
+                outcome = ('not_exportable', the_found, {})
+            elif self.store is not None:
+                manifest_name = self.store.get_manifest_name(pipeline.pipeline_id)
+                messages.append(f"Exporting pipeline '{pipeline.name}' version '{pipeline.version}' with pipeline ID '{pipeline.pipeline_id}' into the store '{self.export_dir}'")
+                data = self.export_pipeline_list([pipeline])
+                self.store.add_archive(data, [pipeline])
+                metrics.count('export', items=1, byte_count=len(data))
+                outcome = ('exported', the_found, {'version': pipeline.version, 'manifest': manifest_name})
+            else:
+                # The file name includes the pipeline ID, so pipelines with the same name never overwrite each other's export
+                file_name = get_pipeline_archive_name(pipeline.name, pipeline.pipeline_id)
+                export_file_name = self.export_dir + '/' + file_name
+                messages.append(f"Exporting pipeline \'{pipeline.name}\' version \'{pipeline.version}\' with pipeline ID \'{pipeline.pipeline_id}\' into the file \'{export_file_name}\'")
+                byte_count = self.export_pipeline_list_to_file([pipeline], export_file_name)
+                metrics.count('export', items=1, byte_count=byte_count)
+                outcome = ('exported', the_found, {'version': pipeline.version, 'file': file_name})
+        except Exception as e:
+            messages.append(f"Error exporting pipeline \'{the_found['pipeline_name']}\': {e}")
+            outcome = ('failed', the_found, {'error': str(e)})
+        messages.append("---------------------------------")
+        return messages, [outcome]
+
+    # Method that exports a numbered batch of found pipelines into a single archive named batch-<number>.zip
+    # in the export_dir, or into the store. The archive is written to disk as soon as the export returns, so
+    # only one archive per worker is held in memory at a time. The outcome of each exported pipeline carries
+    # its manifest entry
+    def export_batch(self, the_batch):
+        batch_number, found = the_batch
+        messages = []
+        outcomes = []
+        pipelines = []
+        exported = []
+        archive_name = f"batch-{batch_number:05d}.zip"
+
+        for entry in found:
+            try:
+                pipeline = self.get_exportable_version(entry, entry['pipeline'], messages.append)
+            except Exception as e:
+                messages.append(f"Error exporting pipeline \'{entry['pipeline_name']}\': {e}")
+                outcomes.append(('failed', entry, {'error': str(e)}))
+                continue
+            if pipeline is None:
+                outcomes.append(('not_exportable', entry, {}))
+                continue
+            pipelines.append(pipeline)
+            manifest_entry = {'pipeline_name': pipeline.name, 'pipeline_id': pipeline.pipeline_id,
+                              'version': pipeline.version, 'commit_id': pipeline.commit_id}
+            if self.store is not None:
+                manifest_entry['manifest'] = self.store.get_manifest_name(pipeline.pipeline_id)
+            else:
+                manifest_entry['archive'] = archive_name
+            exported.append((entry, manifest_entry))
+
+        if len(pipelines) > 0:
+            export_file_name = self.export_dir + '/' + archive_name
+            if self.store is not None:
+                messages.append(f"Exporting {len(pipelines)} pipelines into the store \'{self.export_dir}\'")
+            else:
+                messages.append(f"Exporting {len(pipelines)} pipelines into the file \'{export_file_name}\'")
+            try:
+                if self.store is not None:
+                    data = self.export_pipeline_list(pipelines)
+                    self.store.add_archive(data, pipelines)
+                    byte_count = len(data)
+                else:
+                    byte_count = self.export_pipeline_list_to_file(pipelines, export_file_name)
+                metrics.count('export', items=len(pipelines), byte_count=byte_count)
+                outcomes.extend(('exported', entry, manifest_entry) for entry, manifest_entry in exported)
+            except Exception as e:
+                messages.append(f"Error exporting batch \'{archive_name}\': {e}")
+                for entry, manifest_entry in exported:
+                    outcomes.append(('failed', entry, {'error': str(e)}))
+                    messages.append(f"Warning: Pipeline \'{manifest_entry['pipeline_name']}\' with pipeline ID \'{manifest_entry['pipeline_id']}\' was not exported!")
+
+        messages.append("---------------------------------")
+        return messages, outcomes
+
+# Method that exports the_pipeline_infos into the_export_dir, which is created if it does not exist. A draft
+# pipeline's most recent published version is exported, using the published version recorded in its pipeline
+# info if there is one, and otherwise the metadata cache for its versions if one is given. With an
+# export_batch_size of 1 each pipeline gets its own zip file, named after the pipeline and the UUID of its ID so
+# pipelines with the same name don't overwrite each other. Larger batches are written to numbered
+# batch-<n>.zip archives, numbered after any a previous run wrote, and listed in the export_dir's manifest.
+# If a store is given the exports are unpacked into it instead. With an async HTTP client the archives are
+# streamed to disk by it; pipelines are still looked up through sch. Up to 'workers' exports run at once.
+# Returns a dict with the lists of 'exported' pipelines, each with its 'version' and its 'file', 'archive' or
+# 'manifest', 'not_exportable' drafts that were never published, 'not_found' pipelines and 'failed' pipelines,
+# each with its 'error'
+def export_pipeline_infos(sch, the_pipeline_infos, the_export_dir, cache=None, batch_size=DEFAULT_BATCH_SIZE,
+                          rate_limiter=None, max_retries=5, log=print, workers=1, export_batch_size=1, store=None,
+                          journal=None, client=None):
+    os.makedirs(the_export_dir, exist_ok=True)
+    resolved = resolve_pipeline_infos(sch, the_pipeline_infos, batch_size, rate_limiter, max_retries, journal=journal)
+    results = {'exported': [], 'not_exportable': [], 'not_found': list(resolved['not_found']), 'failed': list(resolved['failed'])}
+    found = resolved['found']
+
+    # Look up the published versions of draft pipelines that get-old-pipelines.py recorded, in batches
+    infos_by_id = {info['pipeline_id']: info for info in the_pipeline_infos}
+    with metrics.phase('resolve'):
+        published_versions = resolve_recorded_published_versions(sch, [(infos_by_id[entry['pipeline_id']], entry['pipeline'])
+                                                                       for entry in found],
+                                                                 batch_size=batch_size, rate_limiter=rate_limiter,
+                                                                 max_retries=max_retries)
+    if len(published_versions) > 0:
+        log(f"Using the published versions recorded in the input file for {len(published_versions)} draft pipelines")
+        log("---------------------------------")
+
+    exporter = _PipelineExporter(sch, the_export_dir, cache, store, client, rate_limiter, max_retries, published_versions)
+    archive_count = 0
+    with metrics.phase('export'):
+        if export_batch_size == 1:
+            outputs = map_in_order(exporter.export_pipeline, found, workers)
+        else:
+            first_batch_number = get_last_batch_number(the_export_dir) + 1
+            batches = [(first_batch_number + n, found[i:i + export_batch_size])
+                       for n, i in enumerate(range(0, len(found), export_batch_size))]
+            outputs = map_in_order(exporter.export_batch, batches, workers)
+        for item, (messages, outcomes) in outputs:
+            _log_messages(messages, log)
+            # A batch's exported pipelines are added to the manifest before they are recorded as exported
+            manifest_entries = [details for status, entry, details in outcomes if status == 'exported' and export_batch_size > 1]
+            if len(manifest_entries) > 0:
+                if store is None:
+                    append_to_manifest(the_export_dir, manifest_entries)
+                archive_count += 1
+            for status, entry, details in outcomes:
+                if status == 'exported' and export_batch_size > 1:
+                    location = 'manifest' if store is not None else 'archive'
+                    details = {'version': details['version'], location: details[location]}
+                _record(journal, entry['pipeline_id'], status, **details)
+                results[status].append(_entry(entry, **details))
+
+    if export_batch_size > 1:
+        if store is not None:
+            log(f"Exported {len(results['exported'])} pipelines in {archive_count} batches")
+        else:
+            log(f"Exported {len(results['exported'])} pipelines into {archive_count} archives")
+            log(f"Wrote the list of exported pipelines and their archives to \'{the_export_dir}/{MANIFEST_FILE_NAME}\'")
+        log("---------------------------------")
+    _log_unresolved(the_pipeline_infos, resolved, log)
+    return results
+
+# The deletions of one call to delete_pipeline_infos. Deleted pipelines, and those whose delete failed, are
+# kept until they have been looked up again. Each delete method appends its messages to 'log'
+class _PipelineDeleter:
+
+    def __init__(self, sch, client, journal, rate_limiter, max_retries):
+        self.sch = sch
+        self.client = client
+        self.journal = journal
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.deleted = {}
+        self.failed = {}
+        self.lock = threading.Lock()
+        self.bulk_delete_supported = True
+
+    # Method that records that a pipeline was deleted. It is removed from the cache once the deletion is verified
+    def record_deleted(self, pipeline, log, message='- Pipeline was deleted.'):
+        _record(self.journal, pipeline.pipeline_id, 'deleted')
+        metrics.count('delete', items=1)
+        with self.lock:
+            self.deleted[pipeline.pipeline_id] = pipeline
+        log(message)
+
+    # Method that records that the attempt to delete a pipeline failed. The pipeline may be gone all the same,
+    # for example if a batch delete deleted it before failing, or a retried delete had already taken effect,
+    # so it is looked up again along with the deleted pipelines before it is reported as failed
+    def record_delete_failed(self, pipeline, ex, log):
+        _record(self.journal, pipeline.pipeline_id, 'failed', error=str(ex))
+        with self.lock:
+            self.failed[pipeline.pipeline_id] = (pipeline, str(ex))
+        log(f"Error: Attempt to delete pipeline \'{pipeline.name}\' with ID \'{pipeline.pipeline_id}\' failed; {ex}")
+
+    # Method that records that a batch delete failed, so its pipelines will be deleted one at a time. If the
+    # failure shows that Control Hub has no bulk delete endpoint, later batches are not sent to it either
+    def record_batch_failed(self, ex, log):
+        if is_bulk_delete_unsupported(ex):
+            self.bulk_delete_supported = False
+            log(f"- Control Hub does not support deleting pipelines in batches, so they will be deleted one at a time; {ex}")
+        else:
+            log(f"- The batch delete failed, so its pipelines will be deleted one at a time; {ex}")
+        log("---------------------------------")
+
+    # Method to delete a pipeline, through the async HTTP client if there is one. The deletion attempt might
+    # fail due to permission issues or if the pipeline is associated with a Job
+    def delete_pipeline(self, the_found, log):
+        log(f"Preparing to delete pipeline \'{the_found['pipeline_name']}\' with ID \'{the_found['pipeline_id']}\'")
+        pipeline = the_found['pipeline']
+        log("- Found Pipeline")
+        try:
+            if self.client is not None:
+                asyncio.run(self.client.delete_pipeline(pipeline))
+            else:
+                call_with_retry(self.sch.delete_pipeline, pipeline, endpoint='delete_pipeline',
+                                rate_limiter=self.rate_limiter, max_retries=self.max_retries)
+            self.record_deleted(pipeline, log)
+        except Exception as ex:
+            self.record_delete_failed(pipeline, ex, log)
+        log("---------------------------------")
+
+    # Method to delete a batch of found pipelines with a single call, or one at a time if the call fails.
+    # Runs on a worker thread, and returns the messages so they can be logged in the order of the input
+    def delete_batch(self, the_batch):
+        messages = []
+        if len(the_batch) > 1 and self.bulk_delete_supported:
+            pipelines = [entry['pipeline'] for entry in the_batch]
+            messages.append(f"Deleting a batch of {len(pipelines)} pipelines")
+            try:
+                if self.client is not None:
+                    asyncio.run(self.client.delete_pipelines(pipelines))
+                else:
+                    call_with_retry(delete_pipelines_in_bulk, self.sch, pipelines, endpoint='delete_pipelines',
+                                    rate_limiter=self.rate_limiter, max_retries=self.max_retries)
+                for pipeline in pipelines:
+                    self.record_deleted(pipeline, messages.append, f"- Pipeline \'{pipeline.name}\' with ID \'{pipeline.pipeline_id}\' was deleted.")
+                messages.append("---------------------------------")
+                return messages
+            except Exception as ex:
+                self.record_batch_failed(ex, messages.append)
+        for entry in the_batch:
+            self.delete_pipeline(entry, messages.append)
+        return messages
+
+# Method that deletes the_pipeline_infos from Control Hub, delete_batch_size pipelines per call, with up to
+# 'workers' calls at once, and then looks them up again to confirm which are gone. If a batch fails its
+# pipelines are deleted one at a time. With an async HTTP client, the pipelines are looked up and deleted
+# through it instead of sch. Pipelines that are gone, or were not found, are removed from the metadata cache
+# if one is given. Returns a dict with the lists of 'deleted', 'failed' (each with its 'error'), 'not_found'
+# and 'unverified' pipelines, as in the results file of delete-old-pipelines.py
+def delete_pipeline_infos(sch, the_pipeline_infos, delete_batch_size=DEFAULT_DELETE_BATCH_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                          rate_limiter=None, max_retries=5, log=print, workers=1, journal=None, cache=None, client=None):
+    resolved = resolve_pipeline_infos(sch, the_pipeline_infos, batch_size, rate_limiter, max_retries, journal=journal, client=client)
+    results = {'deleted': [], 'failed': list(resolved['failed']), 'not_found': list(resolved['not_found']), 'unverified': []}
+    if cache is not None:
+        for entry in resolved['not_found']:
+            cache.remove_pipeline(entry['pipeline_id'])
+
+    # Delete each pipeline that was found, delete_batch_size pipelines per call
+    found = resolved['found']
+    batches = [found[i:i + delete_batch_size] for i in range(0, len(found), delete_batch_size)]
+    numbered = workers > 1 or client is not None
+    if client is not None:
+        log(f"Deleting pipelines with up to {workers} concurrent requests")
+        log("---------------------------------")
+    elif workers > 1:
+        log(f"Deleting pipelines using {workers} workers")
+        log("---------------------------------")
+    deleter = _PipelineDeleter(sch, client, journal, rate_limiter, max_retries)
+    with metrics.phase('delete'):
+        for number, (batch, messages) in enumerate(map_in_order(deleter.delete_batch, batches, workers), start=1):
+            _log_messages(messages, log, number if numbered else None)
+
+    # Confirm that the deleted pipelines are gone with one search per batch_size pipelines. A pipeline that is
+    # still there failed to delete, and one that could not be checked is reported as unverified. The pipelines
+    # whose delete failed are looked up too, and those that are gone are reported as deleted
+    if len(deleter.deleted) + len(deleter.failed) > 0:
+        log(f"Verifying that the {len(deleter.deleted)} deleted pipelines are gone, and checking the "
+            f"{len(deleter.failed)} pipelines that failed to delete")
+        log("---------------------------------")
+        verify_ids = list(deleter.deleted) + list(deleter.failed)
+        with metrics.phase('verify'):
+            remaining, verify_errors = _find_pipelines(sch, client, verify_ids, batch_size, rate_limiter, max_retries)
+        metrics.count('verify', items=len(verify_ids))
+        for pipeline_id, pipeline in deleter.deleted.items():
+            entry = {'pipeline_id': pipeline_id, 'pipeline_name': pipeline.name}
+            if pipeline_id in remaining:
+                error = 'The pipeline still exists after it was deleted'
+                _record(journal, pipeline_id, 'failed', error=error)
+                results['failed'].append(dict(entry, error=error))
+                log(f"Error: Pipeline \'{pipeline.name}\' with ID \'{pipeline_id}\' still exists after it was deleted")
+                continue
+            results['unverified' if pipeline_id in verify_errors else 'deleted'].append(entry)
+            if cache is not None:
+                cache.remove_pipeline(pipeline_id)
+        gone_count = 0
+        for pipeline_id, (pipeline, error) in deleter.failed.items():
+            entry = {'pipeline_id': pipeline_id, 'pipeline_name': pipeline.name}
+            if pipeline_id in remaining or pipeline_id in verify_errors:
+                results['failed'].append(dict(entry, error=error))
+                continue
+            gone_count += 1
+            _record(journal, pipeline_id, 'deleted')
+            results['deleted'].append(entry)
+            if cache is not None:
+                cache.remove_pipeline(pipeline_id)
+        if len(verify_errors) > 0:
+            log(f"{len(verify_errors)} pipelines could not be verified: {next(iter(verify_errors.values()))}")
+        if gone_count > 0:
+            log(f"{gone_count} pipelines whose delete reported an error are gone, so they were deleted after all")
+        log(f"Verified that {len(results['deleted'])} pipelines were deleted")
+        log("---------------------------------")
+
+    _log_unresolved(the_pipeline_infos, resolved, log)
+    return results
@@ -0,0 +1,235 @@
+#################################################################
+# FILE:  store.py
+#
+# DESCRIPTION:    A content-addressed, deduplicated store of exported pipelines. Each export archive is
+#                 unpacked, each of its pipeline and fragment JSON files is split into its top-level sections
+#                 (pipelineConfig, pipelineRules, libraryDefinitions and so on), and each section is kept once,
+#                 compressed, under the SHA-256 hash of its content. The stage library definitions and rules
+#                 that near-identical pipelines share, fragments used by many pipelines, and pipelines that
+#                 are exported again all take no more space. A small compressed manifest per pipeline lists
+#                 the files that made up its export, from which an importable zip archive can be rebuilt.
+#
+#                 Layout of a store directory:
+#                   blobs/<first 2 hex digits>/<sha256>.json.gz  - each distinct section or file
+#                   manifests/<pipeline_id>.json.gz              - one manifest per pipeline
+#
+#################################################################
+
+import fnmatch, gzip, hashlib, io, json, os, tempfile, threading, time, zipfile
+
+# The subdirectories of a store
+BLOBS_DIR_NAME = 'blobs'
+MANIFESTS_DIR_NAME = 'manifests'
+
+# The gzip level used for blobs and manifests; higher levels are much slower for little gain on JSON
+COMPRESSION_LEVEL = 6
+
+# Sections smaller than this many bytes, such as a pipeline's commitId and version, are kept in the
+# manifest rather than in a blob of their own
+INLINE_SECTION_BYTES = 1024
+
+# Method that writes data to a new temporary file in the directory of the_path, fsyncs it and renames
+# it into place. Each writer uses its own temporary file, so two workers that store the same blob at
+# the same time both succeed, and a partially written file is never left behind under its real name
+def _write_file(the_path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(the_path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, the_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+# Method that parses a file from an export archive. Returns None if it is not a JSON object,
+# in which case it is stored whole
+def _parse_definition(the_content):
+    try:
+        definition = json.loads(the_content)
+    except ValueError:
+        return None
+    return definition if isinstance(definition, dict) else None
+
+# Method that returns the set of pipeline IDs and commit IDs named by a parsed file from an export archive,
+# which is empty for files that name neither, such as fragments
+def _get_owner_ids(definition):
+    if definition is None:
+        return set()
+    owner_ids = {definition.get('commitId')}
+    pipeline_config = definition.get('pipelineConfig')
+    if isinstance(pipeline_config, dict):
+        owner_ids.add(pipeline_config.get('pipelineId'))
+    owner_ids.discard(None)
+    return owner_ids
+
+# Method that returns True if the_store_dir looks like an export store
+def is_export_store(the_store_dir):
+    return os.path.isdir(os.path.join(the_store_dir, BLOBS_DIR_NAME)) and \
+           os.path.isdir(os.path.join(the_store_dir, MANIFESTS_DIR_NAME))
+
+
+# A content-addressed store of exported pipelines in the_store_dir, which is created if needed.
+# Safe to use from worker threads
+class ExportStore:
+
+    def __init__(self, the_store_dir):
+        self.path = the_store_dir
+        self.blobs_dir = os.path.join(the_store_dir, BLOBS_DIR_NAME)
+        self.manifests_dir = os.path.join(the_store_dir, MANIFESTS_DIR_NAME)
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.blobs_written = 0
+        self.blobs_reused = 0
+        self.bytes_exported = 0
+        self.bytes_written = 0
+
+    def _blob_path(self, the_hash):
+        return os.path.join(self.blobs_dir, the_hash[:2], the_hash + '.json.gz')
+
+    # Method that returns the name of a pipeline's manifest, relative to the store directory.
+    # Pipeline IDs contain a ':', which is replaced so the name is valid on every platform
+    def get_manifest_name(self, the_pipeline_id):
+        return MANIFESTS_DIR_NAME + '/' + the_pipeline_id.replace(':', '_') + '.json.gz'
+
+    # Method that stores the_content if it isn't stored already and returns its hash
+    def put_blob(self, the_content):
+        blob_hash = hashlib.sha256(the_content).hexdigest()
+        blob_path = self._blob_path(blob_hash)
+        if os.path.exists(blob_path):
+            with self.lock:
+                self.blobs_reused += 1
+            return blob_hash
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        data = gzip.compress(the_content, compresslevel=COMPRESSION_LEVEL, mtime=0)
+        _write_file(blob_path, data)
+        with self.lock:
+            self.blobs_written += 1
+            self.bytes_written += len(data)
+        return blob_hash
+
+    # Method that returns the content stored under the_hash, after checking that it still has that hash
+    def get_blob(self, the_hash):
+        with open(self._blob_path(the_hash), 'rb') as f:
+            content = gzip.decompress(f.read())
+        if hashlib.sha256(content).hexdigest() != the_hash:
+            raise ValueError(f"Blob '{the_hash}' in the store '{self.path}' is corrupt")
+        return content
+
+    # Method that stores one top-level section of a JSON object and returns its manifest entry
+    def put_section(self, the_key, the_value):
+        section = json.dumps(the_value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        if len(section) < INLINE_SECTION_BYTES:
+            return {'key': the_key, 'value': the_value}
+        return {'key': the_key, 'blob': self.put_blob(section)}
+
+    # Method that returns the content of a file listed in a manifest, joining its sections back into
+    # a JSON object if it was stored one section at a time
+    def get_member(self, the_member):
+        if 'blob' in the_member:
+            return self.get_blob(the_member['blob'])
+        sections = []
+        for section in the_member['sections']:
+            if 'blob' in section:
+                value = self.get_blob(section['blob'])
+            else:
+                value = json.dumps(section['value'], separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+            sections.append(json.dumps(section['key']).encode('utf-8') + b':' + value)
+        return b'{' + b','.join(sections) + b'}'
+
+    # Method that unpacks the export archive the_data, exported from Control Hub for the_pipelines, into the
+    # store and writes a manifest for each pipeline. The manifests are written after all of the blobs, so a
+    # manifest never refers to a blob that is not on disk. When the archive holds more than one pipeline,
+    # each pipeline's JSON file is matched to it by pipeline ID or commit ID, and files that belong to none
+    # of them, such as fragments, are listed in every pipeline's manifest
+    def add_archive(self, the_data, the_pipelines):
+        members = []
+        bytes_exported = 0
+        with zipfile.ZipFile(io.BytesIO(the_data)) as archive:
+            for member in archive.infolist():
+                if member.is_dir():
+                    continue
+                content = archive.read(member)
+                bytes_exported += len(content)
+                definition = _parse_definition(content)
+                entry = {'name': member.filename, 'size': len(content)}
+
+                # Store a JSON object one top-level section at a time, and anything else whole
+                if definition is not None:
+                    entry['sections'] = [self.put_section(key, value) for key, value in definition.items()]
+                else:
+                    entry['blob'] = self.put_blob(content)
+                members.append((entry, _get_owner_ids(definition) if len(the_pipelines) > 1 else set()))
+
+        # A file that names one of the pipelines in the archive belongs to that pipeline alone
+        batch_ids = set()
+        for pipeline in the_pipelines:
+            batch_ids.update((pipeline.pipeline_id, pipeline.commit_id))
+        exported_at = int(time.time() * 1000)
+        bytes_written = 0
+        for pipeline in the_pipelines:
+            pipeline_ids = {pipeline.pipeline_id, pipeline.commit_id}
+            manifest = {'pipeline_name': pipeline.name,
+                        'pipeline_id': pipeline.pipeline_id,
+                        'version': pipeline.version,
+                        'commit_id': pipeline.commit_id,
+                        'exported_at': exported_at,
+                        'members': [entry for entry, owner_ids in members
+                                    if not (owner_ids & batch_ids) or (owner_ids & pipeline_ids)]}
+            data = gzip.compress(json.dumps(manifest).encode('utf-8'), compresslevel=COMPRESSION_LEVEL, mtime=0)
+            _write_file(os.path.join(self.path, self.get_manifest_name(pipeline.pipeline_id)), data)
+            bytes_written += len(data)
+
+        with self.lock:
+            self.bytes_exported += bytes_exported
+            self.bytes_written += bytes_written
+
+    # Method that returns the manifests in the store, sorted by pipeline name, optionally only those with
+    # one of the_pipeline_ids or whose name matches the glob pattern the_name_pattern
+    def manifests(self, the_pipeline_ids=None, the_name_pattern=None):
+        if the_pipeline_ids:
+            names = [self.get_manifest_name(pipeline_id) for pipeline_id in the_pipeline_ids]
+        else:
+            names = [MANIFESTS_DIR_NAME + '/' + name for name in os.listdir(self.manifests_dir) if name.endswith('.json.gz')]
+        manifests = []
+        for name in names:
+            manifest_path = os.path.join(self.path, name)
+            if not os.path.isfile(manifest_path):
+                raise FileNotFoundError(f"No manifest '{name}' in the store '{self.path}'")
+            with gzip.open(manifest_path, 'rt', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if the_name_pattern is None or fnmatch.fnmatchcase(manifest['pipeline_name'], the_name_pattern):
+                manifests.append(manifest)
+        return sorted(manifests, key=lambda m: m['pipeline_name'])
+
+    # Method that writes an importable zip archive of the pipelines in the_manifests to the_output_path.
+    # A file shared by several pipelines, such as a fragment, is written once. Files with the same name
+    # but different content, such as two pipelines with the same name, get the start of a hash of their
+    # content added to their name so neither overwrites the other. Returns the number of files written
+    def build_archive(self, the_manifests, the_output_path):
+        written = {}
+        tmp_path = the_output_path + '.part'
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for manifest in the_manifests:
+                for member in manifest['members']:
+                    name = member['name']
+                    member_hash = member.get('blob') or hashlib.sha256(json.dumps(member['sections']).encode('utf-8')).hexdigest()
+                    if written.get(name) == member_hash:
+                        continue
+                    if name in written:
+                        stem, extension = os.path.splitext(name)
+                        name = f"{stem}-{member_hash[:8]}{extension}"
+                        if name in written:
+                            continue
+                    archive.writestr(name, self.get_member(member))
+                    written[name] = member_hash
+        os.replace(tmp_path, the_output_path)
+        return len(written)
+
+    # Method that prints how much the store saved during this run
+    def describe(self, log=print):
+        log(f"Stored {self.blobs_written} new sections and reused {self.blobs_reused} sections already in the store '{self.path}'")
+        log(f"Wrote {self.bytes_written / 1024 / 1024:.2f} MB for {self.bytes_exported / 1024 / 1024:.2f} MB of exported pipelines")
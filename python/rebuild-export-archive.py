@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+#################################################################
+# FILE:  rebuild-export-archive.py
+#
+# DESCRIPTION:    This script rebuilds an importable zip archive of pipelines from the export store written
+#                 by export-old-pipelines.py --store or cleanup-old-pipelines.py --store. The archive can be
+#                 imported into Control Hub like the archives written without --store.
+#
+# ARGS:           - store_dir    - The export_dir that the pipelines were exported into with --store.
+#
+#                 - output_file  - The full path to the zip file to write. Directories in the path will be
+#                                  created as needed, and if an existing file of the same name exists, it
+#                                  will be overwritten.
+#
+#                 - --pipeline-id - (Optional) Only include the pipeline with this ID. May be repeated.
+#
+#                 - --name       - (Optional) Only include pipelines whose name matches this glob pattern.
+#
+# USAGE:          $ python3 rebuild-export-archive.py <store_dir> <output_file> [--pipeline-id <id>] [--name <pattern>]
+#
+# USAGE EXAMPLE:  $ python3 rebuild-export-archive.py /Users/mark/pipelines-export /Users/mark/restore/pipelines.zip
+#
+# PREREQUISITES:
+#
+#  - Python 3.9+
+#
+#################################################################
+
+import os, sys, argparse
+from pathlib import Path
+from pipeline_cleanup.store import ExportStore, is_export_store
+
+# Method that validates the output_file command line parameter, creating its directory if needed.
+# Returns True if the output_file can be written or False otherwise
+def validate_output_file_parameter(the_output_file):
+    output_dir = Path(the_output_file).parent
+    try:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    except Exception as ex:
+        print(f"Exception when trying to create directory \'{output_dir}\': {ex}")
+        return False
+    if not os.access(output_dir, os.W_OK):
+        print(f"Error: Directory \'{output_dir}\' is not writable")
+        return False
+    return True
+
+#####################################
+# Main Program
+#####################################
+
+# Parse the command line args
+parser = argparse.ArgumentParser(prog='rebuild-export-archive.py',
+                                 epilog='Usage Example: $ python3 rebuild-export-archive.py /Users/mark/pipelines-export /Users/mark/restore/pipelines.zip')
+parser.add_argument('store_dir', help='The export_dir that the pipelines were exported into with --store')
+parser.add_argument('output_file', help='The full path to the zip file to write')
+parser.add_argument('--pipeline-id', dest='pipeline_ids', action='append', default=[],
+                    help='Only include the pipeline with this ID. May be specified more than once')
+parser.add_argument('--name', dest='name_pattern', default=None,
+                    help='Only include pipelines whose name matches this glob pattern, for example "Test*"')
+args = parser.parse_args()
+
+# Validate the store_dir parameter
+store_dir = args.store_dir
+print("---------------------------------")
+print(f"store_dir: '{store_dir}'")
+if not is_export_store(store_dir):
+    print(f"Error: \'{store_dir}\' is not an export store written with --store")
+    sys.exit(1)
+
+# Validate the output_file parameter
+output_file = args.output_file
+print("---------------------------------")
+print(f"output_file: '{output_file}'")
+if not validate_output_file_parameter(output_file):
+    sys.exit(1)
+print("---------------------------------")
+
+# Read the manifests of the pipelines to include
+store = ExportStore(store_dir)
+try:
+    manifests = store.manifests(args.pipeline_ids, args.name_pattern)
+except FileNotFoundError as e:
+    print(f"Error: {e}")
+    sys.exit(1)
+if len(manifests) == 0:
+    print('No pipelines in the store match the arguments')
+    sys.exit(1)
+
+# Write the archive
+for manifest in manifests:
+    print(f"Adding pipeline \'{manifest['pipeline_name']}\' version \'{manifest['version']}\' with pipeline ID \'{manifest['pipeline_id']}\'")
+print("---------------------------------")
+file_count = store.build_archive(manifests, output_file)
+print(f"Wrote {len(manifests)} pipelines and {file_count} files to \'{output_file}\'")
+print("---------------------------------")
+print('Done')
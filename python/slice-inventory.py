@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+#################################################################
+# FILE:  slice-inventory.py
+#
+# DESCRIPTION:    This script selects pipelines from an inventory written by get-old-pipelines.py --format inventory,
+#                 by last modified date and draft flag, without connecting to Control Hub. The inventory is memory
+#                 mapped and sorted by last modified date, so a slice only reads the rows it selects. The slice can
+#                 be written as a JSON list of pipelines or as another inventory, either of which can be passed to
+#                 export-old-pipelines.py and delete-old-pipelines.py, or just counted.
+#
+# ARGS:           - inventory_file     - An inventory written by get-old-pipelines.py --format inventory.
+#
+#                 - output_file        - (Optional) The full path to a file where the selected pipelines will be
+#                                        written. If omitted, the selected pipelines are only counted.
+#
+#                 - --modified-after   - (Optional) Only include pipelines last modified on or after this date,
+#                                        in the form yyyy-mm-dd.
+#
+#                 - --modified-before  - (Optional) Only include pipelines last modified before this date,
+#                                        in the form yyyy-mm-dd.
+#
+#                 - --drafts-only      - (Optional) Only include pipelines whose latest version is a draft,
+#                   --published-only     or only those whose latest version is published.
+#
+#                 - --format           - (Optional) 'json' (the default) or 'inventory', as for get-old-pipelines.py.
+#
+# USAGE:          $ python3 slice-inventory.py <inventory_file> [<output_file>] [options]
+#
+# USAGE EXAMPLE:  $ python3 slice-inventory.py /Users/mark/snapshots/2024-06.inv /Users/mark/old-pipelines/old_drafts.json --modified-before 2023-01-01 --drafts-only
+#
+# PREREQUISITES:
+#
+#  - Python 3.9+
+#
+#################################################################
+
+import os, sys, json, argparse
+from datetime import datetime
+from pathlib import Path
+from pipeline_cleanup.inventory import Inventory, InventoryWriter, is_inventory_file
+
+# Method to convert a yyyy-mm-dd date string to millis. Returns None if the date is not valid
+def convert_date_string_to_millis(the_date_str, the_arg_name):
+    try:
+        return int(datetime.strptime(the_date_str, "%Y-%m-%d").timestamp() * 1000)
+    except ValueError:
+        print(f"Error: The {the_arg_name} parameter \'{the_date_str}\' is not a valid date in yyyy-mm-dd format.")
+    return None
+
+# Method that validates the inventory_file command line parameter.
+# Returns True if the inventory_file exists and is an inventory or False otherwise
+def validate_inventory_file_parameter(the_inventory_file):
+    file_path = Path(the_inventory_file)
+    if not (file_path.is_file() and os.access(file_path, os.R_OK)):
+        print(f"Error: Inventory File \'{the_inventory_file}\' either does not exist or is not readable")
+        return False
+    if not is_inventory_file(the_inventory_file):
+        print(f"Error: \'{the_inventory_file}\' is not an inventory written by get-old-pipelines.py --format inventory")
+        return False
+    return True
+
+#####################################
+# Main Program
+#####################################
+
+# Parse the command line args
+parser = argparse.ArgumentParser(prog='slice-inventory.py',
+                                 epilog='Usage Example: $ python3 slice-inventory.py /Users/mark/snapshots/2024-06.inv /Users/mark/old-pipelines/old_drafts.json --modified-before 2023-01-01 --drafts-only')
+parser.add_argument('inventory_file', help='An inventory written by get-old-pipelines.py --format inventory')
+parser.add_argument('output_file', nargs='?', default=None,
+                    help='A file to write the selected pipelines to. If omitted, the selected pipelines are only counted')
+parser.add_argument('--modified-after', default=None,
+                    help='Only include pipelines last modified on or after this date, in the form yyyy-mm-dd')
+parser.add_argument('--modified-before', default=None,
+                    help='Only include pipelines last modified before this date, in the form yyyy-mm-dd')
+draft_group = parser.add_mutually_exclusive_group()
+draft_group.add_argument('--drafts-only', dest='draft', action='store_const', const=True,
+                         help='Only include pipelines whose latest version is a draft')
+draft_group.add_argument('--published-only', dest='draft', action='store_const', const=False,
+                         help='Only include pipelines whose latest version is published')
+parser.add_argument('--format', dest='output_format', choices=['json', 'inventory'], default='json',
+                    help='The format of the output file (default: json)')
+args = parser.parse_args()
+
+# Validate the parameters
+inventory_file = args.inventory_file
+print("---------------------------------")
+print(f"inventory_file: '{inventory_file}'")
+if not validate_inventory_file_parameter(inventory_file):
+    sys.exit(1)
+modified_after = None
+if args.modified_after is not None:
+    modified_after = convert_date_string_to_millis(args.modified_after, 'modified-after')
+    if modified_after is None:
+        sys.exit(1)
+    print(f"Modified on or after: '{args.modified_after}'")
+modified_before = None
+if args.modified_before is not None:
+    modified_before = convert_date_string_to_millis(args.modified_before, 'modified-before')
+    if modified_before is None:
+        sys.exit(1)
+    print(f"Modified before: '{args.modified_before}'")
+if args.draft is not None:
+    print(f"Draft filter: '{'drafts-only' if args.draft else 'published-only'}'")
+output_file = args.output_file
+if output_file is not None:
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+print("---------------------------------")
+
+# Select the pipelines
+with Inventory(inventory_file) as inventory:
+    rows = inventory.select(modified_after, modified_before, args.draft)
+    print(f"Selected {len(rows)} of the {len(inventory)} pipelines in the inventory")
+
+    # Write the selected pipelines
+    if output_file is not None:
+        pipeline_infos = inventory.pipeline_infos(rows)
+        if args.output_format == 'inventory':
+            writer = InventoryWriter()
+            for pipeline_info, millis in zip(pipeline_infos, inventory.column_values('last_modified', rows)):
+                writer.append(pipeline_info, millis)
+            writer.write(output_file)
+        else:
+            with open(output_file, 'w') as f:
+                for pipeline_info in sorted(pipeline_infos, key=lambda x: x['pipeline_name']):
+                    f.write(json.dumps(pipeline_info) + '\n')
+        print(f"Wrote the selected pipelines to \'{output_file}\'")
+print("---------------------------------")
+print('Done')